@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from dotenv import load_dotenv
+from . import metrics
+from .memory.resilience import current_deadline
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+BACKGROUND_MAX_CONCURRENCY = int(os.getenv("BACKGROUND_MAX_CONCURRENCY", "4"))
+BACKGROUND_MAX_QUEUE_PER_PROJECT = int(os.getenv("BACKGROUND_MAX_QUEUE_PER_PROJECT", "16"))
+BACKGROUND_MAX_QUEUED_JOBS = int(os.getenv("BACKGROUND_MAX_QUEUED_JOBS", "1000"))
+BACKGROUND_MAX_COALESCED = int(os.getenv("BACKGROUND_MAX_COALESCED", "8"))
+BACKGROUND_DRAIN_TIMEOUT_SECONDS = float(os.getenv("BACKGROUND_DRAIN_TIMEOUT_SECONDS", "30"))
+
+
+class _Job:
+    def __init__(self, kind, handler, payload):
+        self.kind = kind
+        self.handler = handler
+        self.payloads = [payload]
+        self.enqueued_at = time.monotonic()
+
+
+# Runs background work one job at a time per key (project), in submission order,
+# with a global cap on jobs running concurrently across all keys
+class BackgroundExecutor:
+    def __init__(self, max_concurrency: int = BACKGROUND_MAX_CONCURRENCY, max_queue_per_key: int = BACKGROUND_MAX_QUEUE_PER_PROJECT,
+                 max_queued_jobs: int = BACKGROUND_MAX_QUEUED_JOBS, max_coalesced: int = BACKGROUND_MAX_COALESCED):
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_key = max_queue_per_key
+        self.max_queued_jobs = max_queued_jobs
+        self.max_coalesced = max_coalesced
+        self._queues = {}
+        self._runners = {}
+        self._semaphore = None
+        self._running = 0
+        self._closing = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_lag_seconds = 0.0
+
+    def _queued_jobs(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, key, kind: str, handler, payload):
+        if self._closing:
+            self.shed += 1
+            logger.warning(f"Background executor is shutting down, dropping {kind} job")
+            return False
+
+        queue = self._queues.setdefault(key, deque())
+        tail = queue[-1] if queue else None
+        if tail is not None and tail.kind == kind and tail.handler is handler and len(tail.payloads) < self.max_coalesced:
+            tail.payloads.append(payload)
+            self.submitted += 1
+            self.coalesced += 1
+            logger.info(f"Coalesced {kind} job into queued job ({len(tail.payloads)} payloads)")
+            return True
+
+        if len(queue) >= self.max_queue_per_key or self._queued_jobs() >= self.max_queued_jobs:
+            self.shed += 1
+            logger.warning(f"Background queue full, shedding {kind} job (queue depth {len(queue)})")
+            if not queue:
+                del self._queues[key]
+            return False
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        queue.append(_Job(kind, handler, payload))
+        self.submitted += 1
+        if key not in self._runners:
+            self._runners[key] = asyncio.create_task(self._run_key(key))
+        return True
+
+    async def _run_key(self, key):
+        queue = self._queues[key]
+        # The runner task inherits the context of the request that started it; jobs are not part of that request
+        metrics.current_endpoint.set("background")
+        current_deadline.set(None)
+        try:
+            while queue:
+                async with self._semaphore:
+                    job = queue.popleft()
+                    self.last_lag_seconds = time.monotonic() - job.enqueued_at
+                    self._running += 1
+                    try:
+                        logger.info(f"Running {job.kind} job with {len(job.payloads)} payloads after {self.last_lag_seconds:.3f}s in queue")
+                        await job.handler(job.payloads)
+                        self.completed += 1
+                    except Exception as e:
+                        self.failed += 1
+                        logger.error(f"Background {job.kind} job failed: {e}")
+                    finally:
+                        self._running -= 1
+        finally:
+            self._runners.pop(key, None)
+            if not queue:
+                self._queues.pop(key, None)
+
+    async def drain(self, timeout: float = BACKGROUND_DRAIN_TIMEOUT_SECONDS):
+        self._closing = True
+        runners = list(self._runners.values())
+        if not runners:
+            return True
+        logger.info(f"Draining {self._queued_jobs()} queued background jobs across {len(runners)} projects")
+        done, pending = await asyncio.wait(runners, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Background drain timed out after {timeout}s, cancelled {len(pending)} project queues")
+            return False
+        logger.info("Background jobs drained")
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        oldest = min((queue[0].enqueued_at for queue in self._queues.values() if queue), default=None)
+        return {
+            "queued_jobs": self._queued_jobs(),
+            "queued_payloads": sum(len(job.payloads) for queue in self._queues.values() for job in queue),
+            "max_queue_depth": max((len(queue) for queue in self._queues.values()), default=0),
+            "active_projects": len(self._runners),
+            "running": self._running,
+            "oldest_queued_seconds": now - oldest if oldest is not None else 0.0,
+            "last_lag_seconds": self.last_lag_seconds,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "shed": self.shed,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# Collects items per key and hands them to the executor as a single job once max_items have
+# built up or max_delay seconds have passed since the first one, whichever comes first
+class Debouncer:
+    def __init__(self, executor: BackgroundExecutor, kind: str, handler, max_items: int, max_delay: float):
+        self.executor = executor
+        self.kind = kind
+        self.handler = handler
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self._pending = {}
+        self.flushes = 0
+
+    def add(self, key, items, context):
+        if not items:
+            return
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {"items": [], "context": context, "timer": None}
+            pending["timer"] = asyncio.get_running_loop().call_later(self.max_delay, self.flush, key)
+        pending["items"].extend(items)
+        pending["context"] = context
+        if len(pending["items"]) >= self.max_items:
+            self.flush(key)
+
+    def flush(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        pending["timer"].cancel()
+        self.flushes += 1
+        logger.info(f"Submitting {self.kind} job for {len(pending['items'])} items")
+        self.executor.submit(key, self.kind, self.handler, {**pending["context"], "items": pending["items"]})
+
+    def flush_all(self):
+        for key in list(self._pending):
+            self.flush(key)
+
+    def stats(self):
+        return {
+            "pending_keys": len(self._pending),
+            "pending_items": sum(len(pending["items"]) for pending in self._pending.values()),
+            "flushes": self.flushes
+        }
+
+
+background_executor = BackgroundExecutor()
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import math
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MAX_MESSAGE_TOKENS", "200"))
+CONTEXT_SUMMARY_SHARE = float(os.getenv("CONTEXT_SUMMARY_SHARE", "0.3"))
+CONTEXT_RECENCY_WEIGHT = float(os.getenv("CONTEXT_RECENCY_WEIGHT", "0.2"))
+CONTEXT_RECENCY_HALF_LIFE_DAYS = float(os.getenv("CONTEXT_RECENCY_HALF_LIFE_DAYS", "30"))
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.8"))
+CONTEXT_FORMATS = ("text", "json")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Without tiktoken, roughly four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def truncate_tokens(text: str, max_tokens: int):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max(1, max_tokens - 1)]) + "…"
+    return text[:max(1, max_tokens - 1) * 4] + "…"
+
+
+def _words(text: str):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def _age_days(created_at, now: datetime):
+    try:
+        created = created_at if isinstance(created_at, datetime) else datetime.fromisoformat(created_at)
+        return max(0.0, (now - created.replace(tzinfo=None)).total_seconds() / 86400)
+    except (TypeError, ValueError):
+        return None
+
+
+def rank_facts(facts: List[Dict], now: Optional[datetime] = None):
+    # Similarity to the question blended with an exponential recency decay; facts without a
+    # timestamp get no recency credit. Ties keep retrieval order.
+    now = now or datetime.now()
+    ranked = []
+    for position, fact in enumerate(facts):
+        age = _age_days(fact.get("created_at"), now)
+        recency = 0.5 ** (age / CONTEXT_RECENCY_HALF_LIFE_DAYS) if age is not None else 0.0
+        score = fact.get("score")
+        similarity = score if score is not None else 0.0
+        rank = (1 - CONTEXT_RECENCY_WEIGHT) * similarity + CONTEXT_RECENCY_WEIGHT * recency
+        ranked.append((-rank, position, fact))
+    return [fact for _, _, fact in sorted(ranked, key=lambda item: item[:2])]
+
+
+def collapse_duplicates(facts: List[Dict], threshold: float = CONTEXT_DUPLICATE_SIMILARITY):
+    # Drops facts whose word sets overlap (Jaccard) an already kept, higher-ranked fact by at least threshold
+    kept, kept_words = [], []
+    for fact in facts:
+        words = _words(fact["fact_text"])
+        if any(words and len(words & other) / len(words | other) >= threshold for other in kept_words):
+            continue
+        kept.append(fact)
+        kept_words.append(words)
+    return kept
+
+
+def _format_fact(fact: Dict):
+    created_at = fact.get("created_at")
+    return f"- {fact['fact_text']} ({str(created_at)[:10]})" if created_at else f"- {fact['fact_text']}"
+
+
+def _format_chat(chat: Dict):
+    return f"user: {chat.get('user', '')}\nassistant: {chat.get('assistant', '')}"
+
+
+def _render_text(summary: str, chats: List[Dict], facts: List[Dict]):
+    sections = []
+    if summary:
+        sections.append(f"Summary:\n{summary}")
+    if chats:
+        sections.append("Recent chats:\n" + "\n".join(_format_chat(chat) for chat in chats))
+    if facts:
+        sections.append("Relevant facts:\n" + "\n".join(_format_fact(fact) for fact in facts))
+    return "\n\n".join(sections)
+
+
+def _render_json(summary: str, chats: List[Dict], facts: List[Dict]):
+    return json.dumps({
+        "summary": summary,
+        "recent_chats": chats,
+        "facts": [{"fact": fact["fact_text"], "created_at": fact.get("created_at")} for fact in facts]
+    }, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# Fits the summary, recent chats and retrieved facts into token_budget. The newest chat goes in
+# first, then the summary (capped at CONTEXT_SUMMARY_SHARE of the budget), then facts best-ranked
+# first, then older chats newest first; each chat message is capped at CONTEXT_MAX_MESSAGE_TOKENS.
+# Returns {"context": str, "tokens": int, "facts": int, "dropped_facts": int}.
+def build_context(recent_chats: List[Dict], summary: str, facts: List[Dict],
+                  token_budget: Optional[int] = None, output_format: str = "text"):
+    if output_format not in CONTEXT_FORMATS:
+        raise ValueError(f"Unknown context format: {output_format}")
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    render = _render_text if output_format == "text" else _render_json
+
+    chats = [
+        {
+            "user": truncate_tokens(chat.get("user", ""), CONTEXT_MAX_MESSAGE_TOKENS),
+            "assistant": truncate_tokens(chat.get("assistant", ""), CONTEXT_MAX_MESSAGE_TOKENS)
+        }
+        for chat in recent_chats or []
+    ]
+    ranked_facts = collapse_duplicates(rank_facts(facts or []))
+
+    chosen_chats = []
+    chosen_facts = []
+    chosen_summary = ""
+
+    def fits():
+        return count_tokens(render(chosen_summary, chosen_chats, chosen_facts)) <= token_budget
+
+    if chats:
+        chosen_chats.append(chats[-1])
+        if not fits():
+            chosen_chats.pop()
+
+    if summary:
+        chosen_summary = truncate_tokens(summary, int(token_budget * CONTEXT_SUMMARY_SHARE))
+        if not fits():
+            chosen_summary = ""
+
+    for fact in ranked_facts:
+        chosen_facts.append(fact)
+        if not fits():
+            chosen_facts.pop()
+
+    for chat in reversed(chats[:-1]):
+        chosen_chats.insert(0, chat)
+        if not fits():
+            chosen_chats.pop(0)
+            break
+
+    context = render(chosen_summary, chosen_chats, chosen_facts)
+    tokens = count_tokens(context)
+    logger.info(f"Built {output_format} context with {len(chosen_facts)} of {len(ranked_facts)} facts in {tokens} tokens")
+    return {
+        "context": context,
+        "tokens": tokens,
+        "facts": len(chosen_facts),
+        "dropped_facts": len(facts or []) - len(chosen_facts)
+    }
@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+from typing import Optional
+from dotenv import load_dotenv
+from .models import add_chats, add_memories, validate_content
+from .utils import index_strands
+from .memory.llm_utils import LLMUtils
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", "65536"))
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+
+
+async def iter_ndjson_lines(chunks):
+    # Yields (line number, raw line) from a byte stream without holding more than one line in memory;
+    # a line longer than BULK_MAX_LINE_BYTES is yielded as None and the rest of it is skipped
+    buffer = b""
+    line_number = 0
+    skipping = False
+    async for chunk in chunks:
+        # Each chunk is split once; only its trailing partial line is carried over to the next one
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if skipping:
+                skipping = False
+                continue
+            if len(line) > BULK_MAX_LINE_BYTES:
+                yield line_number, None
+            elif line.strip():
+                yield line_number, line
+        if len(buffer) > BULK_MAX_LINE_BYTES and not skipping:
+            yield line_number + 1, None
+            skipping = True
+        if skipping:
+            buffer = b""
+    if buffer.strip() and not skipping:
+        yield line_number + 1, buffer
+
+
+def parse_chat_row(row):
+    user_msg = row.get("user_message", row.get("user"))
+    assistant_msg = row.get("assistant_message", row.get("assistant"))
+    if not validate_content(user_msg):
+        return None, "User message must be a non-empty string with max 10000 characters"
+    if not validate_content(assistant_msg):
+        return None, "Assistant message must be a non-empty string with max 10000 characters"
+    return {"user": user_msg, "assistant": assistant_msg}, None
+
+
+def parse_memory_row(row):
+    content = row.get("memory_strand", row.get("content"))
+    if not validate_content(content):
+        return None, "Content must be a non-empty string with max 10000 characters"
+    return content.strip(), None
+
+
+# Raised by a write_batch whose rows were stored but not made searchable. Sending those rows again
+# would store them twice, so they are reported as inserted and not_indexed rather than as failed.
+class NotIndexedError(Exception):
+    def __init__(self, inserted: int, error: Exception):
+        super().__init__(str(error))
+        self.inserted = inserted
+
+
+async def bulk_ingest(chunks, parse_row, write_batch, batch_size: int = BULK_BATCH_SIZE):
+    report = {"rows": 0, "inserted": 0, "failed": 0, "not_indexed": 0, "batches": 0, "errors": []}
+    batch = []
+    problems = 0
+
+    def note(line_number, error):
+        nonlocal problems
+        problems += 1
+        if len(report["errors"]) < BULK_MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "error": error})
+
+    def fail(line_number, error):
+        report["failed"] += 1
+        note(line_number, error)
+
+    async def flush():
+        if not batch:
+            return
+        try:
+            report["inserted"] += await write_batch([item for _, item in batch])
+        except NotIndexedError as e:
+            logger.error(f"Stored a batch of {len(batch)} rows but failed to index it: {e}")
+            report["inserted"] += e.inserted
+            report["not_indexed"] += e.inserted
+            for line_number, _ in batch:
+                note(line_number, f"Stored but not indexed: {e}")
+        except Exception as e:
+            logger.error(f"Failed to write batch of {len(batch)} rows: {e}")
+            for line_number, _ in batch:
+                fail(line_number, f"Batch write failed: {e}")
+        report["batches"] += 1
+        logger.info(f"Bulk ingest progress: {report['rows']} rows read, {report['inserted']} inserted, {report['failed']} failed")
+        batch.clear()
+
+    async for line_number, line in iter_ndjson_lines(chunks):
+        report["rows"] += 1
+        if line is None:
+            fail(line_number, f"Line exceeds {BULK_MAX_LINE_BYTES} bytes")
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            fail(line_number, f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            fail(line_number, "Each line must be a JSON object")
+            continue
+        item, error = parse_row(row)
+        if error:
+            fail(line_number, error)
+            continue
+        batch.append((line_number, item))
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+    report["errors_truncated"] = problems > len(report["errors"])
+    return report
+
+
+async def ingest_chats(api_key: str, project_name: str, chunks):
+    async def write_batch(chat_pairs):
+        result = await add_chats(api_key, project_name, chat_pairs)
+        if "error" in result:
+            raise Exception(result["error"])
+        return len(result["inserted_ids"])
+
+    logger.info(f"Starting bulk chat ingest for project: {project_name}")
+    return await bulk_ingest(chunks, parse_chat_row, write_batch)
+
+
+async def ingest_memories(api_key: str, project_name: str, chunks, openai_key: Optional[str] = None):
+    llm = LLMUtils(api_key=openai_key) if openai_key else None
+
+    async def write_batch(strands):
+        result = await add_memories(api_key, project_name, strands)
+        if "error" in result:
+            raise Exception(result["error"])
+        if llm is not None:
+            try:
+                embeddings = await llm.embed_batch(strands)
+                await index_strands(strands, project_name, embeddings, result["inserted_ids"])
+            except Exception as e:
+                raise NotIndexedError(len(result["inserted_ids"]), e) from e
+        return len(result["inserted_ids"])
+
+    logger.info(f"Starting bulk memory ingest for project: {project_name}")
+    report = await bulk_ingest(chunks, parse_memory_row, write_batch)
+    report["vectors_upserted"] = llm is not None
+    return report
@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import logging
+from contextlib import closing
+from typing import Dict, List
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "inline" runs background updates on the API process's BackgroundExecutor; "queue" stores them as
+# durable jobs that `python -m backend.worker` processes, on any number of machines
+BACKGROUND_MODES = ("inline", "queue")
+BACKGROUND_MODE = os.getenv("BACKGROUND_MODE", "inline")
+if BACKGROUND_MODE not in BACKGROUND_MODES:
+    raise ValueError(f"Unknown BACKGROUND_MODE: {BACKGROUND_MODE}")
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "mongo")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "reca11_jobs.db")
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "5"))
+JOB_MAX_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_MAX_RETRY_BACKOFF_SECONDS", "300"))
+JOB_MAX_COALESCED = int(os.getenv("JOB_MAX_COALESCED", os.getenv("BACKGROUND_MAX_COALESCED", "8")))
+JOB_LEASE_SCAN = int(os.getenv("JOB_LEASE_SCAN", "50"))
+JOB_ENQUEUE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("JOB_ENQUEUE_DRAIN_TIMEOUT_SECONDS", "10"))
+# Fernet keys (comma separated, newest first) that encrypt the secrets in job payloads, so the jobs
+# collection or file never holds a caller's OpenAI key in plaintext. Create one with
+# python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+JOB_PAYLOAD_KEY = os.getenv("JOB_PAYLOAD_KEY", "")
+JOB_SECRET_FIELDS = ("openai_key",)
+
+
+def key_string(key):
+    return "|".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+
+def retry_delay(attempts: int):
+    delay = min(JOB_MAX_RETRY_BACKOFF_SECONDS, JOB_RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)))
+    return random.uniform(delay / 2, delay)
+
+
+# Encrypts the secret fields of a payload before it is stored and decrypts them once a worker runs it.
+# Older keys stay listed in JOB_PAYLOAD_KEY until the jobs sealed with them have drained.
+class PayloadCipher:
+    def __init__(self, keys: str = JOB_PAYLOAD_KEY):
+        try:
+            from cryptography.fernet import Fernet, MultiFernet
+        except ImportError as e:
+            raise ImportError('BACKGROUND_MODE=queue needs cryptography: pip install "reca11-memory[queue]"') from e
+        keys = [key.strip() for key in keys.split(",") if key.strip()]
+        if not keys:
+            raise ValueError("JOB_PAYLOAD_KEY must be set to a Fernet key to queue jobs")
+        self.fernet = MultiFernet([Fernet(key) for key in keys])
+
+    def seal(self, payload: Dict):
+        return {
+            field: self.fernet.encrypt(value.encode()).decode() if field in JOB_SECRET_FIELDS and value else value
+            for field, value in payload.items()
+        }
+
+    def open(self, payload: Dict):
+        return {
+            field: self.fernet.decrypt(value.encode()).decode() if field in JOB_SECRET_FIELDS and value else value
+            for field, value in payload.items()
+        }
+
+
+# One or more queued jobs of the same kind and key, leased together so their payloads run as one
+# handler call (as the in-process executor coalesces them). lease_token proves the lease is still ours.
+class Job:
+    def __init__(self, ids: List, kind: str, key: str, payloads: List[Dict], attempts: List[int], lease_token: str):
+        self.ids = ids
+        self.kind = kind
+        self.key = key
+        self.payloads = payloads
+        self.attempts = attempts
+        self.lease_token = lease_token
+
+    def subset(self, indexes: List[int]):
+        return Job(
+            [self.ids[i] for i in indexes], self.kind, self.key, [self.payloads[i] for i in indexes],
+            [self.attempts[i] for i in indexes], self.lease_token
+        )
+
+
+# Raised by a handler when only some of its payloads failed (after the others were handled), so
+# the worker retries just those instead of the whole coalesced batch
+class PayloadsFailed(Exception):
+    def __init__(self, indexes: List[int], error: str):
+        super().__init__(error)
+        self.indexes = indexes
+
+
+# Interface for durable job queues. A lease hides jobs from other workers until it expires
+# (the visibility timeout), so jobs held by a worker that died are picked up again; at most one
+# lease per key is live at a time, which keeps a project's updates from racing each other.
+class JobQueue:
+    def __init__(self):
+        self.cipher = PayloadCipher()
+
+    async def setup(self):
+        pass
+
+    async def enqueue(self, kind: str, key, payload: Dict):
+        raise NotImplementedError
+
+    async def lease(self, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        raise NotImplementedError
+
+    async def extend(self, job: Job, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        raise NotImplementedError
+
+    async def ack(self, job: Job):
+        raise NotImplementedError
+
+    async def fail(self, job: Job, error: str, max_attempts: int = JOB_MAX_ATTEMPTS):
+        # Requeues the job with backoff, or marks it dead once it has used max_attempts
+        raise NotImplementedError
+
+    async def counts(self):
+        raise NotImplementedError
+
+
+class MongoJobQueue(JobQueue):
+    def __init__(self):
+        super().__init__()
+        from .models import jobs_col, job_locks_col
+        self.jobs = jobs_col
+        self.locks = job_locks_col
+
+    @staticmethod
+    def _available(now: float):
+        return {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "leased", "lease_expires_at": {"$lt": now}}
+        ]}
+
+    async def setup(self):
+        await self.jobs.create_index([("status", 1), ("available_at", 1)])
+        await self.jobs.create_index([("key", 1), ("kind", 1), ("status", 1)])
+
+    async def enqueue(self, kind: str, key, payload: Dict):
+        now = time.time()
+        await self.jobs.insert_one({
+            "kind": kind, "key": key_string(key), "payload": self.cipher.seal(payload), "status": "queued",
+            "attempts": 0, "available_at": now, "created_at": now
+        })
+
+    async def _lock(self, key: str, token: str, now: float, visibility_timeout: float):
+        from pymongo.errors import DuplicateKeyError
+        try:
+            await self.locks.insert_one({"_id": key, "token": token, "expires_at": now + visibility_timeout})
+            return True
+        except DuplicateKeyError:
+            result = await self.locks.update_one(
+                {"_id": key, "expires_at": {"$lt": now}},
+                {"$set": {"token": token, "expires_at": now + visibility_timeout}}
+            )
+            return result.modified_count == 1
+
+    async def _unlock(self, key: str, token: str):
+        await self.locks.delete_one({"_id": key, "token": token})
+
+    async def lease(self, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        from pymongo import ReturnDocument
+        now = time.time()
+        candidates = await self.jobs.find(self._available(now), {"key": 1}).sort("available_at", 1).limit(JOB_LEASE_SCAN).to_list()
+        for key in dict.fromkeys(candidate["key"] for candidate in candidates):
+            token = uuid.uuid4().hex
+            if not await self._lock(key, token, now, visibility_timeout):
+                continue
+            claimed = []
+            while len(claimed) < JOB_MAX_COALESCED:
+                query = {**self._available(now), "key": key}
+                if claimed:
+                    query["kind"] = claimed[0]["kind"]
+                doc = await self.jobs.find_one_and_update(
+                    query,
+                    {
+                        "$set": {"status": "leased", "lease_owner": worker_id, "lease_token": token, "lease_expires_at": now + visibility_timeout},
+                        "$inc": {"attempts": 1}
+                    },
+                    sort=[("available_at", 1)],
+                    return_document=ReturnDocument.AFTER
+                )
+                if doc is None:
+                    break
+                claimed.append(doc)
+            if claimed:
+                return Job(
+                    [doc["_id"] for doc in claimed], claimed[0]["kind"], key, [doc["payload"] for doc in claimed],
+                    [doc["attempts"] for doc in claimed], token
+                )
+            await self._unlock(key, token)
+        return None
+
+    async def extend(self, job: Job, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        expires_at = time.time() + visibility_timeout
+        result = await self.jobs.update_many(
+            {"_id": {"$in": job.ids}, "lease_token": job.lease_token}, {"$set": {"lease_expires_at": expires_at}}
+        )
+        await self.locks.update_one({"_id": job.key, "token": job.lease_token}, {"$set": {"expires_at": expires_at}})
+        return result.modified_count == len(job.ids)
+
+    async def ack(self, job: Job):
+        await self.jobs.delete_many({"_id": {"$in": job.ids}, "lease_token": job.lease_token})
+        await self._unlock(job.key, job.lease_token)
+
+    async def fail(self, job: Job, error: str, max_attempts: int = JOB_MAX_ATTEMPTS):
+        now = time.time()
+        for job_id, attempts in zip(job.ids, job.attempts):
+            owned = {"_id": job_id, "lease_token": job.lease_token}
+            unset = {"lease_owner": "", "lease_token": "", "lease_expires_at": ""}
+            if attempts >= max_attempts:
+                await self.jobs.update_one(owned, {"$set": {"status": "dead", "last_error": error}, "$unset": unset})
+            else:
+                await self.jobs.update_one(
+                    owned, {"$set": {"status": "queued", "available_at": now + retry_delay(attempts), "last_error": error}, "$unset": unset}
+                )
+        await self._unlock(job.key, job.lease_token)
+
+    async def counts(self):
+        rows = await (await self.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])).to_list()
+        return {row["_id"]: row["count"] for row in rows}
+
+
+# Single-machine queue in a SQLite file, for running without Mongo. Every operation runs in its own
+# immediate transaction, so worker processes on the same machine can share the file.
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        super().__init__()
+        self.path = path
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _transaction(self, fn, *args):
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(connection, *args)
+                connection.execute("COMMIT")
+                return result
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._transaction, fn, *args)
+
+    @staticmethod
+    def _create(connection):
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_token TEXT,
+                lease_expires_at REAL,
+                last_error TEXT
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_available ON jobs (status, available_at)")
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, kind, status)")
+
+    async def setup(self):
+        # WAL lets readers carry on while a worker holds the write lock
+        def enable_wal():
+            with closing(self._connect()) as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+
+        await asyncio.to_thread(enable_wal)
+        await self._run(self._create)
+
+    async def enqueue(self, kind: str, key, payload: Dict):
+        now = time.time()
+        await self._run(lambda connection: connection.execute(
+            "INSERT INTO jobs (kind, key, payload, status, available_at, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (kind, key_string(key), json.dumps(self.cipher.seal(payload), default=str), now, now)
+        ))
+
+    @staticmethod
+    def _lease(connection, worker_id: str, visibility_timeout: float):
+        now = time.time()
+        available = "((status = 'queued' AND available_at <= :now) OR (status = 'leased' AND lease_expires_at < :now))"
+        first = connection.execute(f"""
+            SELECT kind, key FROM jobs AS job WHERE {available}
+            AND NOT EXISTS (
+                SELECT 1 FROM jobs AS other
+                WHERE other.key = job.key AND other.status = 'leased' AND other.lease_expires_at >= :now
+            )
+            ORDER BY available_at, id LIMIT 1
+        """, {"now": now}).fetchone()
+        if first is None:
+            return None
+        rows = connection.execute(f"""
+            SELECT id, payload, attempts FROM jobs WHERE {available} AND key = :key AND kind = :kind
+            ORDER BY available_at, id LIMIT :limit
+        """, {"now": now, "key": first["key"], "kind": first["kind"], "limit": JOB_MAX_COALESCED}).fetchall()
+        token = uuid.uuid4().hex
+        ids = [row["id"] for row in rows]
+        connection.execute(
+            f"UPDATE jobs SET status = 'leased', lease_owner = ?, lease_token = ?, lease_expires_at = ?, attempts = attempts + 1 "
+            f"WHERE id IN ({', '.join('?' * len(ids))})",
+            (worker_id, token, now + visibility_timeout, *ids)
+        )
+        return Job(ids, first["kind"], first["key"], [json.loads(row["payload"]) for row in rows], [row["attempts"] + 1 for row in rows], token)
+
+    async def lease(self, worker_id: str, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        return await self._run(self._lease, worker_id, visibility_timeout)
+
+    async def extend(self, job: Job, visibility_timeout: float = JOB_VISIBILITY_TIMEOUT_SECONDS):
+        placeholders = ", ".join("?" * len(job.ids))
+        cursor = await self._run(lambda connection: connection.execute(
+            f"UPDATE jobs SET lease_expires_at = ? WHERE lease_token = ? AND id IN ({placeholders})",
+            (time.time() + visibility_timeout, job.lease_token, *job.ids)
+        ))
+        return cursor.rowcount == len(job.ids)
+
+    async def ack(self, job: Job):
+        placeholders = ", ".join("?" * len(job.ids))
+        await self._run(lambda connection: connection.execute(
+            f"DELETE FROM jobs WHERE lease_token = ? AND id IN ({placeholders})", (job.lease_token, *job.ids)
+        ))
+
+    async def fail(self, job: Job, error: str, max_attempts: int = JOB_MAX_ATTEMPTS):
+        now = time.time()
+
+        def fail_jobs(connection):
+            for job_id, attempts in zip(job.ids, job.attempts):
+                if attempts >= max_attempts:
+                    status, available_at = "dead", now
+                else:
+                    status, available_at = "queued", now + retry_delay(attempts)
+                connection.execute(
+                    "UPDATE jobs SET status = ?, available_at = ?, last_error = ?, lease_owner = NULL, lease_token = NULL, "
+                    "lease_expires_at = NULL WHERE id = ? AND lease_token = ?",
+                    (status, available_at, error, job_id, job.lease_token)
+                )
+
+        await self._run(fail_jobs)
+
+    async def counts(self):
+        rows = await self._run(lambda connection: connection.execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        ).fetchall())
+        return {row["status"]: row["count"] for row in rows}
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        if JOB_QUEUE_BACKEND == "mongo":
+            _job_queue = MongoJobQueue()
+        elif JOB_QUEUE_BACKEND == "sqlite":
+            _job_queue = SQLiteJobQueue()
+        else:
+            raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {JOB_QUEUE_BACKEND}")
+    return _job_queue
+
+
+# Stands in for BackgroundExecutor when BACKGROUND_MODE is "queue": submit() keeps its synchronous
+# signature and writes the job in a task, and drain() waits for writes still in flight
+class JobSubmitter:
+    def __init__(self, queue_factory=get_job_queue):
+        self.queue_factory = queue_factory
+        self._tasks = set()
+        self.submitted = 0
+        self.failed = 0
+
+    async def _enqueue(self, kind: str, key, payload: Dict):
+        try:
+            await self.queue_factory().enqueue(kind, key, payload)
+            self.submitted += 1
+            logger.info(f"Queued durable {kind} job")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Failed to queue {kind} job: {e}")
+
+    def submit(self, key, kind: str, handler, payload: Dict):
+        # handler is resolved by kind in the worker
+        task = asyncio.get_running_loop().create_task(self._enqueue(kind, key, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def drain(self, timeout: float = JOB_ENQUEUE_DRAIN_TIMEOUT_SECONDS):
+        if not self._tasks:
+            return True
+        done, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} job writes did not finish within {timeout}s")
+            return False
+        return True
+
+    def stats(self):
+        return {"submitted": self.submitted, "failed": self.failed, "pending_writes": len(self._tasks)}
@@ -1,13 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 from .routes import router
+from .models import ensure_indexes
+from .background import background_executor
+from .utils import summary_debouncer, background_submitter
+from .jobs import BACKGROUND_MODE, get_job_queue
+from .memory.client_pool import openai_client_pool
+from .metrics import MetricsMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    if BACKGROUND_MODE == "queue":
+        await get_job_queue().setup()
+    yield
+    summary_debouncer.flush_all()
+    await background_submitter.drain()
+    await background_executor.drain()
+    await openai_client_pool.aclose()
+
 
 limiter = Limiter(key_func=get_remote_address)
 app = FastAPI(
-    title="Reca11 Memory API", description="A lightweight open-source memory layer for LLMs.")
+    title="Reca11 Memory API", description="A lightweight open-source memory layer for LLMs.", lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -19,5 +39,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware, paths=[route.path for route in router.routes])
+
 app.include_router(router)
 
@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+OPENAI_POOL_MAX_SIZE = int(os.getenv("OPENAI_POOL_MAX_SIZE", "256"))
+OPENAI_POOL_IDLE_SECONDS = float(os.getenv("OPENAI_POOL_IDLE_SECONDS", "600"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+
+
+def _key_hash(api_key: str):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# Process-wide AsyncOpenAI clients keyed by a hash of the caller's key. All clients share
+# one keep-alive HTTP connection pool, so a tenant's repeated recalls reuse warm connections.
+class OpenAIClientPool:
+    def __init__(self, max_size: int = OPENAI_POOL_MAX_SIZE, idle_seconds: float = OPENAI_POOL_IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._clients = OrderedDict()
+        self._http_client = None
+        self._loop = None
+        self._closing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _shared_http_client(self):
+        # httpx connection pools are bound to the event loop that opened them
+        loop = _running_loop()
+        if self._http_client is None or loop is not self._loop:
+            if self._http_client is not None:
+                logger.info("Event loop changed, starting a fresh OpenAI connection pool")
+                self._clients.clear()
+                self._close_stale(self._http_client, self._loop, loop)
+            self._http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS
+                ),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._loop = loop
+        return self._http_client
+
+    @staticmethod
+    async def _aclose_quietly(http_client):
+        try:
+            await http_client.aclose()
+        except Exception as e:
+            logger.debug(f"Failed to close a stale OpenAI connection pool: {e}")
+
+    def _close_stale(self, http_client, old_loop, loop):
+        # The pool's connections belong to the loop that opened them, so it is closed there while that
+        # loop still runs; once it has stopped, closing from the current loop releases the sockets
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._aclose_quietly(http_client), old_loop)
+        elif loop is not None:
+            task = loop.create_task(self._aclose_quietly(http_client))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self._clients[key]
+            self.evictions += 1
+
+    def get(self, api_key: str):
+        key = _key_hash(api_key)
+        now = time.monotonic()
+        with self._lock:
+            http_client = self._shared_http_client()
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            # Retries are made by the resilience layer, which knows the request's deadline
+            client = AsyncOpenAI(
+                api_key=api_key,
+                http_client=http_client,
+                max_retries=0,
+                timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._clients[key] = [client, now]
+            self.misses += 1
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+    async def aclose(self):
+        with self._lock:
+            http_client = self._http_client
+            self._clients.clear()
+            self._http_client = None
+            self._loop = None
+        if http_client is not None:
+            await http_client.aclose()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+openai_client_pool = OpenAIClientPool()
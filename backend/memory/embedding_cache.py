@@ -0,0 +1,162 @@
+import os
+import asyncio
+import logging
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+EMBEDDING_CACHE_DISK_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ROWS", "200000"))
+# Keys per disk tier query; SQLite limits the number of bound parameters
+DISK_BATCH_SIZE = 500
+
+
+def normalize_text(text: str):
+    return " ".join(text.split())
+
+
+def cache_key(model: str, text: str):
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+# In-process LRU of embeddings with an optional SQLite tier that worker processes can share.
+# The disk tier is only touched from worker threads, so a slow disk never stalls the event loop.
+# The LRU is bounded by entry count and by the bytes of its vectors, which it keeps as packed
+# doubles; the disk tier keeps the disk_max_rows most recently written rows.
+class EmbeddingCache:
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, path: Optional[str] = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, disk_max_rows: int = EMBEDDING_CACHE_DISK_MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_max_rows = disk_max_rows
+        self.path = path
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open_disk_tier(path)
+
+    def _open_disk_tier(self, path: str):
+        try:
+            self._db = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+            logger.info(f"Embedding cache disk tier opened at {path}")
+        except Exception as e:
+            logger.error(f"Failed to open embedding cache at {path}, continuing without disk tier: {e}")
+            self._db = None
+
+    def _remember(self, key: str, vector: array):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous) * previous.itemsize
+        self._entries[key] = vector
+        self._bytes += len(vector) * vector.itemsize
+        while len(self._entries) > self.max_entries or (self._bytes > self.max_bytes and len(self._entries) > 1):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted) * evicted.itemsize
+
+    def _read_disk(self, keys: List[str]):
+        rows = {}
+        with self._db_lock:
+            for start in range(0, len(keys), DISK_BATCH_SIZE):
+                chunk = keys[start:start + DISK_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows.update(self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall())
+        return {key: array("d", blob) for key, blob in rows.items()}
+
+    def _write_disk(self, rows: List[tuple]):
+        # INSERT OR REPLACE gives every written row a rowid above all others, so the rows more than
+        # disk_max_rows below the newest are the oldest written and are pruned in the same transaction
+        with self._db_lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?", (self.disk_max_rows,)
+                )
+
+    async def get_many(self, model: str, texts: List[str]):
+        # Returns a vector or None per text. Memory hits are answered on the event loop; the disk tier
+        # is read in one query per DISK_BATCH_SIZE keys on a worker thread
+        keys = [cache_key(model, text) for text in texts]
+        vectors = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    vectors[i] = vector.tolist()
+                else:
+                    missing.append(i)
+        if not missing:
+            return vectors
+
+        found = {}
+        if self._db is not None:
+            try:
+                found = await asyncio.to_thread(self._read_disk, list({keys[i] for i in missing}))
+            except Exception as e:
+                logger.warning(f"Embedding cache disk read failed: {e}")
+        with self._lock:
+            for i in missing:
+                vector = found.get(keys[i])
+                if vector is None:
+                    self.misses += 1
+                    continue
+                self._remember(keys[i], vector)
+                self.hits += 1
+                self.disk_hits += 1
+                vectors[i] = vector.tolist()
+        return vectors
+
+    async def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        # Stores every vector in memory and writes them to the disk tier in one transaction
+        keys = [cache_key(model, text) for text in texts]
+        packed = [array("d", vector) for vector in vectors]
+        with self._lock:
+            for key, vector in zip(keys, packed):
+                self._remember(key, vector)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._write_disk, [(key, vector.tobytes()) for key, vector in zip(keys, packed)])
+            except Exception as e:
+                logger.warning(f"Embedding cache disk write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_tier": self._db is not None,
+                "disk_max_rows": self.disk_max_rows
+            }
+
+
+embedding_cache = EmbeddingCache()
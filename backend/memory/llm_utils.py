@@ -1,34 +1,118 @@
-from openai import OpenAI
+import os
 import ast
+import json
+from typing import List
+from .embedding_cache import embedding_cache, cache_key
+from .client_pool import openai_client_pool, OPENAI_TIMEOUT_SECONDS
+from .resilience import call, UpstreamError
+from .. import metrics
+
+CHAT_MODEL = "gpt-4.1-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Sends a duplicate embedding request when the first has not answered after this long (0 disables)
+HEDGE_EMBED_AFTER_MS = float(os.getenv("HEDGE_EMBED_AFTER_MS", "0"))
 
 class LLMUtils:
     def __init__(self, api_key):
         self.api_key = api_key
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = openai_client_pool.get(self.api_key)
 
-    def get_response(self, user_input: str, system_prompt: str, ast_parse_response: bool = False):
+    async def get_response(self, user_input: str, system_prompt: str, ast_parse_response: bool = False):
+        caller = metrics.current_stage.get()
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ],
-            )
+            with metrics.track("llm.chat"):
+                response = await call("openai.chat", lambda: self.client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_input}
+                    ],
+                ), OPENAI_TIMEOUT_SECONDS)
+            metrics.record_llm_call(caller, CHAT_MODEL, response.usage)
             content = response.choices[0].message.content
             if ast_parse_response:
                 return ast.literal_eval(content)
             return content
+        except UpstreamError:
+            raise
         except Exception as e:
             raise RuntimeError(f"Error getting response: {e}")
             
     
-    def embed(self, text: str):
+    # Asks for a reply matching a JSON schema (OpenAI structured outputs) and returns it parsed
+    async def get_structured_response(self, system_prompt: str, user_input: str, schema: dict, name: str):
+        caller = metrics.current_stage.get()
+        try:
+            with metrics.track("llm.chat"):
+                response = await call("openai.chat", lambda: self.client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_input}
+                    ],
+                    response_format={
+                        "type": "json_schema",
+                        "json_schema": {"name": name, "strict": True, "schema": schema}
+                    },
+                ), OPENAI_TIMEOUT_SECONDS)
+            metrics.record_llm_call(caller, CHAT_MODEL, response.usage)
+            message = response.choices[0].message
+            if getattr(message, "refusal", None):
+                raise ValueError(f"Model refused: {message.refusal}")
+            return json.loads(message.content)
+        except UpstreamError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error getting structured response: {e}")
+
+    async def embed(self, text: str):
+        cached = (await embedding_cache.get_many(EMBEDDING_MODEL, [text]))[0]
+        if cached is not None:
+            return cached
+        caller = metrics.current_stage.get()
+        try:
+            with metrics.track("llm.embed"):
+                response = await call("openai.embed", lambda: self.client.embeddings.create(
+                    input=text,
+                    model=EMBEDDING_MODEL
+                ), OPENAI_TIMEOUT_SECONDS, hedge_after=HEDGE_EMBED_AFTER_MS / 1000)
+            metrics.record_llm_call(caller, EMBEDDING_MODEL, response.usage)
+            embedding = response.data[0].embedding
+        except UpstreamError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Error embedding text: {e}")
+        await embedding_cache.put_many(EMBEDDING_MODEL, [text], [embedding])
+        return embedding
+
+    async def embed_batch(self, texts: List[str]):
+        embeddings = await embedding_cache.get_many(EMBEDDING_MODEL, texts)
+        missing = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                missing.setdefault(cache_key(EMBEDDING_MODEL, text), text)
+        if not missing:
+            return embeddings
+        keys = list(missing.keys())
+        fetched = {}
+        caller = metrics.current_stage.get()
         try:
-            response = self.client.embeddings.create(
-                input=text,
-                model="text-embedding-3-small"
-            )
-            return response.data[0].embedding
+            for start in range(0, len(keys), EMBED_BATCH_SIZE):
+                chunk = keys[start:start + EMBED_BATCH_SIZE]
+                with metrics.track("llm.embed"):
+                    response = await call("openai.embed", lambda: self.client.embeddings.create(
+                        input=[missing[key] for key in chunk],
+                        model=EMBEDDING_MODEL
+                    ), OPENAI_TIMEOUT_SECONDS, hedge_after=HEDGE_EMBED_AFTER_MS / 1000)
+                metrics.record_llm_call(caller, EMBEDDING_MODEL, response.usage)
+                fetched.update({chunk[item.index]: item.embedding for item in response.data})
+        except UpstreamError:
+            raise
         except Exception as e:
-            raise RuntimeError(f"Error embedding text: {e}")
\ No newline at end of file
+            raise RuntimeError(f"Error embedding texts: {e}")
+        await embedding_cache.put_many(EMBEDDING_MODEL, [missing[key] for key in fetched], list(fetched.values()))
+        return [
+            embedding if embedding is not None else fetched[cache_key(EMBEDDING_MODEL, text)]
+            for text, embedding in zip(texts, embeddings)
+        ]
\ No newline at end of file
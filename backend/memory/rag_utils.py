@@ -1,118 +1,211 @@
-from pinecone import Pinecone
 from dotenv import load_dotenv
 import os
 import uuid
 import logging
-from typing import List
+from typing import List, Optional
+import asyncio
 from datetime import datetime
+from .vector_store import get_vector_store
+from .retrieval_cache import retrieval_cache
+from .resilience import call, is_transient_vector_error
+from .. import metrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-try:
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index = pc.Index(host=os.getenv("PINECONE_HOST"))
-    logger.info("Successfully initialized Pinecone connection")
-except Exception as e:
-    logger.error(f"Failed to initialize Pinecone: {e}")
-    raise
+RETRIEVE_MAX_CONCURRENCY = int(os.getenv("RETRIEVE_MAX_CONCURRENCY", "8"))
+RETRIEVE_TIMEOUT_SECONDS = float(os.getenv("RETRIEVE_TIMEOUT_SECONDS", "2.0"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+VECTOR_TIMEOUT_SECONDS = float(os.getenv("VECTOR_TIMEOUT_SECONDS", "5"))
+# Sends a duplicate vector query when the first has not answered after this long (0 disables)
+HEDGE_VECTOR_AFTER_MS = float(os.getenv("HEDGE_VECTOR_AFTER_MS", "0"))
 
-def upsert_strands(strand: str, project_name: str, embed):
+
+@metrics.timed("vector.query")
+async def _query_store(project_name: str, embedding, top_k: int):
+    vector_store = get_vector_store()
+
+    async def query():
+        if vector_store.query_blocks(project_name):
+            return await asyncio.to_thread(vector_store.query, project_name, embedding, top_k)
+        return vector_store.query(project_name, embedding, top_k)
+
+    return await call("vector", query, VECTOR_TIMEOUT_SECONDS, hedge_after=HEDGE_VECTOR_AFTER_MS / 1000,
+                      retryable=is_transient_vector_error)
+
+@metrics.timed("vector.upsert")
+async def upsert_strands(strands: List[str], project_name: str, embeddings: List[List[float]], ids: Optional[List[str]] = None):
+    # ids (the strands' Mongo ids) make the vector ids stable, so indexing the same strands again overwrites them
     try:
-        logger.info(f"Starting upsert for project: {project_name}")
-        embedding = embed(strand)
-        strand_id = f"{project_name}_{str(uuid.uuid4())}"
-
-        index.upsert(
-            vectors=[
-                {
-                    "id": strand_id,
-                    "values": embedding,
-                    "metadata": {
-                        "project_name": project_name,
-                        "fact_text": strand,
-                        "created_at": datetime.now().isoformat()
-                    }
+        logger.info(f"Starting upsert of {len(strands)} strands for project: {project_name}")
+        created_at = datetime.now().isoformat()
+        vectors = [
+            {
+                "id": f"{project_name}_{strand_id or uuid.uuid4()}",
+                "values": embedding,
+                "metadata": {
+                    "project_name": project_name,
+                    "fact_text": strand,
+                    "created_at": created_at
                 }
-            ],
-            namespace=project_name  
-        )
-        logger.info(f"Successfully upserted strand with ID: {strand_id}")
-        return strand_id
+            }
+            for strand, embedding, strand_id in zip(strands, embeddings, ids or [None] * len(strands))
+        ]
+
+        vector_store = get_vector_store()
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            batch = vectors[start:start + UPSERT_BATCH_SIZE]
+            # Vector ids are fixed before the first attempt, so a retried batch overwrites rather than duplicates
+            await call("vector", lambda: asyncio.to_thread(vector_store.upsert, project_name, batch),
+                       VECTOR_TIMEOUT_SECONDS, retryable=is_transient_vector_error)
+        retrieval_cache.invalidate(project_name)
+        strand_ids = [vector["id"] for vector in vectors]
+        logger.info(f"Successfully upserted {len(strand_ids)} strands")
+        return strand_ids
     except Exception as e:
-        logger.error(f"Failed to upsert strand for project {project_name}: {e}")
+        logger.error(f"Failed to upsert strands for project {project_name}: {e}")
         raise
 
-def retrieve(questions: List[str], project_name: str, embed):
+async def _query_question(question_number: int, embedding, project_name: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        logger.debug(f"Processing question {question_number}")
+        matches = await _query_store(project_name, embedding, 2)
+
+    logger.debug(f"Found {len(matches)} matches for question {question_number}")
+
+    facts = []
+    for match in matches:
+        metadata = match.get("metadata", {})
+        fact = metadata.get("fact_text")
+        created_at = metadata.get("created_at")
+        if fact:
+            facts.append({
+                "fact_text": fact,
+                "created_at": created_at,
+                "score": match.get("score")
+            })
+    return facts
+
+async def iter_question_results(questions: List[str], project_name: str, embed_batch, max_concurrency: Optional[int] = None,
+                                timeout: Optional[float] = None, shared_generation=None):
+    # Yields (question index, facts) as each question is answered: cache hits first, then
+    # vector queries in completion order. Queries still running at the deadline are cancelled.
+    # A failed query is skipped, but if every query fails the last error is raised, so an
+    # outage (UpstreamError) is reported as one rather than as a recall with no facts.
+    # shared_generation, if given, returns the project's generation as bumped by every process
+    # that indexes strands; it is read while the questions are embedded.
+    if not questions:
+        return
+
+    max_concurrency = max_concurrency or RETRIEVE_MAX_CONCURRENCY
+    timeout = timeout if timeout is not None else RETRIEVE_TIMEOUT_SECONDS
+
+    async def embed_questions():
+        with metrics.track("embed_questions"):
+            return await embed_batch(questions)
+
+    if shared_generation is not None and retrieval_cache.enabled:
+        embeddings, generation = await asyncio.gather(embed_questions(), shared_generation())
+        retrieval_cache.sync(project_name, generation)
+    else:
+        embeddings = await embed_questions()
+    logger.debug(f"Embedded {len(embeddings)} questions in one batch")
+
+    pending = []
+    for i, embedding in enumerate(embeddings):
+        facts = retrieval_cache.lookup(project_name, embedding)
+        if facts is None:
+            pending.append(i)
+        else:
+            yield i, facts
+    logger.debug(f"{len(questions) - len(pending)} of {len(questions)} questions answered from the retrieval cache")
+    if not pending:
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    generation = retrieval_cache.generation(project_name)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    tasks = {
+        asyncio.ensure_future(_query_question(i + 1, embeddings[i], project_name, semaphore)): i
+        for i in pending
+    }
+    running = set(tasks)
+    failures = 0
+    error = None
     try:
-        logger.info(f"Starting retrieval for project: {project_name} with {len(questions)} questions")
-        retrieved_facts = []
+        while running:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, running = await asyncio.wait(running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i = tasks[task]
+                try:
+                    facts = task.result()
+                except Exception as e:
+                    logger.warning(f"Failed to process question {i+1}: {e}")
+                    failures += 1
+                    error = e
+                    continue
+                retrieval_cache.store(project_name, embeddings[i], facts, generation)
+                yield i, facts
+        if failures == len(pending):
+            raise error
+        if running:
+            logger.warning(f"{len(running)} of {len(pending)} queries did not finish within {timeout}s, returning partial results")
+    finally:
+        for task in running:
+            task.cancel()
 
-        for i, question in enumerate(questions):
-            try:
-                logger.debug(f"Processing question {i+1}/{len(questions)}")
-                embedding = embed(question)
-                result = index.query(
-                    vector=embedding,
-                    top_k=2,
-                    namespace=project_name,
-                    include_metadata=True
-                )
-                
-                matches_count = len(result.get("matches", []))
-                logger.debug(f"Found {matches_count} matches for question {i+1}")
-                
-                for match in result.get("matches", []):
-                    metadata = match.get("metadata", {})
-                    fact = metadata.get("fact_text")
-                    created_at = metadata.get("created_at")
-                    if fact:
-                        retrieved_facts.append({
-                            "fact_text": fact,
-                            "created_at": created_at
-                        })
-            except Exception as e:
-                logger.warning(f"Failed to process question {i+1}: {e}")
-                continue
-
-        seen_facts = set()
-        unique_facts = []
-        for fact_dict in retrieved_facts:
+def merge_facts(fact_lists, seen_facts: Optional[set] = None):
+    seen_facts = seen_facts if seen_facts is not None else set()
+    unique_facts = []
+    for facts in fact_lists:
+        for fact_dict in facts or []:
             fact_text = fact_dict["fact_text"]
             if fact_text not in seen_facts:
                 seen_facts.add(fact_text)
                 unique_facts.append(fact_dict)
-        
-        logger.info(f"Retrieved {len(unique_facts)} unique facts from {len(retrieved_facts)} total matches")
+    return unique_facts
+
+@metrics.timed("retrieve")
+async def retrieve(questions: List[str], project_name: str, embed_batch, max_concurrency: Optional[int] = None,
+                   timeout: Optional[float] = None, shared_generation=None):
+    try:
+        logger.info(f"Starting retrieval for project: {project_name} with {len(questions)} questions")
+        results_by_question = [None] * len(questions)
+        async for i, facts in iter_question_results(questions, project_name, embed_batch, max_concurrency, timeout, shared_generation):
+            results_by_question[i] = facts
+
+        unique_facts = merge_facts(results_by_question)
+        total_matches = sum(len(facts) for facts in results_by_question if facts)
+        logger.info(f"Retrieved {len(unique_facts)} unique facts from {total_matches} total matches")
         return unique_facts
     except Exception as e:
         logger.error(f"Failed to retrieve facts for project {project_name}: {e}")
         raise
 
 
-def retrieve_for_deduplication(strand: str, project_name: str, embed): 
+async def retrieve_for_deduplication(embedding: List[float], project_name: str): 
     try:
         logger.info(f"Starting retrieval for deduplication for project: {project_name}")
         
-        embedding = embed(strand)
-        result = index.query(
-            vector=embedding,
-            top_k=3,
-            namespace=project_name,
-            include_metadata=True
-        )
+        matches = await _query_store(project_name, embedding, 3)
                 
-        matches_count = len(result.get("matches", []))
-        logger.debug(f"Found {matches_count} matches for strand")
+        logger.debug(f"Found {len(matches)} matches for strand")
         
         retrieved_facts = []
-        for match in result.get("matches", []):
+        for match in matches:
             metadata = match.get("metadata", {})
             fact = metadata.get("fact_text")
             if fact:
-                retrieved_facts.append(fact)
+                retrieved_facts.append({
+                    "fact_text": fact,
+                    "score": match.get("score") or 0.0
+                })
         
         logger.info(f"Retrieved {len(retrieved_facts)} facts for deduplication check")
         return retrieved_facts
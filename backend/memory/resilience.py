@@ -0,0 +1,259 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Optional
+import openai
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RESILIENCE_MAX_RETRIES = int(os.getenv("RESILIENCE_MAX_RETRIES", "2"))
+RESILIENCE_BACKOFF_SECONDS = float(os.getenv("RESILIENCE_BACKOFF_SECONDS", "0.2"))
+RESILIENCE_MAX_BACKOFF_SECONDS = float(os.getenv("RESILIENCE_MAX_BACKOFF_SECONDS", "5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Event loop time by which the current request must finish, or None. Set per stage with within()
+current_deadline = ContextVar("reca11_deadline", default=None)
+
+
+# Raised when an upstream dependency cannot be used: retries ran out, its circuit is open, or the
+# deadline left no time to call it. Callers that can work without the dependency catch this.
+class UpstreamError(RuntimeError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+async def within(deadline: Optional[float], fn, *args, **kwargs):
+    # Runs fn with the deadline applied to every upstream call it makes
+    token = current_deadline.set(deadline)
+    try:
+        return await fn(*args, **kwargs)
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining_time():
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+
+def is_transient(error: BaseException):
+    # Timeouts, connection failures, rate limits and 5xx responses are worth retrying; anything
+    # else (bad key, bad request) is the caller's problem
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return False
+
+
+def is_transient_vector_error(error: BaseException):
+    # Vector store clients raise their own transport exceptions, so anything that is not a
+    # programming error is treated as transient
+    if isinstance(error, (TypeError, ValueError, KeyError, AttributeError, IndexError)):
+        return False
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if isinstance(status, int) and status < 500 and status != 429:
+        return False
+    return True
+
+
+def is_rate_limited(error: BaseException):
+    # Rate limits apply to the caller's key, not to the dependency, so one tenant hitting its
+    # limit must not open the circuit for every other tenant
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status == 429
+
+
+def retry_after_seconds(error: BaseException):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        if headers.get("retry-after") is not None:
+            return max(0.0, float(headers["retry-after"]))
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None):
+    if retry_after is not None:
+        return min(retry_after, RESILIENCE_MAX_BACKOFF_SECONDS)
+    # Full jitter, so callers that failed together do not retry together
+    return random.uniform(0, min(RESILIENCE_MAX_BACKOFF_SECONDS, RESILIENCE_BACKOFF_SECONDS * (2 ** attempt)))
+
+
+# Fails fast after failure_threshold consecutive transient failures of a dependency. After
+# reset_seconds one trial call is let through (half-open); its outcome closes or reopens the circuit.
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self.opens = 0
+        self.rejected = 0
+
+    def before_call(self):
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self._trial_running = False
+        if self.state == "open" or (self.state == "half_open" and self._trial_running):
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        if self.state == "half_open":
+            self._trial_running = True
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+
+    def record_abandoned(self):
+        # The call was cancelled before it finished, which says nothing about the dependency
+        self._trial_running = False
+
+
+class _Counters:
+    def __init__(self):
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+
+breakers = {}
+counters = _Counters()
+
+
+def get_breaker(name: str):
+    breaker = breakers.get(name)
+    if breaker is None:
+        breaker = breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+async def _hedged(fn, hedge_after: float, timeout: float):
+    # Starts a second copy of a slow call after hedge_after and returns whichever succeeds first
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=min(hedge_after, timeout))
+        if not done and loop.time() < end:
+            counters.hedges += 1
+            tasks.append(asyncio.ensure_future(fn()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        counters.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        if error is not None and not pending:
+            raise error
+        raise asyncio.TimeoutError()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call(name: str, fn, timeout: float, max_retries: int = RESILIENCE_MAX_RETRIES,
+               hedge_after: Optional[float] = None, retryable=is_transient):
+    # Calls fn (a function returning a fresh awaitable per attempt) through the named circuit breaker.
+    # Each attempt is bounded by timeout and by the current deadline; transient failures are retried
+    # with jittered backoff (honouring retry-after on 429s) as long as the deadline leaves time for it.
+    breaker = get_breaker(name)
+    attempt = 0
+    while True:
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            counters.deadline_exceeded += 1
+            raise DeadlineExceeded(f"No time left to call {name}")
+        attempt_timeout = timeout if remaining is None else min(timeout, remaining)
+
+        breaker.before_call()
+        try:
+            if hedge_after:
+                result = await _hedged(fn, hedge_after, attempt_timeout)
+            else:
+                result = await asyncio.wait_for(fn(), timeout=attempt_timeout)
+        except asyncio.CancelledError:
+            breaker.record_abandoned()
+            raise
+        except Exception as e:
+            if not retryable(e):
+                # The dependency answered, so the failure says nothing about its health
+                breaker.record_success()
+                raise
+            if is_rate_limited(e):
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if attempt >= max_retries:
+                raise UpstreamError(f"{name} failed after {attempt + 1} attempts: {e!r}") from e
+            delay = backoff_delay(attempt, retry_after_seconds(e))
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                counters.deadline_exceeded += 1
+                raise DeadlineExceeded(f"{name} failed and the deadline leaves no time to retry: {e!r}") from e
+            logger.warning(f"{name} attempt {attempt + 1} failed ({e!r}), retrying in {delay:.2f}s")
+            counters.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+def stats():
+    return {
+        "retries": counters.retries,
+        "hedges": counters.hedges,
+        "hedge_wins": counters.hedge_wins,
+        "deadline_exceeded": counters.deadline_exceeded,
+        "breaker_opens": sum(breaker.opens for breaker in breakers.values()),
+        "breaker_rejections": sum(breaker.rejected for breaker in breakers.values()),
+        "open_breakers": sum(breaker.state != "closed" for breaker in breakers.values())
+    }
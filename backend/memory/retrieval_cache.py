@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+RETRIEVAL_CACHE_MAX_DISTANCE = float(os.getenv("RETRIEVAL_CACHE_MAX_DISTANCE", "0.05"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "300"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+RETRIEVAL_CACHE_MAX_PROJECTS = int(os.getenv("RETRIEVAL_CACHE_MAX_PROJECTS", "1024"))
+
+
+class _ProjectEntries:
+    def __init__(self):
+        self.vectors = []
+        self.facts = []
+        self.expires_at = []
+        self.generation = 0
+        self.shared_generation = None
+
+    def expire(self, now: float):
+        live = [i for i, expires_at in enumerate(self.expires_at) if expires_at > now]
+        if len(live) != len(self.expires_at):
+            self.vectors = [self.vectors[i] for i in live]
+            self.facts = [self.facts[i] for i in live]
+            self.expires_at = [self.expires_at[i] for i in live]
+
+
+# Per-project cache of question embedding -> facts retrieved for that question. A lookup hits
+# when a cached question lies within max_distance (cosine distance) of the new one. Writes to a
+# project's namespace invalidate its entries; the generation counter stops queries that were
+# already in flight during a write from caching their now-stale results. Writes made by other
+# processes are picked up through sync() with a generation those processes bump.
+class RetrievalCache:
+    def __init__(self, max_distance: float = RETRIEVAL_CACHE_MAX_DISTANCE, ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS,
+                 max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES, max_projects: int = RETRIEVAL_CACHE_MAX_PROJECTS):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_projects = max_projects
+        self._projects = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def _entries(self, project_name: str):
+        entries = self._projects.get(project_name)
+        if entries is None:
+            entries = self._projects[project_name] = _ProjectEntries()
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+        self._projects.move_to_end(project_name)
+        return entries
+
+    def generation(self, project_name: str):
+        with self._lock:
+            return self._entries(project_name).generation
+
+    def lookup(self, project_name: str, embedding: List[float]):
+        if not self.enabled:
+            return None
+        vector = _unit(embedding)
+        with self._lock:
+            entries = self._entries(project_name)
+            entries.expire(time.monotonic())
+            if entries.vectors:
+                similarities = np.stack(entries.vectors) @ vector
+                best = int(np.argmax(similarities))
+                if 1.0 - float(similarities[best]) <= self.max_distance:
+                    self.hits += 1
+                    return entries.facts[best]
+            self.misses += 1
+            return None
+
+    def store(self, project_name: str, embedding: List[float], facts: List[Dict], generation: int):
+        if not self.enabled:
+            return
+        vector = _unit(embedding)
+        with self._lock:
+            entries = self._entries(project_name)
+            if entries.generation != generation:
+                return
+            entries.vectors.append(vector)
+            entries.facts.append(facts)
+            entries.expires_at.append(time.monotonic() + self.ttl_seconds)
+            if len(entries.vectors) > self.max_entries:
+                del entries.vectors[0], entries.facts[0], entries.expires_at[0]
+
+    @staticmethod
+    def _clear(entries: _ProjectEntries):
+        entries.vectors, entries.facts, entries.expires_at = [], [], []
+        entries.generation += 1
+
+    def invalidate(self, project_name: str):
+        with self._lock:
+            entries = self._projects.get(project_name)
+            if entries is None:
+                return
+            self._clear(entries)
+            self.invalidations += 1
+        logger.debug(f"Invalidated retrieval cache for project: {project_name}")
+
+    def sync(self, project_name: str, shared_generation: int):
+        # Drops the project's entries if the shared generation moved since they were cached
+        with self._lock:
+            entries = self._entries(project_name)
+            if entries.shared_generation == shared_generation:
+                return
+            if entries.shared_generation is not None:
+                self._clear(entries)
+                self.invalidations += 1
+                logger.debug(f"Project {project_name} was written elsewhere, invalidated its retrieval cache")
+            entries.shared_generation = shared_generation
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "projects": len(self._projects),
+                "entries": sum(len(entries.vectors) for entries in self._projects.values()),
+                "max_distance": self.max_distance,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+retrieval_cache = RetrievalCache()
@@ -0,0 +1,452 @@
+import os
+import json
+import struct
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH")
+LOCAL_VECTOR_STORE_ANN_THRESHOLD = int(os.getenv("LOCAL_VECTOR_STORE_ANN_THRESHOLD", "20000"))
+# Exact searches over namespaces at least this large run on a worker thread instead of the event loop
+LOCAL_VECTOR_STORE_INLINE_MAX = int(os.getenv("LOCAL_VECTOR_STORE_INLINE_MAX", "2000"))
+# Writes are appended to a per-namespace log, which is folded into the namespace's snapshot once it
+# holds at least as many rows as the namespace (and this many), so persisting stays O(1) per row
+LOCAL_VECTOR_STORE_COMPACT_MIN_ROWS = int(os.getenv("LOCAL_VECTOR_STORE_COMPACT_MIN_ROWS", "1000"))
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+# Interface every vector backend implements. Matches are returned as
+# {"id": ..., "score": cosine similarity, "metadata": {...}} dicts, best first.
+class VectorStore:
+    # Whether queries do network I/O and should be moved off the event loop; writes always are
+    blocking = True
+
+    def query_blocks(self, namespace: str):
+        return self.blocking
+
+    def upsert(self, namespace: str, vectors: List[Dict]):
+        raise NotImplementedError
+
+    def query(self, namespace: str, vector: List[float], top_k: int):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, ids: List[str]):
+        raise NotImplementedError
+
+    def namespace_stats(self, namespace: str):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, api_key: Optional[str] = None, host: Optional[str] = None):
+        from pinecone import Pinecone
+        try:
+            pc = Pinecone(api_key=api_key or os.getenv("PINECONE_API_KEY"))
+            self.index = pc.Index(host=host or os.getenv("PINECONE_HOST"))
+            logger.info("Successfully initialized Pinecone connection")
+        except Exception as e:
+            logger.error(f"Failed to initialize Pinecone: {e}")
+            raise
+
+    def upsert(self, namespace: str, vectors: List[Dict]):
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, namespace: str, vector: List[float], top_k: int):
+        result = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            namespace=namespace,
+            include_metadata=True
+        )
+        return [
+            {"id": match.get("id"), "score": match.get("score"), "metadata": match.get("metadata") or {}}
+            for match in result.get("matches", [])
+        ]
+
+    def delete(self, namespace: str, ids: List[str]):
+        self.index.delete(ids=ids, namespace=namespace)
+
+    def namespace_stats(self, namespace: str):
+        stats = self.index.describe_index_stats()
+        namespace_summary = stats.get("namespaces", {}).get(namespace)
+        return {"vector_count": namespace_summary.get("vector_count", 0) if namespace_summary else 0}
+
+
+class _LocalNamespace:
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.vectors = np.zeros((16, dimension), dtype=np.float32)
+        self.ids = []
+        self.metadata = []
+        self.rows = {}
+        self.ann = None
+        self.ann_building = False
+        # Bumped whenever rows are renumbered, which invalidates an index built over the old numbering
+        self.layout = 0
+        self.rows_since_snapshot = []
+        # Rows written to the log since the last compaction
+        self.logged_rows = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _ensure_capacity(self, size: int):
+        if size > self.vectors.shape[0]:
+            grown = np.zeros((max(size, self.vectors.shape[0] * 2), self.dimension), dtype=np.float32)
+            grown[:len(self.ids)] = self.vectors[:len(self.ids)]
+            self.vectors = grown
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        changed_rows = []
+        for strand_id, vector, meta in zip(ids, vectors, metadata):
+            row = self.rows.get(strand_id)
+            if row is None:
+                row = len(self.ids)
+                self._ensure_capacity(row + 1)
+                self.ids.append(strand_id)
+                self.metadata.append(meta)
+                self.rows[strand_id] = row
+            else:
+                self.metadata[row] = meta
+            self.vectors[row] = vector
+            changed_rows.append(row)
+        if self.ann is not None:
+            self._add_to_ann(changed_rows)
+        elif self.ann_building:
+            self.rows_since_snapshot.extend(changed_rows)
+
+    def _add_to_ann(self, rows: List[int]):
+        if len(self.ids) > self.ann.get_max_elements():
+            self.ann.resize_index(len(self.ids) * 2)
+        self.ann.add_items(self.vectors[rows], rows)
+
+    def delete(self, ids: List[str]):
+        # Copy on write, so exact searches running on a snapshot of the rows stay consistent
+        self.vectors = self.vectors.copy()
+        for strand_id in ids:
+            row = self.rows.pop(strand_id, None)
+            if row is None:
+                continue
+            last = len(self.ids) - 1
+            if row != last:
+                self.vectors[row] = self.vectors[last]
+                self.ids[row] = self.ids[last]
+                self.metadata[row] = self.metadata[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.metadata.pop()
+        # Rows were renumbered, so the approximate index is rebuilt in the background
+        self.ann = None
+        self.layout += 1
+
+    def needs_ann(self, ann_threshold: int):
+        return hnswlib is not None and self.ann is None and not self.ann_building and len(self.ids) >= ann_threshold
+
+    def snapshot_for_ann(self):
+        self.ann_building = True
+        self.rows_since_snapshot = []
+        return self.vectors[:len(self.ids)].copy(), self.layout
+
+    def install_ann(self, ann, layout: int):
+        # Called with the index built from snapshot_for_ann; rows written since are added to it
+        self.ann_building = False
+        if layout != self.layout:
+            return False
+        self.ann = ann
+        if self.rows_since_snapshot:
+            self._add_to_ann(self.rows_since_snapshot)
+        self.rows_since_snapshot = []
+        return True
+
+    def query_ann(self, vector: np.ndarray, top_k: int):
+        labels, distances = self.ann.knn_query(vector, k=min(top_k, len(self.ids)))
+        return [(int(row), 1.0 - float(distance)) for row, distance in zip(labels[0], distances[0])]
+
+
+def _build_ann(vectors: np.ndarray):
+    ann = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+    ann.init_index(max_elements=len(vectors) * 2, ef_construction=200, M=16)
+    ann.add_items(vectors, np.arange(len(vectors)))
+    ann.set_ef(64)
+    return ann
+
+
+def _exact_matches(vectors: np.ndarray, vector: np.ndarray, top_k: int):
+    count = len(vectors)
+    if count == 0:
+        return []
+    top_k = min(top_k, count)
+    scores = vectors @ vector
+    if top_k < count:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(count)
+    ranked = candidates[np.argsort(-scores[candidates])]
+    return [(int(row), float(scores[row])) for row in ranked]
+
+
+# Log records are a (header length, payload length) prefix, a JSON header with the op, ids and
+# metadata, and the float32 vectors of an upsert as the payload
+_LOG_PREFIX = struct.Struct("<II")
+
+
+def _encode_log_record(op: str, ids: List[str], vectors: Optional[np.ndarray] = None, metadata: Optional[List[Dict]] = None):
+    header = json.dumps({"op": op, "ids": ids, "metadata": metadata}).encode("utf-8")
+    payload = vectors.astype(np.float32).tobytes() if vectors is not None else b""
+    return _LOG_PREFIX.pack(len(header), len(payload)) + header + payload
+
+
+def _read_log(path: str):
+    # Returns the complete records and the length they span; a record cut short by a crash ends the log
+    with open(path, "rb") as f:
+        data = f.read()
+    records, offset = [], 0
+    while offset + _LOG_PREFIX.size <= len(data):
+        header_length, payload_length = _LOG_PREFIX.unpack_from(data, offset)
+        start = offset + _LOG_PREFIX.size
+        end = start + header_length + payload_length
+        if end > len(data):
+            break
+        header = json.loads(data[start:start + header_length])
+        vectors = None
+        if payload_length:
+            vectors = np.frombuffer(data[start + header_length:end], dtype=np.float32).reshape(len(header["ids"]), -1)
+        records.append((header["op"], header["ids"], vectors, header["metadata"]))
+        offset = end
+    return records, offset
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# In-process store: exact NumPy search for small namespaces, an HNSW index (when hnswlib is
+# installed) once a namespace reaches the ANN threshold. Persists a snapshot file and an
+# append-only log of later writes per namespace; loading replays the log over the snapshot.
+# Indexes are built on a background thread, and exact search serves the namespace meanwhile.
+class LocalVectorStore(VectorStore):
+    blocking = False
+
+    def __init__(self, path: Optional[str] = LOCAL_VECTOR_STORE_PATH, ann_threshold: int = LOCAL_VECTOR_STORE_ANN_THRESHOLD):
+        self.path = path
+        self.ann_threshold = ann_threshold
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load_all()
+        logger.info(f"Initialized local vector store{f' at {path}' if path else ' (in memory)'}")
+
+    def _namespace_file(self, namespace: str):
+        return os.path.join(self.path, f"{namespace}.npz")
+
+    def _log_file(self, namespace: str):
+        return os.path.join(self.path, f"{namespace}.log")
+
+    def _load_all(self):
+        namespaces = {
+            filename.rsplit(".", 1)[0] for filename in os.listdir(self.path)
+            if filename.endswith(".npz") or filename.endswith(".log")
+        }
+        for namespace in namespaces:
+            try:
+                store = None
+                if os.path.exists(self._namespace_file(namespace)):
+                    with np.load(self._namespace_file(namespace), allow_pickle=False) as data:
+                        vectors = data["vectors"]
+                        ids = [str(strand_id) for strand_id in data["ids"]]
+                        metadata = json.loads(str(data["metadata"]))
+                    store = _LocalNamespace(vectors.shape[1])
+                    store.upsert(ids, vectors, metadata)
+                if os.path.exists(self._log_file(namespace)):
+                    store = self._replay_log(namespace, store)
+                if store is None:
+                    continue
+                self._namespaces[namespace] = store
+                self._maybe_build_ann(namespace, store)
+            except Exception as e:
+                logger.error(f"Failed to load local vector namespace {namespace}: {e}")
+
+    def _replay_log(self, namespace: str, store: Optional[_LocalNamespace]):
+        # Records already folded into the snapshot (a crash between compaction's two steps) are
+        # replayed again harmlessly: upserts and deletes by id are idempotent
+        path = self._log_file(namespace)
+        records, length = _read_log(path)
+        if length < os.path.getsize(path):
+            logger.warning(f"Dropping a partially written record at the end of the log for namespace {namespace}")
+            os.truncate(path, length)
+        for op, ids, vectors, metadata in records:
+            if op == "upsert":
+                if store is None:
+                    store = _LocalNamespace(vectors.shape[1])
+                store.upsert(ids, vectors, metadata)
+                store.logged_rows += len(ids)
+            elif store is not None:
+                store.delete(ids)
+                store.logged_rows += len(ids)
+        return store
+
+    def _append_log(self, namespace: str, record: bytes):
+        with open(self._log_file(namespace), "ab") as f:
+            f.write(record)
+
+    def _needs_compaction(self, store: _LocalNamespace):
+        # Called with _lock held
+        return store.logged_rows >= max(len(store), LOCAL_VECTOR_STORE_COMPACT_MIN_ROWS)
+
+    def _compact(self, namespace: str):
+        # Called with _persist_lock held, so no write reaches the log between the snapshot and its truncation.
+        # Only the copy of the rows happens under _lock; the snapshot is serialized and written after it.
+        with self._lock:
+            store = self._namespaces[namespace]
+            count = len(store)
+            vectors, ids, metadata = store.vectors[:count].copy(), list(store.ids), list(store.metadata)
+            store.logged_rows = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, vectors=vectors, ids=np.array(ids, dtype=str), metadata=np.array(json.dumps(metadata)))
+            os.replace(temp_path, self._namespace_file(namespace))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        open(self._log_file(namespace), "wb").close()
+
+    def _persist(self, namespace: str, record: bytes, compact: bool):
+        # Called with _persist_lock held, after the write was applied in memory
+        if not self.path:
+            return
+        self._append_log(namespace, record)
+        if compact:
+            self._compact(namespace)
+
+    def _maybe_build_ann(self, namespace: str, store: _LocalNamespace):
+        # Called with _lock held
+        if not store.needs_ann(self.ann_threshold):
+            return
+        vectors, layout = store.snapshot_for_ann()
+        threading.Thread(
+            target=self._build_ann_in_background, args=(namespace, store, vectors, layout),
+            name=f"ann-{namespace}", daemon=True
+        ).start()
+
+    def _build_ann_in_background(self, namespace: str, store: _LocalNamespace, vectors: np.ndarray, layout: int):
+        try:
+            ann = _build_ann(vectors)
+        except Exception as e:
+            logger.error(f"Failed to build approximate index for namespace {namespace}: {e}")
+            with self._lock:
+                store.ann_building = False
+            return
+        with self._lock:
+            if store.install_ann(ann, layout):
+                logger.info(f"Built approximate index over {len(vectors)} vectors for namespace {namespace}")
+            elif self._namespaces.get(namespace) is store:
+                # Rows were deleted while it was building; start over on the new numbering
+                self._maybe_build_ann(namespace, store)
+
+    def query_blocks(self, namespace: str):
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            return store is not None and store.ann is None and len(store) >= LOCAL_VECTOR_STORE_INLINE_MAX
+
+    # Writes hold _persist_lock for their whole duration so log records reach disk in order,
+    # but only hold _lock while mutating, so queries are never stuck behind file I/O.
+    # Each write logs only its own rows; the whole namespace is rewritten only on compaction.
+    def upsert(self, namespace: str, vectors: List[Dict]):
+        if not vectors:
+            return
+        values = _normalize([vector["values"] for vector in vectors])
+        ids = [vector["id"] for vector in vectors]
+        metadata = [vector.get("metadata") or {} for vector in vectors]
+        record = _encode_log_record("upsert", ids, values, metadata) if self.path else None
+        with self._persist_lock:
+            with self._lock:
+                store = self._namespaces.get(namespace)
+                if store is None:
+                    store = self._namespaces[namespace] = _LocalNamespace(values.shape[1])
+                store.upsert(ids, values, metadata)
+                self._maybe_build_ann(namespace, store)
+                store.logged_rows += len(ids)
+                compact = self._needs_compaction(store)
+            self._persist(namespace, record, compact)
+
+    def query(self, namespace: str, vector: List[float], top_k: int):
+        vector = _normalize(vector)
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            if store is None or len(store) == 0:
+                return []
+            if store.ann is not None:
+                return [
+                    {"id": store.ids[row], "score": score, "metadata": store.metadata[row]}
+                    for row, score in store.query_ann(vector, top_k)
+                ]
+            # Exact search runs outside the lock on a view of the rows (deletes copy on write)
+            vectors, ids, metadata = store.vectors[:len(store)], list(store.ids), list(store.metadata)
+        return [
+            {"id": ids[row], "score": score, "metadata": metadata[row]}
+            for row, score in _exact_matches(vectors, vector, top_k)
+        ]
+
+    def delete(self, namespace: str, ids: List[str]):
+        record = _encode_log_record("delete", list(ids)) if self.path else None
+        with self._persist_lock:
+            with self._lock:
+                store = self._namespaces.get(namespace)
+                if store is None:
+                    return
+                store.delete(ids)
+                self._maybe_build_ann(namespace, store)
+                store.logged_rows += len(ids)
+                compact = self._needs_compaction(store)
+            self._persist(namespace, record, compact)
+
+    def namespace_stats(self, namespace: str):
+        with self._lock:
+            store = self._namespaces.get(namespace)
+            return {
+                "vector_count": len(store) if store else 0,
+                "approximate": bool(store and store.ann is not None)
+            }
+
+
+_vector_store = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store():
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                if VECTOR_STORE_BACKEND == "local":
+                    _vector_store = LocalVectorStore()
+                elif VECTOR_STORE_BACKEND == "pinecone":
+                    _vector_store = PineconeVectorStore()
+                else:
+                    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {VECTOR_STORE_BACKEND}")
+    return _vector_store
+
+
+def set_vector_store(store: VectorStore):
+    global _vector_store
+    _vector_store = store
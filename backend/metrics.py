@@ -0,0 +1,144 @@
+import time
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Prometheus metrics for the API. Every observation is labelled with the endpoint that caused it
+# (set per request by MetricsMiddleware, "background" inside background jobs) and the stage it
+# timed; stages nest, so LLM calls are also attributed to the stage that made them.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FRESHNESS_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+current_endpoint = ContextVar("reca11_endpoint", default="internal")
+current_stage = ContextVar("reca11_stage", default="none")
+
+REQUEST_SECONDS = Histogram(
+    "reca11_request_seconds", "Time to fully serve an HTTP request.",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "reca11_stage_seconds", "Time spent in each stage of request and background processing.",
+    ["endpoint", "stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "reca11_stage_errors_total", "Stages that raised an exception.",
+    ["endpoint", "stage"]
+)
+LLM_CALLS = Counter(
+    "reca11_llm_calls_total", "OpenAI API calls, by the stage that made them.",
+    ["endpoint", "stage", "model"]
+)
+LLM_TOKENS = Counter(
+    "reca11_llm_tokens_total", "OpenAI tokens used, by the stage that used them.",
+    ["endpoint", "stage", "model", "type"]
+)
+FRESHNESS_SECONDS = Histogram(
+    "reca11_memory_freshness_lag_seconds", "Time from a recall to the strands extracted from its chat pair becoming searchable.",
+    buckets=FRESHNESS_BUCKETS
+)
+
+
+@contextmanager
+def track(stage: str):
+    endpoint = current_endpoint.get()
+    token = current_stage.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(endpoint, stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(endpoint, stage).observe(time.perf_counter() - start)
+        current_stage.reset(token)
+
+
+def timed(stage: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with track(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_call(stage: str, model: str, usage=None):
+    endpoint = current_endpoint.get()
+    LLM_CALLS.labels(endpoint, stage, model).inc()
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None)
+        if count:
+            LLM_TOKENS.labels(endpoint, stage, model, kind[:-len("_tokens")]).inc(count)
+
+
+def record_freshness(recalled_at: float):
+    FRESHNESS_SECONDS.observe(max(0.0, time.time() - recalled_at))
+
+
+# Exposes the in-process stats() dicts (caches, background queue, client pool, dedup outcomes)
+# at scrape time, so those modules keep their own counters and need no Prometheus calls
+class StatsCollector:
+    COUNTER_FIELDS = {
+        "hits", "disk_hits", "misses", "invalidations", "submitted", "coalesced", "shed", "completed",
+        "failed", "flushes", "evictions", "empty", "auto_accept", "auto_reject", "llm", "llm_batches", "error",
+        "retries", "hedges", "hedge_wins", "deadline_exceeded", "breaker_opens", "breaker_rejections",
+        "leased", "acked", "retried", "dead"
+    }
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def collect(self):
+        for source, stats in self.sources.items():
+            for field, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"reca11_{source}_{field}"
+                if field in self.COUNTER_FIELDS:
+                    yield CounterMetricFamily(name, f"{source} {field.replace('_', ' ')}.", value=value)
+                else:
+                    yield GaugeMetricFamily(name, f"{source} {field.replace('_', ' ')}.", value=value)
+
+
+def register_stats(sources):
+    collector = StatsCollector(sources)
+    REGISTRY.register(collector)
+    return collector
+
+
+def render():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# Labels each request's metrics with its route path (or "other" for paths not in paths, to keep
+# label cardinality bounded) and records how long the whole response took, streaming included
+class MetricsMiddleware:
+    def __init__(self, app, paths=()):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = scope["path"] if scope["path"] in self.paths else "other"
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = current_endpoint.set(endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.labels(endpoint, scope["method"], str(status["code"])).observe(time.perf_counter() - start)
+            current_endpoint.reset(token)
@@ -0,0 +1,112 @@
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from .models import projects_col, chats_col, strands_col, summaries_col, ensure_indexes, RECENT_CHATS_LIMIT
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Moves the chat_history, memory_strands and summaries arrays embedded in project documents
+# into the per-item collections, and backfills the recent_chats / latest_summary fields recall
+# reads in one round trip. Item ids are derived from the project id and array position,
+# so an interrupted run can simply be started again.
+# Usage: python -m backend.migrate [--dry-run] [--keep-arrays]
+
+LEGACY_ARRAYS = ("chat_history", "memory_strands", "summaries")
+
+
+def _upsert(doc_id, doc):
+    return UpdateOne({"_id": doc_id}, {"$setOnInsert": doc}, upsert=True)
+
+
+def build_operations(project):
+    owner = {"owner_api_key": project["owner_api_key"], "project_name": project["project_name"]}
+    created_at = project.get("created_at") or datetime.now()
+    project_id = project["_id"]
+
+    # Legacy chats carry no timestamp; spread them after the project creation time to keep their order
+    chat_ops = [
+        _upsert(f"{project_id}:chat:{i}", {
+            **owner,
+            "user": chat.get("user", ""),
+            "assistant": chat.get("assistant", ""),
+            "timestamp": created_at + timedelta(microseconds=i + 1)
+        })
+        for i, chat in enumerate(project.get("chat_history") or [])
+    ]
+    strand_ops = [
+        _upsert(f"{project_id}:strand:{i}", {
+            **owner,
+            "content": strand.get("content", ""),
+            "timestamp": strand.get("timestamp") or created_at
+        })
+        for i, strand in enumerate(project.get("memory_strands") or [])
+    ]
+    summary_ops = [
+        _upsert(f"{project_id}:summary:{i}", {
+            **owner,
+            "summary": summary.get("summary", ""),
+            "timestamp": summary.get("timestamp") or created_at
+        })
+        for i, summary in enumerate(project.get("summaries") or [])
+        if summary.get("summary")
+    ]
+    return chat_ops, strand_ops, summary_ops
+
+
+async def recall_fields(project):
+    owner = {"owner_api_key": project["owner_api_key"], "project_name": project["project_name"]}
+    chats = await chats_col.find(owner, {"_id": 0, "user": 1, "assistant": 1}).sort("timestamp", -1).limit(RECENT_CHATS_LIMIT).to_list(length=RECENT_CHATS_LIMIT)
+    summary = await summaries_col.find_one(owner, {"_id": 0, "summary": 1}, sort=[("timestamp", -1)])
+    return {
+        "recent_chats": list(reversed(chats)),
+        "latest_summary": summary["summary"] if summary else ""
+    }
+
+
+async def migrate_project(project, dry_run: bool = False, keep_arrays: bool = False):
+    chat_ops, strand_ops, summary_ops = build_operations(project)
+    logger.info(
+        f"Project {project['project_name']}: {len(chat_ops)} chats, "
+        f"{len(strand_ops)} strands, {len(summary_ops)} summaries"
+    )
+    if dry_run:
+        return
+
+    for collection, operations in ((chats_col, chat_ops), (strands_col, strand_ops), (summaries_col, summary_ops)):
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+
+    update = {"$set": await recall_fields(project)}
+    if not keep_arrays:
+        update["$unset"] = {name: "" for name in LEGACY_ARRAYS}
+    await projects_col.update_one({"_id": project["_id"]}, update)
+
+
+async def migrate(dry_run: bool = False, keep_arrays: bool = False):
+    try:
+        await ensure_indexes()
+        query = {"$or": [{name: {"$exists": True}} for name in LEGACY_ARRAYS] + [{"recent_chats": {"$exists": False}}]}
+        migrated = 0
+        async for project in projects_col.find(query):
+            await migrate_project(project, dry_run=dry_run, keep_arrays=keep_arrays)
+            migrated += 1
+        logger.info(f"Migrated {migrated} projects{' (dry run)' if dry_run else ''}")
+        return migrated
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split embedded project arrays into per-item collections.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be migrated without writing.")
+    parser.add_argument("--keep-arrays", action="store_true", help="Leave the legacy arrays on the project documents.")
+    args = parser.parse_args()
+    asyncio.run(migrate(dry_run=args.dry_run, keep_arrays=args.keep_arrays))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from pymongo.mongo_client import MongoClient
+from pymongo import AsyncMongoClient, ReturnDocument, UpdateOne
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import os
@@ -6,24 +6,70 @@ import uuid
 import logging
 import certifi
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
+from . import metrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+MEMORY_STRANDS_LIMIT = int(os.getenv("MEMORY_STRANDS_LIMIT", "1000"))
+RECENT_CHATS_LIMIT = 3
+
 try:
-    client = MongoClient(os.getenv("MONGODB_URI"), server_api=ServerApi('1'), tls = True, tlsCAFile=certifi.where())
+    client = AsyncMongoClient(os.getenv("MONGODB_URI"), server_api=ServerApi('1'), tls = True, tlsCAFile=certifi.where())
     db = client["reca11_db"]
     users_col = db["users"]
     projects_col = db["projects"]
+    chats_col = db["chats"]
+    strands_col = db["memory_strands"]
+    summaries_col = db["summaries"]
+    jobs_col = db["jobs"]
+    job_locks_col = db["job_locks"]
+    retrieval_generations_col = db["retrieval_generations"]
     logger.info("Successfully connected to MongoDB")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     raise
 
 
+async def ensure_indexes():
+    try:
+        logger.info("Ensuring MongoDB indexes")
+        await projects_col.create_index([("owner_api_key", 1), ("project_name", 1)])
+        for collection in (chats_col, strands_col, summaries_col):
+            await collection.create_index([("owner_api_key", 1), ("project_name", 1), ("timestamp", -1)])
+        # Looked up by a retried background update; only strands written by the job queue carry one
+        await strands_col.create_index([("owner_api_key", 1), ("project_name", 1), ("update_id", 1)], sparse=True)
+        logger.info("MongoDB indexes ensured")
+    except Exception as e:
+        logger.error(f"Failed to ensure MongoDB indexes: {e}")
+        raise
+
+
+@metrics.timed("mongo.project_exists")
+async def project_exists(api_key, project_name):
+    project = await projects_col.find_one(
+        {"owner_api_key": api_key, "project_name": project_name},
+        {"_id": 1}
+    )
+    return project is not None
+
+
+# Per-namespace counter bumped whenever strands are indexed, so every process's retrieval cache
+# can tell that a write happened elsewhere (the vector namespace is the project name)
+@metrics.timed("mongo.get_retrieval_generation")
+async def get_retrieval_generation(project_name):
+    doc = await retrieval_generations_col.find_one({"_id": project_name})
+    return doc["generation"] if doc else 0
+
+
+@metrics.timed("mongo.bump_retrieval_generation")
+async def bump_retrieval_generation(project_name):
+    await retrieval_generations_col.update_one({"_id": project_name}, {"$inc": {"generation": 1}}, upsert=True)
+
+
 def validate_api_key(api_key):
     if not api_key or not isinstance(api_key, str):
         return False
@@ -44,7 +90,8 @@ def validate_content(content):
     return len(content.strip()) > 0 and len(content) <= 10000
 
 
-def create_api_key():
+@metrics.timed("mongo.create_api_key")
+async def create_api_key():
     try:
         logger.info("Creating API key")
         api_key = "rcll_" + str(uuid.uuid4())
@@ -53,7 +100,7 @@ def create_api_key():
             "created_at": datetime.now(),
             "projects": []
         }
-        users_col.insert_one(user_doc)
+        await users_col.insert_one(user_doc)
         logger.info("API key created successfully")
         return api_key
     except Exception as e:
@@ -61,7 +108,8 @@ def create_api_key():
         raise
 
 
-def create_project(api_key, project_name):
+@metrics.timed("mongo.create_project")
+async def create_project(api_key, project_name):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -72,7 +120,7 @@ def create_project(api_key, project_name):
             return {"error": "Invalid project name. Must be 1-100 chars, alphanumeric, underscore, or hyphen only"}
         
         logger.info(f"Creating project: {project_name} for user: {api_key}")
-        existing = projects_col.find_one({"owner_api_key": api_key, "project_name": project_name})
+        existing = await projects_col.find_one({"owner_api_key": api_key, "project_name": project_name})
         if existing:
             logger.warning(f"Project {project_name} already exists for user {api_key}")
             return {"error": "Project with this name already exists for this user."}
@@ -81,12 +129,11 @@ def create_project(api_key, project_name):
             "owner_api_key": api_key,
             "project_name": project_name,
             "created_at": datetime.now(),
-            "memory_strands": [],
-            "summaries": [{"summary": "", "timestamp": datetime.now()}],
-            "chat_history": []
+            "recent_chats": [],
+            "latest_summary": ""
         }
-        result = projects_col.insert_one(project_doc)
-        users_col.update_one(
+        result = await projects_col.insert_one(project_doc)
+        await users_col.update_one(
             {"api_key": api_key},
             {"$push": {"projects": result.inserted_id}}
         )
@@ -97,7 +144,8 @@ def create_project(api_key, project_name):
         raise
 
 
-def add_memory(api_key, project_name, content):
+@metrics.timed("mongo.add_memory")
+async def add_memory(api_key, project_name, content):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -112,27 +160,102 @@ def add_memory(api_key, project_name, content):
             return {"error": "Content must be a non-empty string with max 10000 characters"}
         
         logger.info(f"Adding memory to project: {project_name}")
-        memory_obj = {
+        if not await project_exists(api_key, project_name):
+            logger.warning(f"Project {project_name} not found for user")
+            return {"error": "Project not found"}
+
+        memory_doc = {
+            "owner_api_key": api_key,
+            "project_name": project_name,
             "content": content.strip(),
             "timestamp": datetime.now()
         }
-        result = projects_col.update_one(
-            {"owner_api_key": api_key, "project_name": project_name},
-            {"$push": {"memory_strands": memory_obj}}
-        )
+        result = await strands_col.insert_one(memory_doc)
+        logger.info("Memory added successfully")
+        return {"inserted_id": str(result.inserted_id)}
+    except Exception as e:
+        logger.error(f"Failed to add memory to project {project_name}: {e}")
+        raise
+
+
+@metrics.timed("mongo.add_memories")
+async def add_memories(api_key, project_name, contents, update_keys=None):
+    # update_keys, if given, holds an (update id, index) pair per strand. Such strands are stored under
+    # ids built from them with $setOnInsert, so writing the same update again stores nothing twice.
+    try:
+        if not validate_api_key(api_key):
+            logger.error("Invalid API key format")
+            return {"error": "Invalid API key format"}
+        
+        if not validate_project_name(project_name):
+            logger.error("Invalid project name")
+            return {"error": "Invalid project name"}
         
-        if result.matched_count == 0:
+        valid = [i for i, content in enumerate(contents) if validate_content(content)]
+        valid_contents = [contents[i].strip() for i in valid]
+        if len(valid_contents) != len(contents):
+            logger.warning(f"Skipping {len(contents) - len(valid_contents)} invalid memory strands")
+        if not valid_contents:
+            return {"inserted_ids": []}
+        
+        logger.info(f"Adding {len(valid_contents)} memories to project: {project_name}")
+        if not await project_exists(api_key, project_name):
             logger.warning(f"Project {project_name} not found for user")
             return {"error": "Project not found"}
-        
-        logger.info("Memory added successfully")
-        return {"modified_count": result.modified_count}
+
+        timestamp = datetime.now()
+        if update_keys is not None:
+            strand_ids, operations = [], []
+            for i, content in zip(valid, valid_contents):
+                update_id, index = update_keys[i]
+                strand_ids.append(f"{update_id}:{index}")
+                operations.append(UpdateOne({"_id": strand_ids[-1]}, {"$setOnInsert": {
+                    "owner_api_key": api_key,
+                    "project_name": project_name,
+                    "update_id": update_id,
+                    "content": content,
+                    "timestamp": timestamp
+                }}, upsert=True))
+            await strands_col.bulk_write(operations, ordered=False)
+            logger.info("Memories added successfully")
+            return {"inserted_ids": strand_ids}
+
+        memory_docs = [
+            {
+                "owner_api_key": api_key,
+                "project_name": project_name,
+                "content": content,
+                "timestamp": timestamp
+            }
+            for content in valid_contents
+        ]
+        result = await strands_col.insert_many(memory_docs, ordered=False)
+        logger.info("Memories added successfully")
+        return {"inserted_ids": [str(inserted_id) for inserted_id in result.inserted_ids]}
     except Exception as e:
-        logger.error(f"Failed to add memory to project {project_name}: {e}")
+        logger.error(f"Failed to add memories to project {project_name}: {e}")
         raise
 
 
-def add_chat(api_key, project_name, user_msg, assistant_msg):
+@metrics.timed("mongo.get_update_strands")
+async def get_update_strands(api_key, project_name, update_ids):
+    # Strands already stored for these updates by add_memories, as {update id: [(strand id, content)]}
+    try:
+        cursor = strands_col.find(
+            {"owner_api_key": api_key, "project_name": project_name, "update_id": {"$in": list(update_ids)}},
+            {"_id": 1, "update_id": 1, "content": 1}
+        )
+        stored = {}
+        for doc in await cursor.to_list(length=None):
+            stored.setdefault(doc["update_id"], []).append((doc["_id"], doc["content"]))
+        return stored
+    except Exception as e:
+        logger.error(f"Failed to get stored strands for project {project_name}: {e}")
+        raise
+
+
+@metrics.timed("mongo.add_chat")
+async def add_chat(api_key, project_name, user_msg, assistant_msg):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -155,23 +278,32 @@ def add_chat(api_key, project_name, user_msg, assistant_msg):
             "user": user_msg.strip(),
             "assistant": assistant_msg.strip()
         }
-        result = projects_col.update_one(
+        project_result = await projects_col.update_one(
             {"owner_api_key": api_key, "project_name": project_name},
-            {"$push": {"chat_history": chat_pair}}
+            {"$push": {"recent_chats": {"$each": [chat_pair], "$slice": -RECENT_CHATS_LIMIT}}}
         )
-        
-        if result.matched_count == 0:
+        if project_result.matched_count == 0:
             logger.warning(f"Project {project_name} not found for user")
             return {"error": "Project not found"}
-        
+
+        chat_doc = {
+            "owner_api_key": api_key,
+            "project_name": project_name,
+            **chat_pair,
+            "timestamp": datetime.now()
+        }
+        result = await chats_col.insert_one(chat_doc)
         logger.info("Chat added successfully")
-        return {"modified_count": result.modified_count}
+        return {"inserted_id": str(result.inserted_id)}
     except Exception as e:
         logger.error(f"Failed to add chat to project {project_name}: {e}")
         raise
 
 
-def add_summary(api_key, project_name, summary_text):
+# projects.latest_summary is the canonical summary that every reader (recall, get_project,
+# get_latest_summary) uses; summaries keeps each version as history and is never read back
+@metrics.timed("mongo.add_summary")
+async def add_summary(api_key, project_name, summary_text):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -186,27 +318,132 @@ def add_summary(api_key, project_name, summary_text):
             return {"error": "Summary text must be a non-empty string with max 10000 characters"}
         
         logger.info(f"Adding summary to project: {project_name}")
-        summary_obj = {
-            "timestamp": datetime.now(),
-            "summary": summary_text.strip()
-        }
-        result = projects_col.update_one(
+        project_result = await projects_col.update_one(
             {"owner_api_key": api_key, "project_name": project_name},
-            {"$push": {"summaries": summary_obj}}
+            {"$set": {"latest_summary": summary_text.strip()}}
         )
-        
-        if result.matched_count == 0:
+        if project_result.matched_count == 0:
             logger.warning(f"Project {project_name} not found for user")
             return {"error": "Project not found"}
-        
+
+        summary_doc = {
+            "owner_api_key": api_key,
+            "project_name": project_name,
+            "summary": summary_text.strip(),
+            "timestamp": datetime.now()
+        }
+        result = await summaries_col.insert_one(summary_doc)
         logger.info("Summary added successfully")
-        return {"modified_count": result.modified_count}
+        return {"inserted_id": str(result.inserted_id)}
     except Exception as e:
         logger.error(f"Failed to add summary to project {project_name}: {e}")
         raise
 
 
-def get_project(api_key, project_name):
+@metrics.timed("mongo.add_chats")
+async def add_chats(api_key, project_name, chat_pairs):
+    try:
+        if not validate_api_key(api_key):
+            logger.error("Invalid API key format")
+            return {"error": "Invalid API key format"}
+        
+        if not validate_project_name(project_name):
+            logger.error("Invalid project name")
+            return {"error": "Invalid project name"}
+        
+        valid_pairs = [
+            {"user": pair["user"].strip(), "assistant": pair["assistant"].strip()}
+            for pair in chat_pairs
+            if validate_content(pair.get("user")) and validate_content(pair.get("assistant"))
+        ]
+        if len(valid_pairs) != len(chat_pairs):
+            logger.warning(f"Skipping {len(chat_pairs) - len(valid_pairs)} invalid chat pairs")
+        if not valid_pairs:
+            return {"inserted_ids": []}
+        
+        logger.info(f"Adding {len(valid_pairs)} chats to project: {project_name}")
+        project_result = await projects_col.update_one(
+            {"owner_api_key": api_key, "project_name": project_name},
+            {"$push": {"recent_chats": {"$each": valid_pairs[-RECENT_CHATS_LIMIT:], "$slice": -RECENT_CHATS_LIMIT}}}
+        )
+        if project_result.matched_count == 0:
+            logger.warning(f"Project {project_name} not found for user")
+            return {"error": "Project not found"}
+
+        # Consecutive microseconds keep the import order stable under the timestamp index
+        base_time = datetime.now()
+        chat_docs = [
+            {
+                "owner_api_key": api_key,
+                "project_name": project_name,
+                **pair,
+                "timestamp": base_time + timedelta(microseconds=i)
+            }
+            for i, pair in enumerate(valid_pairs)
+        ]
+        result = await chats_col.insert_many(chat_docs, ordered=False)
+        logger.info("Chats added successfully")
+        return {"inserted_ids": [str(inserted_id) for inserted_id in result.inserted_ids]}
+    except Exception as e:
+        logger.error(f"Failed to add chats to project {project_name}: {e}")
+        raise
+
+
+@metrics.timed("mongo.append_chat_and_get_context")
+async def append_chat_and_get_context(api_key, project_name, user_msg, assistant_msg):
+    try:
+        if not validate_api_key(api_key):
+            logger.error("Invalid API key format")
+            return {"error": "Invalid API key format"}
+        
+        if not validate_project_name(project_name):
+            logger.error("Invalid project name")
+            return {"error": "Invalid project name"}
+        
+        if not validate_content(user_msg):
+            logger.error("Invalid user message")
+            return {"error": "User message must be a non-empty string with max 10000 characters"}
+        
+        if not validate_content(assistant_msg):
+            logger.error("Invalid assistant message")
+            return {"error": "Assistant message must be a non-empty string with max 10000 characters"}
+        
+        logger.info(f"Appending chat and fetching context for project: {project_name}")
+        chat_pair = {
+            "user": user_msg.strip(),
+            "assistant": assistant_msg.strip()
+        }
+        chat_doc = {
+            "owner_api_key": api_key,
+            "project_name": project_name,
+            **chat_pair,
+            "timestamp": datetime.now()
+        }
+        # The project update returns the pre-append window of recent chats and the latest summary
+        # atomically, and doubles as the ownership check: the chat log insert only follows a match.
+        project = await projects_col.find_one_and_update(
+            {"owner_api_key": api_key, "project_name": project_name},
+            {"$push": {"recent_chats": {"$each": [chat_pair], "$slice": -RECENT_CHATS_LIMIT}}},
+            projection={"_id": 0, "recent_chats": 1, "latest_summary": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if project is None:
+            logger.warning(f"Project {project_name} not found for user")
+            return {"error": "Project not found"}
+        await chats_col.insert_one(chat_doc)
+
+        logger.info("Chat appended and context retrieved successfully")
+        return {
+            "recent_chats": project.get("recent_chats", []),
+            "summary": project.get("latest_summary", "")
+        }
+    except Exception as e:
+        logger.error(f"Failed to append chat and fetch context for project {project_name}: {e}")
+        raise
+
+
+@metrics.timed("mongo.get_project")
+async def get_project(api_key, project_name):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -217,17 +454,23 @@ def get_project(api_key, project_name):
             return {"error": "Invalid project name"}
         
         logger.info(f"Getting project: {project_name} for user: {api_key}")
-        project = projects_col.find_one(
+        project = await projects_col.find_one(
             {"owner_api_key": api_key, "project_name": project_name},
-            {"_id": 0}
+            {"_id": 0, "owner_api_key": 1, "project_name": 1, "created_at": 1, "latest_summary": 1}
         )
+        if not project:
+            logger.warning(f"Project {project_name} not found")
+            return {"error": "Project not found."}
+
+        project["summary"] = project.pop("latest_summary", "")
         logger.info("Project retrieved successfully")
-        return project or {"error": "Project not found."}
+        return project
     except Exception as e:
         logger.error(f"Failed to get project {project_name}: {e}")
         raise
 
-def get_last_three_chats(api_key, project_name):
+@metrics.timed("mongo.get_latest_summary")
+async def get_latest_summary(api_key, project_name):
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -237,23 +480,50 @@ def get_last_three_chats(api_key, project_name):
             logger.error("Invalid project name")
             return {"error": "Invalid project name"}
         
-        logger.info(f"Getting last 3 chats for project: {project_name} for user: {api_key}")
-        project = projects_col.find_one(
+        logger.info(f"Getting latest summary for project: {project_name} for user: {api_key}")
+        project = await projects_col.find_one(
             {"owner_api_key": api_key, "project_name": project_name},
-            {"_id": 0, "chat_history": {"$slice": -3}}
+            {"_id": 0, "latest_summary": 1}
         )
-        if not project or "chat_history" not in project:
-            logger.warning(f"Project {project_name} not found or no chat history")
+        logger.info("Latest summary retrieved successfully")
+        return {"summary": project.get("latest_summary", "") if project else ""}
+    except Exception as e:
+        logger.error(f"Failed to get latest summary for project {project_name}: {e}")
+        raise
+
+
+@metrics.timed("mongo.get_last_three_chats")
+async def get_last_three_chats(api_key, project_name):
+    try:
+        if not validate_api_key(api_key):
+            logger.error("Invalid API key format")
+            return {"error": "Invalid API key format"}
+        
+        if not validate_project_name(project_name):
+            logger.error("Invalid project name")
+            return {"error": "Invalid project name"}
+        
+        logger.info(f"Getting last 3 chats for project: {project_name} for user: {api_key}")
+        cursor = chats_col.find(
+            {"owner_api_key": api_key, "project_name": project_name},
+            {"_id": 0, "user": 1, "assistant": 1}
+        ).sort("timestamp", -1).limit(3)
+        chats = await cursor.to_list(length=3)
+        if not chats and not await project_exists(api_key, project_name):
+            logger.warning(f"Project {project_name} not found")
             return {"error": "Project not found or no chat history."}
         
         logger.info("Last 3 chats retrieved successfully")
-        return {"last_three_chats": project["chat_history"]}
+        return {"last_three_chats": list(reversed(chats))}
     except Exception as e:
         logger.error(f"Failed to get last 3 chats for project {project_name}: {e}")
         raise
 
 
-def get_memory_strands(api_key, project_name):
+@metrics.timed("mongo.get_memory_strands")
+async def get_memory_strands(api_key, project_name, skip=0, limit=MEMORY_STRANDS_LIMIT):
+    # Pages through the strands newest first, each page in chronological order; next_skip is where
+    # the next (older) page starts, or None once the oldest strand has been returned
     try:
         if not validate_api_key(api_key):
             logger.error("Invalid API key format")
@@ -264,17 +534,21 @@ def get_memory_strands(api_key, project_name):
             return {"error": "Invalid project name"}
         
         logger.info(f"Getting memory strands for project: {project_name} for user: {api_key}")
-        project = projects_col.find_one(
+        # One row past the page tells whether older strands remain
+        cursor = strands_col.find(
             {"owner_api_key": api_key, "project_name": project_name},
-            {"_id": 0, "memory_strands": 1}
-        )
-        if not project:
+            {"_id": 0, "content": 1, "timestamp": 1}
+        ).sort("timestamp", -1).skip(skip).limit(limit + 1)
+        memory_strands = await cursor.to_list(length=limit + 1)
+        if not memory_strands and not await project_exists(api_key, project_name):
             logger.warning(f"Project {project_name} not found")
             return {"error": "Project not found."}
         
-        memory_strands = project.get("memory_strands", [])
+        truncated = len(memory_strands) > limit
+        memory_strands = memory_strands[:limit]
+        memory_strands.reverse()
         logger.info(f"Retrieved {len(memory_strands)} memory strands successfully")
-        return {"memory_strands": memory_strands}
+        return {"memory_strands": memory_strands, "truncated": truncated, "next_skip": skip + limit if truncated else None}
     except Exception as e:
         logger.error(f"Failed to get memory strands for project {project_name}: {e}")
         raise
\ No newline at end of file
@@ -400,4 +400,173 @@ No explanations, no punctuation, no quotes.
 
 ---
 """
-    return prompt
\ No newline at end of file
+    return prompt
+
+def extraction_prompt():
+    prompt = """
+You are a memory assistant working behind the scenes of an LLM-based application.
+
+Given **the last chat pair** (assistant message + user message), you do two jobs at once:
+
+1. **questions**: write specific questions that would help fetch useful memory from a database for the assistant's next reply — preferences, past choices, history or relevant facts.
+2. **strands**: extract every meaningful statement the user made — facts, decisions, preferences, likes and dislikes, requests, goals, speculations or tentative opinions.
+
+---
+
+## Rules for questions
+
+- ONLY write questions that help the assistant respond better in the next message.
+- Keep them simple, specific and grounded in the current conversation.
+- If the user already gave a fact, don't ask about it again.
+- Do NOT hallucinate or guess new facts.
+
+## Rules for strands
+
+- Each strand is one standalone statement about the user, e.g. "The user likes pasta."
+- Do not combine multiple facts into one strand.
+- Include speculative or hedged statements ("I think", "maybe") and vague interests.
+- Do NOT extract the assistant's suggestions or questions unless the user confirmed them.
+- If the user said nothing new or meaningful, return an empty list of strands.
+
+---
+
+## Output Format
+
+Return a JSON object with exactly two keys, each a list of strings:
+{"questions": [...], "strands": [...]}
+
+---
+
+## Examples
+
+### Example 1
+
+**Assistant:** Want me to plan your meals for the week?
+**User:** Yes, but no dairy or red meat.
+
+**Output:**
+{
+  "questions": [
+    "What meals has the user liked before?",
+    "Does the user have other dietary restrictions?",
+    "Has the user mentioned preferred cuisines?"
+  ],
+  "strands": [
+    "The user wants a weekly meal plan.",
+    "The user does not eat dairy.",
+    "The user does not eat red meat."
+  ]
+}
+
+### Example 2
+
+**Assistant:** Want me to queue up some jazz?
+**User:** Jazz is okay, but I love classic rock and 90s hip hop way more.
+
+**Output:**
+{
+  "questions": [
+    "What artists or bands has the user mentioned liking?",
+    "Has the user asked for playlists before?"
+  ],
+  "strands": [
+    "The user loves classic rock.",
+    "The user loves 90s hip hop.",
+    "The user thinks jazz is okay but not a favorite."
+  ]
+}
+
+### Example 3
+
+**Assistant:** Should I adjust your workout based on yesterday?
+**User:** What did I do yesterday again?
+
+**Output:**
+{
+  "questions": [
+    "What workout did the user do yesterday?",
+    "What types of workouts does the user usually prefer?"
+  ],
+  "strands": []
+}
+
+---
+
+## Final Instructions
+
+- Return ONLY the JSON object.
+- Strands must reflect only what the user confirmed, requested, or tentatively proposed.
+"""
+    return prompt
+
+def batch_deduplicate_strands_prompt():
+    prompt = """
+You are a world-class expert at detecting meaning-level duplicates.
+
+## Inputs
+A JSON list of **candidates**. Each candidate has:
+- **id**: an integer identifying the candidate.
+- **strand**: a single factual statement that is about to be stored.
+- **similar**: a list of semantically similar strands. These are existing strands retrieved via vector search, and may also include other new strands extracted alongside this one.
+
+## Task
+For **every** candidate, decide if its **strand** is a *duplicate in meaning* of **any** item in its **similar** list.
+
+- Verdict **"fail"** if the strand conveys the **same essential fact(s)** as any one of its similar strands (even if wording, order, or style differ).
+- Verdict **"pass"** if the strand contributes **materially new information** or differs in **substance** (not just wording) from **all** of its similar strands.
+
+Judge each candidate independently, against its own **similar** list only.
+
+## How to Judge "Same Meaning"
+Treat as the **same** (→ fail) when differences are only:
+- Synonyms, paraphrases, tense/voice changes, or minor rephrasings
+- Formatting differences (lists vs sentence), pronouns vs names, or trivial specificity (e.g., “NYC” vs “New York City” if context clearly identical)
+- Reordered clauses that don’t change the facts
+- Minor style/typo differences
+
+Treat as **different** (→ pass) when the strand:
+- Adds or changes **key facts** (numbers, dates, locations, actors, conditions, outcomes)
+- Narrows or broadens meaning in a **substantive** way (subset/superset with **material** new info)
+- Contradicts a similar strand
+- Refers to a **different entity** or objective (even if the domain is similar)
+
+## Edge Rules
+- Numbers/dates/metrics matter: if they differ meaningfully, consider **pass**.
+- “Subset vs superset”: if the strand adds **non-trivial** details not present anywhere in its list, **pass**. If it merely restates what’s already covered, **fail**.
+- Ambiguity: if a reasonable reader would treat them as the **same fact**, **fail**; otherwise **pass**.
+
+## Example
+
+Input:
+[
+  {
+    "id": 0,
+    "strand": "The user plans to build a tool that speeds up legal brief drafting for public defenders.",
+    "similar": ["The user wants to build a tool to help public defenders generate legal briefs faster."]
+  },
+  {
+    "id": 2,
+    "strand": "The user wants a tool to help public defenders draft appeals faster.",
+    "similar": ["The user wants to build a tool to help public defenders generate legal briefs faster."]
+  },
+  {
+    "id": 3,
+    "strand": "The team aims to reduce drafting time by 50%.",
+    "similar": ["The team aims to reduce drafting time by 10%.", "The team wants drafting to take half as long."]
+  }
+]
+
+Output:
+{
+  "verdicts": [
+    {"id": 0, "verdict": "fail"},
+    {"id": 2, "verdict": "pass"},
+    {"id": 3, "verdict": "fail"}
+  ]
+}
+
+## Final Instructions
+- Return ONLY a JSON object with one verdict per candidate, using the candidate's id.
+- No explanations.
+"""
+    return prompt
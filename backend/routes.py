@@ -1,14 +1,26 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from .schemas import ProjectCreate, MemoryStrandCreate, ChatCreate, SummaryCreate, RecallRequest
 from .models import (
     create_api_key, create_project, add_memory, add_chat, add_summary, 
-    get_project, get_last_three_chats, get_memory_strands
+    get_project, get_last_three_chats, get_memory_strands,
+    project_exists, validate_api_key, validate_project_name, MEMORY_STRANDS_LIMIT
 )
-from .utils import recall
+from .ingest import ingest_chats, ingest_memories
+from .utils import recall, recall_stream, dedup_counters, summary_debouncer, background_submitter, RECALL_MODES
+from .jobs import JobSubmitter, get_job_queue
+from .context_builder import CONTEXT_FORMATS
+from .memory.embedding_cache import embedding_cache
+from .background import background_executor
+from .memory.client_pool import openai_client_pool
+from .memory.retrieval_cache import retrieval_cache
+from .memory import resilience
+from . import metrics
 import json
 import logging
+from typing import Optional
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -16,11 +28,22 @@ logger = logging.getLogger(__name__)
 limiter = Limiter(key_func=get_remote_address)
 router = APIRouter()
 
+metrics.register_stats({
+    "embedding_cache": embedding_cache.stats,
+    "retrieval_cache": retrieval_cache.stats,
+    "background": background_executor.stats,
+    "summaries": summary_debouncer.stats,
+    "openai_clients": openai_client_pool.stats,
+    "dedup": lambda: dict(dedup_counters),
+    "resilience": resilience.stats,
+    **({"jobs": background_submitter.stats} if isinstance(background_submitter, JobSubmitter) else {})
+})
+
 @router.post("/project/create")
 @limiter.limit("10/minute")
 async def create_project_endpoint(request: Request, data: ProjectCreate):
     logger.info(f"Create project request for: {data.project_name}")
-    result = create_project(data.api_key, data.project_name)
+    result = await create_project(data.api_key, data.project_name)
     if "error" in result:
         logger.error(f"Failed to create project {data.project_name}: {result['error']}")
         raise HTTPException(status_code=400, detail=result["error"])
@@ -31,9 +54,9 @@ async def create_project_endpoint(request: Request, data: ProjectCreate):
 @limiter.limit("50/minute")
 async def add_memory_endpoint(request: Request, data: MemoryStrandCreate):
     logger.info(f"Add memory request for project: {data.project_name}")
-    result = add_memory(data.api_key, data.project_name, data.memory_strand)
-    if result["modified_count"] == 0:
-        logger.error(f"Failed to add memory to project {data.project_name}")
+    result = await add_memory(data.api_key, data.project_name, data.memory_strand)
+    if "error" in result:
+        logger.error(f"Failed to add memory to project {data.project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail="Project not found or memory not added")
     logger.info(f"Memory added to project {data.project_name}")
     return {"success": True, "message": "Memory strand added successfully"}
@@ -42,9 +65,9 @@ async def add_memory_endpoint(request: Request, data: MemoryStrandCreate):
 @limiter.limit("100/minute")
 async def add_chat_endpoint(request: Request, data: ChatCreate):
     logger.info(f"Add chat request for project: {data.project_name}")
-    result = add_chat(data.api_key, data.project_name, data.user_message, data.assistant_message)
-    if result["modified_count"] == 0:
-        logger.error(f"Failed to add chat to project {data.project_name}")
+    result = await add_chat(data.api_key, data.project_name, data.user_message, data.assistant_message)
+    if "error" in result:
+        logger.error(f"Failed to add chat to project {data.project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail="Project not found or chat not added")
     logger.info(f"Chat added to project {data.project_name}")
     return {"success": True, "message": "Chat pair added successfully"}
@@ -53,18 +76,56 @@ async def add_chat_endpoint(request: Request, data: ChatCreate):
 @limiter.limit("20/minute")
 async def add_summary_endpoint(request: Request, data: SummaryCreate):
     logger.info(f"Add summary request for project: {data.project_name}")
-    result = add_summary(data.api_key, data.project_name, data.summary)
-    if result["modified_count"] == 0:
-        logger.error(f"Failed to add summary to project {data.project_name}")
+    result = await add_summary(data.api_key, data.project_name, data.summary)
+    if "error" in result:
+        logger.error(f"Failed to add summary to project {data.project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail="Project not found or summary not added")
     logger.info(f"Summary added to project {data.project_name}")
     return {"success": True, "message": "Summary added successfully"}
 
+async def validate_bulk_target(api_key: str, project_name: str):
+    if not validate_api_key(api_key):
+        raise HTTPException(status_code=400, detail="Invalid API key format")
+    if not validate_project_name(project_name):
+        raise HTTPException(status_code=400, detail="Invalid project name")
+    if not await project_exists(api_key, project_name):
+        logger.error(f"Bulk ingest target project {project_name} not found")
+        raise HTTPException(status_code=404, detail="Project not found")
+
+# Bulk endpoints take an NDJSON body (one chat or strand object per line) and read it as a stream,
+# writing every BULK_BATCH_SIZE valid rows; the per-row report is returned once the body is consumed
+@router.post("/chat/bulk")
+@limiter.limit("30/minute")
+async def bulk_add_chats(request: Request, api_key: str, project_name: str):
+    logger.info(f"Bulk chat ingest request for project: {project_name}")
+    await validate_bulk_target(api_key, project_name)
+    try:
+        report = await ingest_chats(api_key, project_name, request.stream())
+    except Exception as e:
+        logger.error(f"Bulk chat ingest failed for project {project_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error ingesting chats: {str(e)}")
+    logger.info(f"Bulk chat ingest for project {project_name}: {report['inserted']} inserted, {report['failed']} failed")
+    return report
+
+@router.post("/memory/bulk")
+@limiter.limit("30/minute")
+async def bulk_add_memories(request: Request, api_key: str, project_name: str,
+                            openai_key: Optional[str] = Header(None, alias="X-OpenAI-Key")):
+    logger.info(f"Bulk memory ingest request for project: {project_name}")
+    await validate_bulk_target(api_key, project_name)
+    try:
+        report = await ingest_memories(api_key, project_name, request.stream(), openai_key=openai_key)
+    except Exception as e:
+        logger.error(f"Bulk memory ingest failed for project {project_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error ingesting memory strands: {str(e)}")
+    logger.info(f"Bulk memory ingest for project {project_name}: {report['inserted']} inserted, {report['failed']} failed")
+    return report
+
 @router.get("/chat/recent")
 @limiter.limit("30/minute")
 async def get_recent_chats(request: Request, api_key: str, project_name: str):
     logger.info(f"Get recent chats request for project: {project_name}")
-    result = get_last_three_chats(api_key, project_name)
+    result = await get_last_three_chats(api_key, project_name)
     if "error" in result:
         logger.error(f"Failed to get recent chats for project {project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail=result["error"])
@@ -75,7 +136,7 @@ async def get_recent_chats(request: Request, api_key: str, project_name: str):
 @limiter.limit("20/minute")
 async def get_project_info(request: Request, api_key: str, project_name: str):
     logger.info(f"Get project info request for: {project_name}")
-    result = get_project(api_key, project_name)
+    result = await get_project(api_key, project_name)
     if "error" in result:
         logger.error(f"Failed to get project {project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail=result["error"])
@@ -84,24 +145,54 @@ async def get_project_info(request: Request, api_key: str, project_name: str):
 
 @router.get("/memory/all")
 @limiter.limit("30/minute")
-async def get_all_memory_strands(request: Request, api_key: str, project_name: str):
+async def get_all_memory_strands(request: Request, api_key: str, project_name: str, skip: int = 0,
+                                 limit: int = MEMORY_STRANDS_LIMIT):
     logger.info(f"Get all memory strands request for project: {project_name}")
-    result = get_memory_strands(api_key, project_name)
+    if skip < 0 or not 0 < limit <= MEMORY_STRANDS_LIMIT:
+        logger.error(f"Invalid strand page skip={skip} limit={limit} for project {project_name}")
+        raise HTTPException(status_code=400, detail=f"skip must be >= 0 and limit between 1 and {MEMORY_STRANDS_LIMIT}")
+    result = await get_memory_strands(api_key, project_name, skip, limit)
     if "error" in result:
         logger.error(f"Failed to get memory strands for project {project_name}: {result['error']}")
         raise HTTPException(status_code=404, detail=result["error"])
     logger.info(f"Memory strands retrieved for project {project_name}")
     return result
 
+def validate_recall_mode(data: RecallRequest):
+    if data.mode not in RECALL_MODES:
+        logger.error(f"Invalid recall mode {data.mode} for project {data.project_name}")
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Must be one of: {', '.join(RECALL_MODES)}")
+    if data.latency_budget_ms is not None and data.latency_budget_ms <= 0:
+        logger.error(f"Invalid latency budget {data.latency_budget_ms} for project {data.project_name}")
+        raise HTTPException(status_code=400, detail="latency_budget_ms must be positive")
+    if data.token_budget is not None and data.token_budget <= 0:
+        logger.error(f"Invalid token budget {data.token_budget} for project {data.project_name}")
+        raise HTTPException(status_code=400, detail="token_budget must be positive")
+    if data.format not in CONTEXT_FORMATS:
+        logger.error(f"Invalid context format {data.format} for project {data.project_name}")
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(CONTEXT_FORMATS)}")
+
 @router.post("/recall")
 @limiter.limit("30/minute")
-async def recall_memory(request: Request, data: RecallRequest):
+async def recall_memory(request: Request, response: Response, data: RecallRequest):
     logger.info(f"Recall request for project: {data.project_name}")
+    validate_recall_mode(data)
     try:
         chat_pair = data.chat_pair
-        result = recall(data.api_key, data.project_name, chat_pair, data.openai_key)
-        logger.info(f"Recall completed for project {data.project_name}")
-        return result
+        result = await recall(
+            data.api_key, data.project_name, chat_pair, data.openai_key,
+            mode=data.mode, latency_budget_ms=data.latency_budget_ms,
+            token_budget=data.token_budget, output_format=data.format
+        )
+        response.headers["X-Recall-Path"] = result["path"]
+        response.headers["X-Context-Tokens"] = str(result["tokens"])
+        logger.info(f"Recall completed for project {data.project_name} via {result['path']} path in {result['tokens']} tokens")
+        if data.format == "json":
+            # Already serialized compactly by the context builder, so it is sent as is
+            return Response(content=result["context"], media_type="application/json", headers={
+                "X-Recall-Path": result["path"], "X-Context-Tokens": str(result["tokens"])
+            })
+        return result["context"]
     except json.JSONDecodeError:
         logger.error(f"Invalid JSON format in recall request for project {data.project_name}")
         raise HTTPException(status_code=400, detail="Invalid chat_pair JSON format")
@@ -109,11 +200,49 @@ async def recall_memory(request: Request, data: RecallRequest):
         logger.error(f"Error processing recall for project {data.project_name}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing recall: {str(e)}")
 
+def format_stream_event(event, sse: bool):
+    payload = json.dumps(event["data"], default=str)
+    if sse:
+        return f"event: {event['event']}\ndata: {payload}\n\n"
+    return json.dumps({"event": event["event"], "data": event["data"]}, default=str) + "\n"
+
+@router.post("/recall/stream")
+@limiter.limit("30/minute")
+async def recall_memory_stream(request: Request, data: RecallRequest):
+    logger.info(f"Streaming recall request for project: {data.project_name}")
+    validate_recall_mode(data)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    events = recall_stream(
+        data.api_key, data.project_name, data.chat_pair, data.openai_key,
+        mode=data.mode, latency_budget_ms=data.latency_budget_ms
+    )
+    try:
+        # Pull the first section before responding so setup failures still map to an HTTP error
+        first_event = await events.__anext__()
+    except Exception as e:
+        logger.error(f"Error processing streaming recall for project {data.project_name}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing recall: {str(e)}")
+
+    async def body():
+        yield format_stream_event(first_event, sse)
+        try:
+            async for event in events:
+                yield format_stream_event(event, sse)
+            logger.info(f"Streaming recall completed for project {data.project_name}")
+        except Exception as e:
+            logger.error(f"Error during streaming recall for project {data.project_name}: {str(e)}")
+            yield format_stream_event({"event": "error", "data": f"Error processing recall: {str(e)}"}, sse)
+        finally:
+            await events.aclose()
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
 @router.post("/apikey/create")
 @limiter.limit("5/minute")
 async def create_api_key_endpoint(request: Request):
     logger.info("API key creation request")
-    api_key = create_api_key()
+    api_key = await create_api_key()
     logger.info("API key created successfully")
     return {"api_key": api_key, "message": "API key created successfully"}
 
@@ -122,3 +251,26 @@ async def create_api_key_endpoint(request: Request):
 async def health_check(request: Request):
     logger.info("Health check request")
     return {"status": "healthy", "service": "reca11-memory"}
+
+@router.get("/stats")
+@limiter.limit("60/minute")
+async def get_stats(request: Request):
+    logger.info("Stats request")
+    stats = {
+        "embedding_cache": embedding_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "background": background_executor.stats(),
+        "summaries": summary_debouncer.stats(),
+        "openai_clients": openai_client_pool.stats(),
+        "dedup": dict(dedup_counters),
+        "resilience": resilience.stats()
+    }
+    if isinstance(background_submitter, JobSubmitter):
+        stats["jobs"] = {**background_submitter.stats(), "queue": await get_job_queue().counts()}
+    return stats
+
+@router.get("/metrics")
+@limiter.limit("60/minute")
+async def get_metrics(request: Request):
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
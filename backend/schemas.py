@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 from pydantic import BaseModel
 
 class ProjectCreate(BaseModel):
@@ -26,5 +26,9 @@ class RecallRequest(BaseModel):
     openai_key: str
     project_name: str
     chat_pair: Dict[str, str]
+    mode: str = "auto"
+    latency_budget_ms: Optional[int] = None
+    token_budget: Optional[int] = None
+    format: str = "text"
 
 
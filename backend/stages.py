@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_REQUIRED = object()
+
+
+class _Stage:
+    def __init__(self, name, fn, deps, fallback):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.fallback = fallback
+
+
+# Runs async stages as a dependency graph. Each stage starts as soon as every stage it depends on has
+# finished and is called with their results as keyword arguments, so independent stages overlap and
+# the critical path is the slowest chain instead of the sum of all stages. Once the deadline passes,
+# stages that have a fallback are cancelled (or never started) and resolve to it; stages without one
+# are awaited. A stage that raises cancels everything still running and its exception propagates.
+class StageGraph:
+    def __init__(self):
+        self._stages = {}
+
+    def add(self, name: str, fn, deps=(), fallback=_REQUIRED):
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        # Dependencies must already be in the graph, which also keeps it acyclic
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self._stages[name] = _Stage(name, fn, deps, fallback)
+        return self
+
+    async def iter(self, deadline=None):
+        # Yields (name, result) for each stage as it finishes; deadline is an event loop time
+        loop = asyncio.get_running_loop()
+        results = {}
+        waiting = list(self._stages.values())
+        running = {}
+        cancelled = []
+        expired = False
+        try:
+            while waiting or running:
+                ready = [stage for stage in waiting if all(dep in results for dep in stage.deps)]
+                skipped = []
+                for stage in ready:
+                    waiting.remove(stage)
+                    if expired and stage.fallback is not _REQUIRED:
+                        skipped.append(stage)
+                        continue
+                    args = {dep: results[dep] for dep in stage.deps}
+                    running[asyncio.create_task(stage.fn(**args))] = stage
+                if skipped:
+                    for stage in skipped:
+                        logger.warning(f"Skipping stage {stage.name}, the deadline has passed")
+                        results[stage.name] = stage.fallback
+                        yield stage.name, stage.fallback
+                    continue
+
+                timeout = None if expired or deadline is None else max(deadline - loop.time(), 0.0)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    expired = True
+                    for task, stage in list(running.items()):
+                        if stage.fallback is _REQUIRED:
+                            continue
+                        logger.warning(f"Cancelling stage {stage.name}, the deadline has passed")
+                        task.cancel()
+                        cancelled.append(task)
+                        del running[task]
+                        results[stage.name] = stage.fallback
+                        yield stage.name, stage.fallback
+                    continue
+
+                for task in done:
+                    stage = running.pop(task)
+                    results[stage.name] = task.result()
+                    yield stage.name, results[stage.name]
+        finally:
+            for task in running:
+                task.cancel()
+            if running or cancelled:
+                await asyncio.gather(*running, *cancelled, return_exceptions=True)
+
+    async def run(self, deadline=None):
+        return {name: result async for name, result in self.iter(deadline)}
@@ -1,15 +1,95 @@
-import threading
+import os
+import json
+import time
+import uuid
+import asyncio
 import logging
-from typing import List, Dict
-from .models import get_last_three_chats, get_project, add_chat, add_summary, add_memory
-from .prompts import summary_prompt, strands_prompt, generate_questions_prompt, deduplicate_strands_prompt
-from .memory.rag_utils import retrieve, upsert_strands, retrieve_for_deduplication
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+from .models import (
+    append_chat_and_get_context, get_latest_summary, add_summary, add_memories, validate_content,
+    get_update_strands, get_retrieval_generation, bump_retrieval_generation
+)
+from .prompts import summary_prompt, strands_prompt, generate_questions_prompt, deduplicate_strands_prompt, extraction_prompt, batch_deduplicate_strands_prompt
+from .memory.rag_utils import retrieve, iter_question_results, merge_facts, upsert_strands, retrieve_for_deduplication
 from .memory.llm_utils import LLMUtils 
+from .memory.resilience import within, UpstreamError
+from .background import background_executor, Debouncer
+from .jobs import BACKGROUND_MODE, JobSubmitter, PayloadsFailed
+from . import metrics
+from .context_builder import build_context
+from .stages import StageGraph
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def regenerate_summary(past_summary: str, new_facts: List[str], generate_response):
+load_dotenv()
+
+# Nearest-neighbour similarity below DEDUP_ACCEPT_BELOW keeps a strand and at or above
+# DEDUP_REJECT_ABOVE drops it, without asking the LLM; only the band in between is judged.
+DEDUP_ACCEPT_BELOW = float(os.getenv("DEDUP_ACCEPT_BELOW", "0.55"))
+DEDUP_REJECT_ABOVE = float(os.getenv("DEDUP_REJECT_ABOVE", "0.95"))
+
+dedup_counters = Counter()
+
+# "batched" judges all strands of a background update in one structured LLM call and also compares
+# them with each other; "per_strand" makes one LLM call per strand that needs judging
+DEDUP_MODES = ("per_strand", "batched")
+DEDUP_MODE = os.getenv("DEDUP_MODE", "per_strand")
+if DEDUP_MODE not in DEDUP_MODES:
+    raise ValueError(f"Unknown DEDUP_MODE: {DEDUP_MODE}")
+
+BATCH_DEDUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "verdicts": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "verdict": {"type": "string", "enum": ["pass", "fail"]}
+                },
+                "required": ["id", "verdict"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["verdicts"],
+    "additionalProperties": False
+}
+
+SUMMARY_EVERY_N_STRANDS = int(os.getenv("SUMMARY_EVERY_N_STRANDS", "5"))
+SUMMARY_MAX_DELAY_SECONDS = float(os.getenv("SUMMARY_MAX_DELAY_SECONDS", "120"))
+
+# "combined" asks for the retrieval questions and the chat pair's memory strands in one structured
+# call during recall and hands the strands to the background update; "separate" makes one call for each
+EXTRACTION_MODES = ("separate", "combined")
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "separate")
+if EXTRACTION_MODE not in EXTRACTION_MODES:
+    raise ValueError(f"Unknown EXTRACTION_MODE: {EXTRACTION_MODE}")
+
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {"type": "array", "items": {"type": "string"}},
+        "strands": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["questions", "strands"],
+    "additionalProperties": False
+}
+
+RECALL_MODES = ("auto", "full", "fast")
+# Time kept back from a recall's latency budget for embedding and querying the retrieval questions
+FAST_RECALL_RESERVE_MS = float(os.getenv("FAST_RECALL_RESERVE_MS", "300"))
+# Stages that stop at the latency budget on their own (retrieval returns what it has) get this long
+# past it before the recall's stage graph cancels them
+RECALL_DEADLINE_GRACE_MS = float(os.getenv("RECALL_DEADLINE_GRACE_MS", "100"))
+
+@metrics.timed("regenerate_summary")
+async def regenerate_summary(past_summary: str, new_facts: List[str], generate_response):
     try:
         logger.info("Regenerating summary")
         prompt = summary_prompt()
@@ -18,153 +98,493 @@ def regenerate_summary(past_summary: str, new_facts: List[str], generate_respons
         Here are the new facts: {new_facts}
         """
 
-        summary = generate_response(prompt, user_prompt)
+        summary = await generate_response(prompt, user_prompt)
         logger.info("Summary regenerated successfully")
         return summary
     except Exception as e:
         logger.error(f"Failed to regenerate summary: {e}")
         raise
 
-def generate_strands(chat_pair: Dict[str, str], generate_response):
+@metrics.timed("generate_strands")
+async def generate_strands(chat_pair: Dict[str, str], generate_response):
     try:
         logger.info("Generating strands")
         prompt = strands_prompt()
         user_prompt = f"""
         Here is the chat pair: {chat_pair}
         """
-        strands = generate_response(prompt, user_prompt, ast_parse_response=True)
+        strands = await generate_response(prompt, user_prompt, ast_parse_response=True)
         logger.info(f"Generated {len(strands) if strands else 0} strands successfully")
         return strands
     except Exception as e:
         logger.error(f"Failed to generate strands: {e}")
         raise
 
-def generate_questions(chat_pair: Dict[str, str], generate_response):
+@metrics.timed("generate_questions")
+async def generate_questions(chat_pair: Dict[str, str], generate_response):
     try:
         logger.info("Generating questions")
         prompt = generate_questions_prompt()
         user_prompt = f"""
         Here is the chat pair: {chat_pair}
         """
-        questions = generate_response(prompt, user_prompt, ast_parse_response=True)
+        questions = await generate_response(prompt, user_prompt, ast_parse_response=True)
         logger.info(f"Generated {len(questions) if questions else 0} questions successfully")
         return questions
     except Exception as e:
         logger.error(f"Failed to generate questions: {e}")
         raise
 
-def deduplicate_strands(strand, project_name: str, embed, generate_response):
+@metrics.timed("extract")
+async def generate_questions_and_strands(chat_pair: Dict[str, str], generate_structured):
+    try:
+        logger.info("Generating questions and strands")
+        user_prompt = f"""
+        Here is the chat pair: {chat_pair}
+        """
+        extracted = await generate_structured(extraction_prompt(), user_prompt, EXTRACTION_SCHEMA, "memory_extraction")
+        if not isinstance(extracted, dict) or not all(isinstance(extracted.get(key), list) for key in ("questions", "strands")):
+            raise ValueError("Extraction did not return questions and strands lists")
+        questions = [question for question in extracted["questions"] if validate_content(question)]
+        strands = [strand for strand in extracted["strands"] if validate_content(strand)]
+        logger.info(f"Generated {len(questions)} questions and {len(strands)} strands successfully")
+        return questions, strands
+    except Exception as e:
+        logger.error(f"Failed to generate questions and strands: {e}")
+        raise
+
+@metrics.timed("dedup")
+async def deduplicate_strands(strand, embedding, project_name: str, generate_response):
     try:
         logger.info(f"Deduplicating strand for project: {project_name}")
-        semantically_similar_strands = retrieve_for_deduplication(strand, project_name, embed)
-        if not semantically_similar_strands:
+        neighbours = await retrieve_for_deduplication(embedding, project_name)
+        if not neighbours:
             logger.info("No semantically similar strands found, some error in retrieval")
+            dedup_counters["empty"] += 1
             return "pass"
         
-        logger.info(f"Found {len(semantically_similar_strands)} semantically similar strands")
-        
+        logger.info(f"Found {len(neighbours)} semantically similar strands")
+        top_score = max(neighbour["score"] for neighbour in neighbours)
+        if top_score < DEDUP_ACCEPT_BELOW:
+            logger.info(f"Top similarity {top_score:.3f} below {DEDUP_ACCEPT_BELOW}, accepting without LLM")
+            dedup_counters["auto_accept"] += 1
+            return "pass"
+        if top_score >= DEDUP_REJECT_ABOVE:
+            logger.info(f"Top similarity {top_score:.3f} at or above {DEDUP_REJECT_ABOVE}, rejecting without LLM")
+            dedup_counters["auto_reject"] += 1
+            return "fail"
+
+        semantically_similar_strands = [neighbour["fact_text"] for neighbour in neighbours]
+        dedup_counters["llm"] += 1
         logger.info("Sending to LLM for deduplication")
         prompt = deduplicate_strands_prompt()
         user_prompt = f"""
         Here is the strand: {strand}
         Here are the semantically similar strands: {semantically_similar_strands}
         """
-        strand_status = generate_response(prompt, user_prompt, ast_parse_response=False)
+        strand_status = await generate_response(prompt, user_prompt, ast_parse_response=False)
         logger.info("Checked strand successfully")
         return strand_status
     except Exception as e:
         logger.error(f"Failed to check strand for duplication: {e}")
+        dedup_counters["error"] += 1
         return "pass"
 
-def recall(api_key: str, project_name: str, chat_pair: Dict[str, str], openai_key: str):
-    try:
-        logger.info(f"Starting recall for project: {project_name}")
-        llm = LLMUtils(api_key=openai_key)
+@metrics.timed("dedup")
+async def deduplicate_strands_batch(strands: List[str], embeddings: List[List[float]], project_name: str, generate_structured):
+    # Returns a "pass"/"fail" status per strand using at most one LLM call. Each strand's neighbours are
+    # its nearest stored strands plus the earlier strands of the batch, so the same thresholds as
+    # deduplicate_strands decide which strands are settled by similarity and which the LLM judges.
+    logger.info(f"Deduplicating {len(strands)} strands in one batch for project: {project_name}")
+    stored = await asyncio.gather(
+        *(retrieve_for_deduplication(embedding, project_name) for embedding in embeddings), return_exceptions=True
+    )
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarities = vectors @ vectors.T
 
-        recent_chats_result = get_last_three_chats(api_key, project_name)
-        if "error" in recent_chats_result:
-            logger.warning(f"Could not retrieve recent chats: {recent_chats_result['error']}")
-            recent_chats = []
+    statuses = [None] * len(strands)
+    candidates = []
+    for i, neighbours in enumerate(stored):
+        if isinstance(neighbours, Exception):
+            logger.error(f"Failed to retrieve similar strands for strand {i+1}: {neighbours}")
+            dedup_counters["error"] += 1
+            neighbours = []
+        batch_neighbours = [
+            {"fact_text": strands[j], "score": float(similarities[i, j])}
+            for j in range(i) if statuses[j] != "fail"
+        ]
+        if not neighbours and not batch_neighbours:
+            dedup_counters["empty"] += 1
+            statuses[i] = "pass"
+            continue
+
+        top_score = max(neighbour["score"] for neighbour in neighbours + batch_neighbours)
+        if top_score < DEDUP_ACCEPT_BELOW:
+            dedup_counters["auto_accept"] += 1
+            statuses[i] = "pass"
+        elif top_score >= DEDUP_REJECT_ABOVE:
+            dedup_counters["auto_reject"] += 1
+            statuses[i] = "fail"
         else:
-            recent_chats = recent_chats_result.get("last_three_chats", [])
-            logger.info("Recent chats retrieved successfully")
+            similar = [neighbour["fact_text"] for neighbour in neighbours]
+            similar += [neighbour["fact_text"] for neighbour in batch_neighbours if neighbour["score"] >= DEDUP_ACCEPT_BELOW]
+            candidates.append({"id": i, "strand": strands[i], "similar": similar})
+
+    if candidates:
+        dedup_counters["llm"] += len(candidates)
+        dedup_counters["llm_batches"] += 1
+        logger.info(f"Sending {len(candidates)} strands to LLM for deduplication")
+        try:
+            result = await generate_structured(
+                batch_deduplicate_strands_prompt(), json.dumps(candidates, ensure_ascii=False), BATCH_DEDUP_SCHEMA, "dedup_verdicts"
+            )
+            verdicts = {verdict["id"]: verdict["verdict"] for verdict in result["verdicts"]}
+        except Exception as e:
+            logger.error(f"Failed to check strands for duplication: {e}")
+            dedup_counters["error"] += 1
+            verdicts = {}
+        for candidate in candidates:
+            statuses[candidate["id"]] = "fail" if verdicts.get(candidate["id"]) == "fail" else "pass"
+
+    logger.info(f"Checked {len(strands)} strands successfully")
+    return statuses
+
+def drop_batch_duplicates(strands: List[str], embeddings: List[List[float]]):
+    # Strands from the same turn are not in the vector store yet, so compare them with each other
+    if len(strands) < 2:
+        return strands, embeddings
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept = []
+    for i in range(len(strands)):
+        if kept and float(np.max(vectors[kept] @ vectors[i])) >= DEDUP_REJECT_ABOVE:
+            logger.info(f"Strand {i+1} duplicates another strand from this batch, skipping")
+            dedup_counters["auto_reject"] += 1
+            continue
+        kept.append(i)
+    return [strands[i] for i in kept], [embeddings[i] for i in kept]
+
+@metrics.timed("background_update")
+async def background_update(payloads: List[Dict]):
+    try:
+        logger.info(f"Starting background update for {len(payloads)} chat pairs")
+        api_key = payloads[-1]["api_key"]
+        project_name = payloads[-1]["project_name"]
+        llm = LLMUtils(api_key=payloads[-1]["openai_key"])
+
+        # A retried job resumes the updates whose strands an earlier attempt already stored, and only
+        # indexes them again; extracting them anew would store differently worded duplicates. Only
+        # queued payloads carry an update_id, since the in-process executor never retries
+        update_ids = [payload.get("update_id") or uuid.uuid4().hex for payload in payloads]
+        resumable = any(payload.get("update_id") for payload in payloads)
+        stored = {}
+        if resumable:
+            stored = await get_update_strands(api_key, project_name, update_ids)
+        if stored:
+            logger.info(f"Resuming {len(stored)} updates whose strands were already stored")
+        pending = [(i, update_ids[i]) for i in range(len(payloads)) if update_ids[i] not in stored]
+
+        # Payloads from a combined-extraction recall already carry their strands
+        async def strands_for(payload):
+            if payload.get("strands") is not None:
+                return payload["strands"]
+            return await generate_strands(str(payload["chat_pair"]), llm.get_response)
+
+        # A chat pair whose extraction fails is skipped, and the others are stored without it
+        results = await asyncio.gather(*(strands_for(payloads[i]) for i, _ in pending), return_exceptions=True)
+        failed, errors, generated = [], [], []
+        for (i, _), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to extract strands for chat pair {i + 1} of {len(payloads)}, skipping it: {result}")
+                failed.append(i)
+                errors.append(result)
+                result = []
+            generated.append([strand for strand in (result or []) if validate_content(strand)])
+        strands = [strand for pair_strands in generated for strand in pair_strands]
+        update_keys = {}
+        for (_, update_id), pair_strands in zip(pending, generated):
+            for index, strand in enumerate(pair_strands):
+                update_keys.setdefault(strand, (update_id, index))
+        logger.info(f"Generated {len(strands)} strands successfully")
+
+        new_strands, new_embeddings = [], []
+        if strands:
+            embeddings = await llm.embed_batch(strands)
+            if DEDUP_MODE == "batched":
+                statuses = await deduplicate_strands_batch(strands, embeddings, project_name, llm.get_structured_response)
+            else:
+                strands, embeddings = drop_batch_duplicates(strands, embeddings)
+                statuses = await asyncio.gather(*(
+                    deduplicate_strands(strand, embedding, project_name, llm.get_response)
+                    for strand, embedding in zip(strands, embeddings)
+                ))
+            accepted = [(strand, embedding) for strand, embedding, status in zip(strands, embeddings, statuses) if status != "fail"]
+            logger.info(f"{len(accepted)} of {len(strands)} strands passed deduplication")
+            new_strands = [strand for strand, _ in accepted]
+            new_embeddings = [embedding for _, embedding in accepted]
+
+        strand_ids = []
+        if new_strands:
+            keys = [update_keys[strand] for strand in new_strands] if resumable else None
+            memory_result = await add_memories(api_key, project_name, new_strands, keys)
+            # Raised rather than dropped, so a queued job is retried or dead-lettered instead of acked
+            if "error" in memory_result:
+                raise Exception(f"Failed to add memory strands: {memory_result['error']}")
+            strand_ids = memory_result["inserted_ids"]
+
+        indexed_updates = set(stored) | {update_keys[strand][0] for strand in new_strands}
+        resumed = [strand for update_strands in stored.values() for strand in update_strands]
+        if resumed:
+            strand_ids = strand_ids + [strand_id for strand_id, _ in resumed]
+            new_strands = new_strands + [content for _, content in resumed]
+            new_embeddings = new_embeddings + await llm.embed_batch([content for _, content in resumed])
+
+        if new_strands:
+            await index_strands(new_strands, project_name, new_embeddings, strand_ids)
+            logger.info(f"Stored {len(new_strands)} new memory strands")
+            for payload, update_id in zip(payloads, update_ids):
+                if "recalled_at" in payload and update_id in indexed_updates:
+                    metrics.record_freshness(payload["recalled_at"])
+            summary_debouncer.add(
+                (api_key, project_name), new_strands,
+                {"api_key": api_key, "project_name": project_name, "openai_key": payloads[-1]["openai_key"]}
+            )
+
+        if failed:
+            raise PayloadsFailed(failed, f"Failed to extract strands for {len(failed)} of {len(payloads)} chat pairs: {errors[0]}")
+        logger.info("Background update completed successfully")
+    except Exception as e:
+        logger.error(f"Error in background update: {e}")
+        raise
 
-        chat_result = add_chat(api_key, project_name, chat_pair["user"], chat_pair["assistant"])
-        if "error" in chat_result:
-            logger.error(f"Failed to add chat: {chat_result['error']}")
+@metrics.timed("summary_update")
+async def summary_update(payloads: List[Dict]):
+    try:
+        api_key = payloads[-1]["api_key"]
+        project_name = payloads[-1]["project_name"]
+        new_facts = [fact for payload in payloads for fact in payload["items"]]
+        if not new_facts:
+            logger.info("No new strands since the last summary, skipping regeneration")
             return
-        logger.info("Chat added successfully")
+        logger.info(f"Starting summary update with {len(new_facts)} new strands")
+        llm = LLMUtils(api_key=payloads[-1]["openai_key"])
+
+        summary_result = await get_latest_summary(api_key, project_name)
+        if "error" in summary_result:
+            raise Exception(f"Failed to retrieve summary: {summary_result['error']}")
+        summary = summary_result["summary"]
+        
+        updated_summary = await regenerate_summary(summary, new_facts, llm.get_response)
+        logger.info("Summary regenerated successfully")
+        
+        summary_result = await add_summary(api_key, project_name, updated_summary)
+        if "error" in summary_result:
+            raise Exception(f"Failed to add summary: {summary_result['error']}")
+        logger.info("Summary added successfully")
+    except Exception as e:
+        logger.error(f"Error in summary update: {e}")
+        raise
 
-        project = get_project(api_key, project_name)
-        if "error" in project:
-            logger.error(f"Failed to retrieve project: {project['error']}")
-            raise Exception(f"Project not found: {project['error']}")
-        logger.info("Project retrieved successfully")
+# In queue mode strands are indexed by worker processes, whose invalidations never reach this process's
+# retrieval cache; recalls then check a per-project generation in Mongo that every indexing write bumps
+SHARED_RETRIEVAL_GENERATION = BACKGROUND_MODE == "queue"
 
-        summary = project.get("summaries", [])[-1]["summary"] if project.get("summaries") else ""
-        logger.info("Summary retrieved successfully")
+async def index_strands(strands: List[str], project_name: str, embeddings: List[List[float]], ids: Optional[List[str]] = None):
+    await upsert_strands(strands, project_name, embeddings, ids)
+    if SHARED_RETRIEVAL_GENERATION:
+        await bump_retrieval_generation(project_name)
 
-        questions = generate_questions(str(chat_pair), llm.get_response)
-        logger.info("Questions generated successfully")
+def shared_retrieval_generation(project_name: str):
+    if not SHARED_RETRIEVAL_GENERATION:
+        return None
+    return lambda: get_retrieval_generation(project_name)
 
-        ragged_memory = retrieve(questions, project_name, llm.embed)
-        logger.info(f"Retrieved {len(ragged_memory)} memory items successfully")
+# Background work goes to the in-process executor, or with BACKGROUND_MODE=queue to the durable job
+# queue that backend.worker drains; both take submit(key, kind, handler, payload)
+background_submitter = JobSubmitter() if BACKGROUND_MODE == "queue" else background_executor
 
-        result = f"""
-        Recent chats: 
-        {recent_chats}
+# Summaries are regenerated once SUMMARY_EVERY_N_STRANDS new strands have been accepted for a
+# project or SUMMARY_MAX_DELAY_SECONDS after the first of them, folding all of them into one call
+summary_debouncer = Debouncer(background_submitter, "summary_update", summary_update, SUMMARY_EVERY_N_STRANDS, SUMMARY_MAX_DELAY_SECONDS)
 
-        Summary:
-        {summary}
+def queue_memory_update(api_key: str, project_name: str, chat_pair: Dict[str, str], openai_key: str,
+                        recalled_at: float, strands: Optional[List[str]] = None):
+    payload = {
+        "api_key": api_key, "project_name": project_name, "openai_key": openai_key, "chat_pair": chat_pair,
+        "recalled_at": recalled_at
+    }
+    if BACKGROUND_MODE == "queue":
+        payload["update_id"] = uuid.uuid4().hex
+    if strands is not None:
+        payload["strands"] = strands
+    background_submitter.submit((api_key, project_name), "memory_update", background_update, payload)
+    logger.info(f"Background update queued{' with extracted strands' if strands is not None else ''}")
 
-        Ragged memory:
-        {ragged_memory}
-        """
-        logger.info("Context package generated successfully")
+@metrics.timed("start_recall")
+async def start_recall(api_key: str, project_name: str, chat_pair: Dict[str, str]):
+    recalled_at = time.time()
+    context = await append_chat_and_get_context(api_key, project_name, chat_pair["user"], chat_pair["assistant"])
+    if "error" in context:
+        logger.error(f"Failed to append chat: {context['error']}")
+        raise Exception(f"Failed to append chat: {context['error']}")
+    logger.info("Chat added and context retrieved successfully")
+    context["recalled_at"] = recalled_at
+    return context
 
-        def background_update():
+def fast_questions(chat_pair: Dict[str, str]):
+    return [chat_pair["user"], f"{chat_pair['user']}\n{chat_pair['assistant']}"]
+
+@metrics.timed("plan_retrieval")
+async def plan_retrieval(chat_pair: Dict[str, str], generate_response, mode: str, deadline: Optional[float], generate_structured=None):
+    # Returns (questions, path, retrieval timeout, strands). "full" always asks the LLM for questions,
+    # "fast" queries with the chat turn itself, and "auto" asks the LLM only while the budget allows it.
+    # With generate_structured the LLM call also extracts the strands; otherwise strands is None.
+    if mode not in RECALL_MODES:
+        raise ValueError(f"Unknown recall mode: {mode}")
+    loop = asyncio.get_running_loop()
+    reserve = FAST_RECALL_RESERVE_MS / 1000
+
+    async def ask_llm():
+        if generate_structured is not None:
+            return await generate_questions_and_strands(str(chat_pair), generate_structured)
+        return await generate_questions(str(chat_pair), generate_response), None
+
+    def can_fall_back(error):
+        # The background update extracts strands on its own if the combined call fails, and an
+        # unavailable LLM should cost the recall its questions rather than the whole recall
+        return generate_structured is not None or isinstance(error, UpstreamError)
+
+    path = "fast"
+    if mode == "full" or (mode == "auto" and deadline is None):
+        try:
+            questions, strands = await ask_llm()
+            return questions, "full", None, strands
+        except Exception as e:
+            if not can_fall_back(e):
+                raise
+            logger.warning(f"Question generation failed, falling back to fast recall: {e}")
+            path = "fast_fallback"
+    elif mode == "auto":
+        question_budget = deadline - loop.time() - reserve
+        if question_budget > 0:
             try:
-                logger.info("Starting background update")
-                
-                strands = generate_strands(str(chat_pair), llm.get_response)
-                logger.info("Strands generated successfully")
-                
-                for i, strand in enumerate(strands):
-                    try:
-                        strand_status = deduplicate_strands(strand, project_name, llm.embed, llm.get_response)
-                        if strand_status == "fail":
-                            logger.info(f"Strand {i+1} is a duplicate, skipping")
-                            continue
-                        
-                        memory_result = add_memory(api_key, project_name, strand)
-                        if "error" in memory_result:
-                            logger.warning(f"Failed to add memory strand {i+1}: {memory_result['error']}")
-                            continue
-                        logger.debug(f"Memory strand {i+1} added successfully")
-                        
-                        upsert_strands(strand, project_name, llm.embed)
-                        logger.debug(f"Strand {i+1} upserted successfully")
-                    except Exception as e:
-                        logger.warning(f"Failed to process strand {i+1}: {e}")
-                        continue
-                
-                updated_summary = regenerate_summary(summary, strands, llm.get_response)
-                logger.info("Summary regenerated successfully")
-                
-                summary_result = add_summary(api_key, project_name, updated_summary)
-                if "error" in summary_result:
-                    logger.error(f"Failed to add summary: {summary_result['error']}")
-                else:
-                    logger.info("Summary added successfully")
-                
-                logger.info("Background update completed successfully")
+                questions, strands = await asyncio.wait_for(ask_llm(), timeout=question_budget)
+                return questions, "full", max(deadline - loop.time(), 0.0), strands
+            except asyncio.TimeoutError:
+                logger.warning(f"Question generation exceeded {question_budget:.3f}s of the latency budget, falling back to fast recall")
+                path = "fast_fallback"
             except Exception as e:
-                logger.error(f"Error in background update: {e}")
+                if not can_fall_back(e):
+                    raise
+                logger.warning(f"Question generation failed, falling back to fast recall: {e}")
+                path = "fast_fallback"
+
+    timeout = max(deadline - loop.time(), 0.0) if deadline is not None else None
+    return fast_questions(chat_pair), path, timeout, None
+
+def recall_deadline(mode: str, latency_budget_ms: Optional[int]):
+    # "full" recalls wait for question generation and retrieval whatever the budget
+    if not latency_budget_ms or mode == "full":
+        return None
+    return asyncio.get_running_loop().time() + latency_budget_ms / 1000
+
+def recall_stages(api_key: str, project_name: str, chat_pair: Dict[str, str], openai_key: str,
+                  llm: LLMUtils, mode: str, deadline: Optional[float]):
+    # Appending the chat and reading the project (Mongo) and planning the retrieval (LLM) only need the
+    # chat pair, so they start together. The background update is queued once the chat is stored, or,
+    # with combined extraction, once the plan has produced the strands.
+    combined = EXTRACTION_MODE == "combined"
+    graph = StageGraph()
+    graph.add("context", lambda: start_recall(api_key, project_name, chat_pair))
+    graph.add("plan", lambda: within(
+        deadline, plan_retrieval, chat_pair, llm.get_response, mode, deadline,
+        generate_structured=llm.get_structured_response if combined else None
+    ))
+
+    async def queue_update(context, plan=None):
+        strands = plan[3] if plan is not None else None
+        queue_memory_update(api_key, project_name, chat_pair, openai_key, context["recalled_at"], strands)
+
+    graph.add("queue_update", queue_update, deps=("context", "plan") if combined else ("context",))
+    return graph
 
-        threading.Thread(target=background_update).start()
-        logger.info("Background update thread started")
+async def recall(api_key: str, project_name: str, chat_pair: Dict[str, str], openai_key: str,
+                 mode: str = "auto", latency_budget_ms: Optional[int] = None,
+                 token_budget: Optional[int] = None, output_format: str = "text"):
+    try:
+        logger.info(f"Starting recall for project: {project_name}")
+        deadline = recall_deadline(mode, latency_budget_ms)
+        llm = LLMUtils(api_key=openai_key)
+
+        async def retrieve_facts(plan):
+            try:
+                return await within(
+                    deadline, retrieve, plan[0], project_name, llm.embed_batch, timeout=plan[2],
+                    shared_generation=shared_retrieval_generation(project_name)
+                )
+            except UpstreamError as e:
+                # Embeddings or the vector store are unavailable; the summary and recent chats still make a context
+                logger.warning(f"Retrieval unavailable, returning a degraded recall: {e}")
+                return None
+
+        graph = recall_stages(api_key, project_name, chat_pair, openai_key, llm, mode, deadline)
+        graph.add("retrieve", retrieve_facts, deps=("plan",), fallback=[])
+        results = await graph.run(deadline + RECALL_DEADLINE_GRACE_MS / 1000 if deadline is not None else None)
+        recent_chats = results["context"]["recent_chats"]
+        summary = results["context"]["summary"]
+        questions, path = results["plan"][:2]
+        ragged_memory = results["retrieve"]
+        if ragged_memory is None:
+            path, ragged_memory = "degraded", []
+        logger.info(f"Using {path} recall path with {len(questions)} questions")
+        logger.info(f"Retrieved {len(ragged_memory)} memory items successfully")
+
+        with metrics.track("build_context"):
+            built = build_context(recent_chats, summary, ragged_memory, token_budget=token_budget, output_format=output_format)
+        logger.info("Context package generated successfully")
         logger.info("Recall completed successfully")
-        return result
+        return {"context": built["context"], "path": path, "tokens": built["tokens"]}
     except Exception as e:
         logger.error(f"Failed to complete recall for project {project_name}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+async def recall_stream(api_key: str, project_name: str, chat_pair: Dict[str, str], openai_key: str,
+                        mode: str = "auto", latency_budget_ms: Optional[int] = None):
+    try:
+        logger.info(f"Starting streaming recall for project: {project_name}")
+        deadline = recall_deadline(mode, latency_budget_ms)
+        llm = LLMUtils(api_key=openai_key)
+
+        # Chats and summary are sent as soon as Mongo returns them, while the plan may still be running
+        stages = recall_stages(api_key, project_name, chat_pair, openai_key, llm, mode, deadline).iter()
+        try:
+            async for name, result in stages:
+                if name == "context":
+                    yield {"event": "recent_chats", "data": result["recent_chats"]}
+                    yield {"event": "summary", "data": result["summary"]}
+                elif name == "plan":
+                    questions, path, timeout, _ = result
+        finally:
+            await stages.aclose()
+        logger.info(f"Using {path} recall path with {len(questions)} questions")
+
+        seen_facts = set()
+        facts_sent = 0
+        try:
+            embed_questions = lambda texts: within(deadline, llm.embed_batch, texts)
+            async for _, facts in iter_question_results(questions, project_name, embed_questions, timeout=timeout,
+                                                        shared_generation=shared_retrieval_generation(project_name)):
+                new_facts = merge_facts([facts], seen_facts)
+                if new_facts:
+                    facts_sent += len(new_facts)
+                    yield {"event": "facts", "data": new_facts}
+        except UpstreamError as e:
+            logger.warning(f"Retrieval unavailable, ending a degraded recall: {e}")
+            path = "degraded"
+
+        logger.info(f"Streamed {facts_sent} memory items")
+        yield {"event": "done", "data": {"facts": facts_sent, "path": path}}
+    except Exception as e:
+        logger.error(f"Failed to complete streaming recall for project {project_name}: {e}")
+        raise
@@ -0,0 +1,184 @@
+import os
+import sys
+import uuid
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+
+# Leases memory and summary update jobs from the durable job queue and runs them. Start as many
+# worker processes, on as many machines, as the background load needs:
+#
+#     python -m backend.worker --concurrency 4
+#
+# A job whose worker dies is leased again once its visibility timeout passes; a job that keeps
+# failing is retried with backoff and marked dead after JOB_MAX_ATTEMPTS attempts.
+
+logger = logging.getLogger("backend.worker")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a reca11 background worker.")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")),
+                        help="Jobs this process runs at once.")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("WORKER_POLL_INTERVAL_SECONDS", "1.0")),
+                        help="Seconds to wait before polling an empty queue again.")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this port (0 disables).")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue is empty.")
+    return parser.parse_args(argv)
+
+
+class Worker:
+    def __init__(self, queue, handlers, concurrency: int, poll_interval: float, visibility_timeout: float, max_attempts: int):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = asyncio.Event()
+        self.leased = 0
+        self.acked = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def _heartbeat(self, job):
+        # Extends the lease while the job runs, so only a dead worker's jobs become visible again
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            if not await self.queue.extend(job, self.visibility_timeout):
+                logger.warning(f"Lost the lease on {job.kind} job for {job.key}")
+                return
+
+    async def process(self, job):
+        from .jobs import PayloadsFailed
+        self.leased += 1
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            await self.queue.fail(job, f"Unknown job kind: {job.kind}", max_attempts=0)
+            self.dead += len(job.ids)
+            logger.error(f"Dropped job of unknown kind {job.kind}")
+            return
+        if max(job.attempts) > self.max_attempts:
+            # Leased again after its lease expired too often: the job keeps killing its worker
+            await self.queue.fail(job, "Lease expired on every attempt", max_attempts=self.max_attempts)
+            self.dead += len(job.ids)
+            logger.error(f"Marked {job.kind} job for {job.key} dead after {max(job.attempts) - 1} expired leases")
+            return
+
+        logger.info(f"Running {job.kind} job with {len(job.payloads)} payloads (attempt {max(job.attempts)})")
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await handler([self.queue.cipher.open(payload) for payload in job.payloads])
+        except PayloadsFailed as e:
+            succeeded = [i for i in range(len(job.ids)) if i not in set(e.indexes)]
+            if succeeded:
+                await self.queue.ack(job.subset(succeeded))
+                self.acked += len(succeeded)
+            await self._fail(job.subset(e.indexes), e)
+            return
+        except Exception as e:
+            await self._fail(job, e)
+            return
+        finally:
+            heartbeat.cancel()
+        await self.queue.ack(job)
+        self.acked += len(job.ids)
+
+    async def _fail(self, job, error: Exception):
+        await self.queue.fail(job, str(error), max_attempts=self.max_attempts)
+        if max(job.attempts) >= self.max_attempts:
+            self.dead += len(job.ids)
+            logger.error(f"{job.kind} job for {job.key} failed for the last time: {error}")
+        else:
+            self.retried += len(job.ids)
+            logger.warning(f"{job.kind} job for {job.key} failed, will retry: {error}")
+
+    async def _loop(self, once: bool):
+        while not self.stopping.is_set():
+            try:
+                job = await self.queue.lease(self.worker_id, self.visibility_timeout)
+            except Exception as e:
+                logger.error(f"Failed to lease a job: {e}")
+                job = None
+            if job is None:
+                if once:
+                    return
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.process(job)
+            except Exception as e:
+                # The lease runs out and another worker picks the job up
+                logger.error(f"Failed to settle {job.kind} job for {job.key}: {e}")
+
+    async def run(self, once: bool = False):
+        logger.info(f"Worker {self.worker_id} started with concurrency {self.concurrency}")
+        await asyncio.gather(*(self._loop(once) for _ in range(self.concurrency)))
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def stats(self):
+        return {"leased": self.leased, "acked": self.acked, "retried": self.retried, "dead": self.dead}
+
+
+async def run(args):
+    # Imported here so BACKGROUND_MODE is set before the backend reads it
+    from . import metrics
+    from .models import ensure_indexes
+    from .jobs import get_job_queue, JOB_QUEUE_BACKEND, JOB_VISIBILITY_TIMEOUT_SECONDS, JOB_MAX_ATTEMPTS
+    from .utils import background_update, summary_update, summary_debouncer, background_submitter, dedup_counters
+    from .background import background_executor
+    from .memory.client_pool import openai_client_pool
+    from .memory import resilience
+
+    metrics.current_endpoint.set("background")
+    queue = get_job_queue()
+    if JOB_QUEUE_BACKEND == "mongo":
+        await ensure_indexes()
+    await queue.setup()
+
+    worker = Worker(
+        queue, {"memory_update": background_update, "summary_update": summary_update},
+        args.concurrency, args.poll_interval, JOB_VISIBILITY_TIMEOUT_SECONDS, JOB_MAX_ATTEMPTS
+    )
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+        metrics.register_stats({
+            "worker": worker.stats, "jobs": background_submitter.stats, "summaries": summary_debouncer.stats,
+            "openai_clients": openai_client_pool.stats, "dedup": lambda: dict(dedup_counters), "resilience": resilience.stats
+        })
+        start_http_server(args.metrics_port)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, worker.stopping.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await worker.run(once=args.once)
+    finally:
+        # Summary jobs debounced in this process still go to the queue before it exits
+        summary_debouncer.flush_all()
+        await background_submitter.drain()
+        await background_executor.drain()
+        await openai_client_pool.aclose()
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["BACKGROUND_MODE"] = "queue"
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
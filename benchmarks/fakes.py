@@ -0,0 +1,438 @@
+import re
+import copy
+import json
+import time
+import zlib
+import base64
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from bson import ObjectId
+from pymongo import ReturnDocument
+from backend.memory.vector_store import VectorStore
+from backend.prompts import summary_prompt, strands_prompt, generate_questions_prompt, deduplicate_strands_prompt, extraction_prompt, batch_deduplicate_strands_prompt
+
+# Local stand-ins for the services the backend talks to, so benchmarks run offline with
+# controlled latency: an OpenAI-compatible HTTP server, an in-memory async Mongo and a
+# wrapper that gives the in-process vector store a network round trip.
+
+EMBEDDING_DIMENSION = 1536
+
+
+def _sleep_seconds(latency_ms: float, jitter: float):
+    if latency_ms <= 0:
+        return 0.0
+    return max(0.0, latency_ms * (1 + random.uniform(-jitter, jitter))) / 1000
+
+
+_token_vectors = {}
+
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION):
+    # Sum of per-word random vectors, so texts sharing words land near each other like real embeddings do
+    vector = np.zeros(dimension, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()) or [""]:
+        token_vector = _token_vectors.get(token)
+        if token_vector is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            token_vector = _token_vectors[token] = rng.standard_normal(dimension).astype(np.float32)
+        vector += token_vector
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _words(text: str, count: int):
+    return " ".join(re.findall(r"[A-Za-z]+", text)[:count]) or "something"
+
+
+def fake_completion(messages):
+    # The backend's callers pass their instructions and input in either message, so match on whichever holds a known prompt
+    contents = [message["content"] for message in messages]
+    prompts = {prompt(): name for prompt, name in (
+        (strands_prompt, "strands"), (generate_questions_prompt, "questions"),
+        (deduplicate_strands_prompt, "dedup"), (summary_prompt, "summary"), (extraction_prompt, "extraction"),
+        (batch_deduplicate_strands_prompt, "batch_dedup")
+    )}
+    kind = next((prompts[content] for content in contents if content in prompts), None)
+    text = next((content for content in contents if content not in prompts), "")
+    topic = _words(text.split("'user':")[-1], 8)
+    if kind == "strands":
+        return repr([f"The user mentioned {topic}", f"The user is interested in {topic}"])
+    if kind == "questions":
+        return repr([f"What has the user said about {topic}?", f"What does the user prefer regarding {topic}?", "What is the user working on?"])
+    if kind == "extraction":
+        return json.dumps({
+            "questions": [f"What has the user said about {topic}?", f"What does the user prefer regarding {topic}?", "What is the user working on?"],
+            "strands": [f"The user mentioned {topic}", f"The user is interested in {topic}"]
+        })
+    if kind == "dedup":
+        return "pass"
+    if kind == "batch_dedup":
+        return json.dumps({"verdicts": [{"id": candidate["id"], "verdict": "pass"} for candidate in json.loads(text)]})
+    if kind == "summary":
+        return f"The user has discussed {_words(text, 6)}."
+    return "ok"
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, keep-alive responses stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body, status: int = 200):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server.requests[self.path] += 1
+        if server.error_status is not None:
+            self._send_json({"error": {"message": "Simulated outage", "type": "server_error"}}, server.error_status)
+            return
+
+        if self.path.endswith("/embeddings"):
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            time.sleep(_sleep_seconds(server.embed_latency_ms, server.jitter))
+            data = []
+            for i, text in enumerate(texts):
+                vector = fake_embedding(text, server.dimension)
+                if request.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            self._send_json({
+                "object": "list", "data": data, "model": request.get("model"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}
+            })
+            return
+
+        if self.path.endswith("/chat/completions"):
+            time.sleep(_sleep_seconds(server.llm_latency_ms, server.jitter))
+            self._send_json({
+                "id": "chatcmpl-benchmark", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": fake_completion(request.get("messages", []))}
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+            return
+
+        self.send_error(404)
+
+
+# OpenAI-compatible server for chat completions and embeddings. Point the SDK at it with
+# OPENAI_BASE_URL=server.base_url; every response waits latency_ms +/- jitter (a fraction of it).
+class FakeOpenAIServer:
+    def __init__(self, llm_latency_ms: float = 0.0, embed_latency_ms: float = 0.0, jitter: float = 0.0,
+                 dimension: int = EMBEDDING_DIMENSION, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), _OpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.llm_latency_ms = llm_latency_ms
+        self.httpd.embed_latency_ms = embed_latency_ms
+        self.httpd.jitter = jitter
+        self.httpd.dimension = dimension
+        self.httpd.requests = {"/v1/chat/completions": 0, "/v1/embeddings": 0}
+        self.httpd.error_status = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return dict(self.httpd.requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def fail_with(self, status=None):
+        # Answers every request with this HTTP status until called again with None
+        self.httpd.error_status = status
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _matches(doc, query):
+    for field, expected in query.items():
+        if isinstance(expected, dict) and "$exists" in expected:
+            if (field in doc) != bool(expected["$exists"]):
+                return False
+        elif isinstance(expected, dict) and "$in" in expected:
+            if doc.get(field) not in expected["$in"]:
+                return False
+        elif doc.get(field) != expected:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [field for field, value in projection.items() if value and field != "_id"]
+    if included:
+        result = {field: copy.deepcopy(doc[field]) for field in included if field in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {field: copy.deepcopy(value) for field, value in doc.items() if projection.get(field, 1)}
+
+
+def _sorted(docs, sort):
+    for field, direction in reversed(sort or []):
+        docs = sorted(docs, key=lambda doc: doc.get(field), reverse=direction < 0)
+    return docs
+
+
+def _apply_update(doc, update, inserting: bool = False):
+    for field, value in update.get("$set", {}).items():
+        doc[field] = copy.deepcopy(value)
+    if inserting:
+        for field, value in update.get("$setOnInsert", {}).items():
+            doc[field] = copy.deepcopy(value)
+    for field, value in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + value
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+    for field, value in update.get("$push", {}).items():
+        items = doc.setdefault(field, [])
+        if isinstance(value, dict) and "$each" in value:
+            items.extend(copy.deepcopy(value["$each"]))
+            if "$slice" in value:
+                limit = value["$slice"]
+                doc[field] = items[limit:] if limit < 0 else items[:limit]
+        else:
+            items.append(copy.deepcopy(value))
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def _results(self):
+        docs = _sorted(self.collection.scan(self.query), self._sort)[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        self.collection.docs_returned += len(docs)
+        return [_project(doc, self.projection) for doc in docs]
+
+    async def to_list(self, length=None):
+        await self.collection.round_trip()
+        results = self._results()
+        return results[:length] if length else results
+
+    async def __aiter__(self):
+        await self.collection.round_trip()
+        for doc in self._results():
+            yield doc
+
+
+# Async, in-memory subset of the pymongo collection API used by backend.models.
+# Queries are equality matches served from a per-(owner, project) index, so cost follows the
+# documents a call touches rather than the size of the whole collection.
+class FakeCollection:
+    def __init__(self, name: str, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self._docs = {}
+        self._by_owner = {}
+        self.operations = 0
+        self.docs_returned = 0
+
+    async def round_trip(self):
+        self.operations += 1
+        delay = _sleep_seconds(self.latency_ms, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+
+    def _owner(self, doc_or_query):
+        return doc_or_query.get("owner_api_key"), doc_or_query.get("project_name")
+
+    def scan(self, query):
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            candidates = [doc] if doc is not None else []
+        elif "owner_api_key" in query and "project_name" in query:
+            candidates = [self._docs[doc_id] for doc_id in self._by_owner.get(self._owner(query), [])]
+        else:
+            candidates = list(self._docs.values())
+        return [doc for doc in candidates if _matches(doc, query)]
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(doc)
+        self._docs[stored["_id"]] = stored
+        self._by_owner.setdefault(self._owner(stored), []).append(stored["_id"])
+        return stored["_id"]
+
+    def __len__(self):
+        return len(self._docs)
+
+    async def create_index(self, keys, **kwargs):
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    async def find_one(self, query, projection=None, sort=None):
+        await self.round_trip()
+        docs = _sorted(self.scan(query), sort)
+        if not docs:
+            return None
+        self.docs_returned += 1
+        return _project(docs[0], projection)
+
+    def find(self, query, projection=None):
+        return FakeCursor(self, query, projection)
+
+    async def insert_one(self, doc):
+        await self.round_trip()
+        return SimpleNamespace(inserted_id=self._insert(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        await self.round_trip()
+        return SimpleNamespace(inserted_ids=[self._insert(doc) for doc in docs])
+
+    async def update_one(self, query, update, upsert=False):
+        await self.round_trip()
+        return self._update_one(query, update, upsert)
+
+    def _update_one(self, query, update, upsert):
+        docs = self.scan(query)
+        if docs:
+            _apply_update(docs[0], update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {field: value for field, value in query.items() if not isinstance(value, dict)}
+            _apply_update(doc, update, inserting=True)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def bulk_write(self, operations, ordered=True):
+        # Only UpdateOne, which is all the backend sends in bulk
+        await self.round_trip()
+        for operation in operations:
+            self._update_one(operation._filter, operation._doc, operation._upsert)
+        return SimpleNamespace(acknowledged=True)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=ReturnDocument.BEFORE, upsert=False):
+        await self.round_trip()
+        docs = self.scan(query)
+        if not docs:
+            return None
+        before = _project(docs[0], projection) if return_document == ReturnDocument.BEFORE else None
+        _apply_update(docs[0], update)
+        self.docs_returned += 1
+        return before if before is not None else _project(docs[0], projection)
+
+    async def delete_one(self, query):
+        await self.round_trip()
+        docs = self.scan(query)
+        if not docs:
+            return SimpleNamespace(deleted_count=0)
+        doc = self._docs.pop(docs[0]["_id"])
+        self._by_owner[self._owner(doc)].remove(doc["_id"])
+        return SimpleNamespace(deleted_count=1)
+
+
+class FakeMongo:
+    COLLECTIONS = {
+        "users_col": "users",
+        "projects_col": "projects",
+        "chats_col": "chats",
+        "strands_col": "memory_strands",
+        "summaries_col": "summaries",
+        "retrieval_generations_col": "retrieval_generations"
+    }
+
+    def __init__(self, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.collections = {
+            attribute: FakeCollection(name, latency_ms, jitter) for attribute, name in self.COLLECTIONS.items()
+        }
+
+    # Swaps the module-level collections of backend.models, which every model function reads at call time
+    def install(self):
+        from backend import models
+        for attribute, collection in self.collections.items():
+            setattr(models, attribute, collection)
+        return self
+
+    def __getitem__(self, attribute: str):
+        return self.collections[attribute]
+
+    def stats(self):
+        return {
+            collection.name: {"operations": collection.operations, "docs_returned": collection.docs_returned, "documents": len(collection)}
+            for collection in self.collections.values()
+        }
+
+    def reset_counters(self):
+        for collection in self.collections.values():
+            collection.operations = 0
+            collection.docs_returned = 0
+
+
+# Gives a vector store a per-call network delay, run in a thread like the Pinecone client's calls are
+class LatencyVectorStore(VectorStore):
+    blocking = True
+
+    def __init__(self, store: VectorStore, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+
+    def _wait(self):
+        delay = _sleep_seconds(self.latency_ms, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def upsert(self, namespace, vectors):
+        self._wait()
+        self.store.upsert(namespace, vectors)
+
+    def query(self, namespace, vector, top_k):
+        self._wait()
+        return self.store.query(namespace, vector, top_k)
+
+    def delete(self, namespace, ids):
+        self._wait()
+        self.store.delete(namespace, ids)
+
+    def namespace_stats(self, namespace):
+        return self.store.namespace_stats(namespace)
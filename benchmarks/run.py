@@ -0,0 +1,380 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from datetime import datetime, timezone
+
+# Offline benchmarks for the recall path, the background strand pipeline, retrieval fan-out and
+# the model layer. OpenAI, the vector store and Mongo are replaced by the stand-ins in
+# benchmarks.fakes, each with a configurable latency, so runs are repeatable on any machine.
+# Usage: python -m benchmarks.run [--suites recall,background,retrieve,models] [--output FILE] [--compare FILE]
+
+SUITES = ("recall", "background", "retrieve", "models")
+API_KEY = "rcll_" + "0" * 36
+OPENAI_KEY = "sk-benchmark"
+
+WORDS = (
+    "pizza running legal research marathon python database travel budget garden music guitar "
+    "kubernetes deadline startup investor recipe allergy knee injury apartment lease vacation "
+    "tokyo lisbon coffee sleep schedule meeting resume interview thesis chapter dataset model "
+    "training latency cache billing invoice client design figma onboarding hiring climbing"
+).split()
+
+
+def percentile(values, q: float):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {}
+        self.prefix = ""
+
+    def record(self, name: str, seconds: float):
+        self.samples.setdefault(f"{self.prefix}{name}", []).append(seconds * 1000)
+
+    # Wraps a coroutine function so each call records its duration under prefix + name
+    def wrap(self, name: str, fn):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+        return timed
+
+    def results(self):
+        return {
+            name: {
+                "unit": "ms",
+                "n": len(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": max(values)
+            }
+            for name, values in self.samples.items()
+        }
+
+
+def chat_pair(rng: random.Random, i: int):
+    topic = " ".join(rng.sample(WORDS, 4))
+    return {
+        "user": f"I keep thinking about {topic} since conversation {i}",
+        "assistant": f"Tell me more about {topic.split()[0]}."
+    }
+
+
+class Context:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.server = None
+        self.mongo = None
+        self.projects = 0
+
+    async def new_project(self, label: str, strands: int = 0, chats: int = 0):
+        from backend.models import create_project
+        from backend.memory.rag_utils import upsert_strands
+        from .fakes import fake_embedding
+
+        self.projects += 1
+        project_name = f"{label}-{self.projects}"
+        result = await create_project(API_KEY, project_name)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+        owner = {"owner_api_key": API_KEY, "project_name": project_name}
+        now = datetime.now()
+        if chats:
+            pairs = [chat_pair(self.rng, i) for i in range(chats)]
+            await self.mongo["chats_col"].insert_many([{**owner, **pair, "timestamp": now} for pair in pairs])
+            await self.mongo["projects_col"].update_one(owner, {"$set": {"recent_chats": pairs[-3:]}})
+        if strands:
+            texts = [f"The user mentioned {' '.join(self.rng.sample(WORDS, 5))} ({i})" for i in range(strands)]
+            await self.mongo["strands_col"].insert_many([{**owner, "content": text, "timestamp": now} for text in texts])
+            await upsert_strands(texts, project_name, [fake_embedding(text).tolist() for text in texts])
+        return project_name
+
+
+async def wait_for_background():
+    from backend.background import background_executor
+    while True:
+        stats = background_executor.stats()
+        if not stats["queued_jobs"] and not stats["running"] and not stats["active_projects"]:
+            return
+        await asyncio.sleep(0.01)
+
+
+async def bench_recall(ctx: Context):
+    from backend import utils
+    from backend.memory.llm_utils import LLMUtils
+
+    args = ctx.args
+    timings = Timings()
+    project_name = await ctx.new_project("recall", strands=args.strands, chats=3)
+    stages = ("start_recall", "plan_retrieval", "retrieve")
+    originals = {name: getattr(utils, name) for name in stages}
+    original_embed_batch = LLMUtils.embed_batch
+    original_submit = utils.background_executor.submit
+
+    # Background strand extraction has its own suite; here it would only add noise to the recall timings
+    utils.background_executor.submit = lambda *submit_args, **submit_kwargs: True
+    for name in stages:
+        setattr(utils, name, timings.wrap(name, originals[name]))
+    LLMUtils.embed_batch = timings.wrap("embed_batch", original_embed_batch)
+    try:
+        for mode in ("full", "fast"):
+            for i in range(args.warmup):
+                timings.prefix = "warmup."
+                await utils.recall(API_KEY, project_name, chat_pair(ctx.rng, i), OPENAI_KEY, mode=mode)
+            timings.prefix = f"recall.{mode}."
+            for i in range(args.iterations):
+                start = time.perf_counter()
+                await utils.recall(API_KEY, project_name, chat_pair(ctx.rng, i), OPENAI_KEY, mode=mode)
+                timings.record("total", time.perf_counter() - start)
+    finally:
+        for name, fn in originals.items():
+            setattr(utils, name, fn)
+        LLMUtils.embed_batch = original_embed_batch
+        utils.background_executor.submit = original_submit
+
+    return {name: result for name, result in timings.results().items() if not name.startswith("warmup.")}
+
+
+async def bench_background(ctx: Context):
+    from backend import utils
+
+    args = ctx.args
+    timings = Timings()
+    results = {}
+    for batch_size in sorted({1, args.batch_size}):
+        project_name = await ctx.new_project("background", strands=args.strands)
+        payloads = [
+            {"api_key": API_KEY, "project_name": project_name, "openai_key": OPENAI_KEY, "chat_pair": chat_pair(ctx.rng, i)}
+            for i in range(args.iterations * batch_size)
+        ]
+        llm_calls_before = ctx.server.requests["/v1/chat/completions"]
+        timings.prefix = f"background.batch{batch_size}."
+        start = time.perf_counter()
+        for offset in range(0, len(payloads), batch_size):
+            job_start = time.perf_counter()
+            await utils.background_update(payloads[offset:offset + batch_size])
+            timings.record("job", time.perf_counter() - job_start)
+        elapsed = time.perf_counter() - start
+        results[f"background.batch{batch_size}.throughput"] = {"unit": "pairs/s", "value": len(payloads) / elapsed}
+        results[f"background.batch{batch_size}.llm_calls_per_pair"] = {
+            "unit": "calls", "value": (ctx.server.requests["/v1/chat/completions"] - llm_calls_before) / len(payloads)
+        }
+
+    utils.summary_debouncer.flush_all()
+    await wait_for_background()
+    results.update(timings.results())
+    results["background.dedup"] = {"unit": "count", **dict(utils.dedup_counters)}
+    return results
+
+
+async def bench_retrieve(ctx: Context):
+    from backend.memory.rag_utils import retrieve
+    from backend.memory.llm_utils import LLMUtils
+
+    args = ctx.args
+    timings = Timings()
+    project_name = await ctx.new_project("retrieve", strands=args.strands)
+    llm = LLMUtils(api_key=OPENAI_KEY)
+    for question_count in (1, 3, 5, 10):
+        for label, max_concurrency in (("", None), (".serial", 1)):
+            timings.prefix = f"retrieve.q{question_count}{label}."
+            for i in range(args.iterations):
+                questions = [f"What did the user say about {' '.join(ctx.rng.sample(WORDS, 3))}? ({i}.{n})" for n in range(question_count)]
+                start = time.perf_counter()
+                await retrieve(questions, project_name, llm.embed_batch, max_concurrency=max_concurrency)
+                timings.record("total", time.perf_counter() - start)
+    return timings.results()
+
+
+async def bench_models(ctx: Context):
+    from backend import models
+
+    args = ctx.args
+    results = {}
+    for size in args.model_sizes:
+        project_name = await ctx.new_project("models", chats=size)
+        owner = {"owner_api_key": API_KEY, "project_name": project_name}
+        now = datetime.now()
+        await ctx.mongo["strands_col"].insert_many([{**owner, "content": f"Seeded strand {i}", "timestamp": now} for i in range(size)])
+        operations = {
+            "append_chat_and_get_context": lambda i: models.append_chat_and_get_context(API_KEY, project_name, f"user {i}", f"assistant {i}"),
+            "add_chat": lambda i: models.add_chat(API_KEY, project_name, f"user {i}", f"assistant {i}"),
+            "add_memories": lambda i: models.add_memories(API_KEY, project_name, [f"New strand {i}.{n}" for n in range(10)]),
+            "get_last_three_chats": lambda i: models.get_last_three_chats(API_KEY, project_name),
+            "get_latest_summary": lambda i: models.get_latest_summary(API_KEY, project_name),
+            "get_project": lambda i: models.get_project(API_KEY, project_name),
+            "get_memory_strands": lambda i: models.get_memory_strands(API_KEY, project_name)
+        }
+        for name, operation in operations.items():
+            timings = Timings()
+            timings.prefix = f"models.n{size}."
+            ctx.mongo.reset_counters()
+            for i in range(args.iterations):
+                start = time.perf_counter()
+                await operation(i)
+                timings.record(name, time.perf_counter() - start)
+            stats = ctx.mongo.stats()
+            for key, result in timings.results().items():
+                result["round_trips"] = sum(collection["operations"] for collection in stats.values()) / args.iterations
+                result["docs_returned"] = sum(collection["docs_returned"] for collection in stats.values()) / args.iterations
+                results[key] = result
+    return results
+
+
+BENCHMARKS = {
+    "recall": bench_recall,
+    "background": bench_background,
+    "retrieve": bench_retrieve,
+    "models": bench_models
+}
+
+
+# Latency figures regress when they grow, throughputs when they shrink; counts are informational.
+# min_delta_ms keeps sub-millisecond noise on in-process operations from failing a comparison.
+def compare(results, baseline, threshold: float, min_delta_ms: float):
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or previous.get("unit") != current.get("unit"):
+            continue
+        if current["unit"] == "ms":
+            for field in ("p50", "p95"):
+                delta = current[field] - previous[field]
+                if delta > min_delta_ms and delta > threshold * previous[field]:
+                    regressions.append((name, field, previous[field], current[field]))
+        elif current["unit"].endswith("/s"):
+            if current["value"] < previous["value"] * (1 - threshold):
+                regressions.append((name, "value", previous["value"], current["value"]))
+    return regressions
+
+
+def print_results(results):
+    for name, result in sorted(results.items()):
+        if result["unit"] == "ms":
+            print(f"{name:<60} p50 {result['p50']:9.2f} ms   p95 {result['p95']:9.2f} ms   n={result['n']}")
+        elif "value" in result:
+            print(f"{name:<60} {result['value']:9.2f} {result['unit']}")
+        else:
+            print(f"{name:<60} {json.dumps({k: v for k, v in result.items() if k != 'unit'})}")
+
+
+def configure_environment():
+    # Read by the backend modules at import time, so this runs before any of them are imported
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["LOCAL_VECTOR_STORE_PATH"] = ""
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    # Benchmarks measure the uncached path; cache hit rates depend on real traffic, not on these inputs
+    os.environ["RETRIEVAL_CACHE_TTL_SECONDS"] = "0"
+
+
+async def run(args):
+    from .fakes import FakeOpenAIServer, FakeMongo, LatencyVectorStore
+    from backend.memory.vector_store import LocalVectorStore, set_vector_store
+    from backend.memory.client_pool import openai_client_pool
+
+    ctx = Context(args)
+    ctx.server = FakeOpenAIServer(args.llm_latency_ms, args.embed_latency_ms, args.jitter).start()
+    os.environ["OPENAI_BASE_URL"] = ctx.server.base_url
+    ctx.mongo = FakeMongo(args.mongo_latency_ms, args.jitter).install()
+    set_vector_store(LatencyVectorStore(LocalVectorStore(path=None), args.vector_latency_ms, args.jitter))
+
+    results = {}
+    try:
+        for suite in args.suites:
+            logging.getLogger(__name__).warning(f"Running {suite} benchmarks")
+            start = time.perf_counter()
+            results.update(await BENCHMARKS[suite](ctx))
+            logging.getLogger(__name__).warning(f"Finished {suite} benchmarks in {time.perf_counter() - start:.1f}s")
+    finally:
+        await openai_client_pool.aclose()
+        ctx.server.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline reca11 benchmarks.")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated subset of: {', '.join(SUITES)}.")
+    parser.add_argument("--iterations", type=int, default=20, help="Measured calls per benchmark.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured recalls per mode before timing starts.")
+    parser.add_argument("--strands", type=int, default=2000, help="Memory strands seeded into each project's vector namespace.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Chat pairs per background job, compared against single-pair jobs.")
+    parser.add_argument("--model-sizes", default="100,1000,10000", help="Comma-separated chat/strand counts for the model benchmarks.")
+    parser.add_argument("--llm-latency-ms", type=float, default=250.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=40.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=15.0)
+    parser.add_argument("--mongo-latency-ms", type=float, default=2.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction of each latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as a JSON baseline to this file.")
+    parser.add_argument("--compare", help="Baseline JSON to compare against; exits with status 1 on a regression.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative change that counts as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="Latency increases smaller than this are never regressions.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the backend's INFO logging.")
+    args = parser.parse_args(argv)
+    args.suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(unknown)}")
+    args.model_sizes = [int(size) for size in args.model_sizes.split(",") if size.strip()]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment()
+    if not args.verbose:
+        # The backend modules configure INFO logging when imported, so quieten it once they are loaded
+        import backend.utils  # noqa: F401
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")}
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config
+        },
+        "results": results
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote baseline to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("config") != config:
+            print("Warning: baseline was recorded with a different configuration")
+        regressions = compare(results, baseline["results"], args.threshold, args.min_delta_ms)
+        for name, field, previous, current in regressions:
+            print(f"REGRESSION {name} {field}: {previous:.2f} -> {current:.2f}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
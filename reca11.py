@@ -1,56 +1,540 @@
+import json
+import time
+import atexit
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
 BASE_URL = "https://reca11-memory.onrender.com"
 
-# Wrapper class for the Reca11 API, to be used in SDK
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_FLUSH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 5.0
+# The bulk endpoints allow 30 requests a minute per kind, so batches of one kind are spaced this far apart
+DEFAULT_MIN_SEND_INTERVAL = 2.0
+DEFAULT_MAX_BUFFER = 10000
+DEFAULT_CLOSE_TIMEOUT = 10.0
+
+logger = logging.getLogger(__name__)
+
+# Retried for every request; POSTs that write (project creation, recall) are only retried when the
+# server said it did not process them (429) or no connection was made, so a chat is never stored twice
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_STATUSES_UNSAFE = {429}
+
+
+def _backoff_delay(attempt: int, backoff: float, response=None):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Full jitter keeps many workers that failed together from retrying in lockstep
+    return random.uniform(0, backoff * (2 ** attempt))
+
+
+def _should_retry(status_code: int, idempotent: bool):
+    return status_code in (RETRY_STATUSES if idempotent else RETRY_STATUSES_UNSAFE)
+
+
+def _never_connected(error: requests.ConnectionError):
+    # requests raises ConnectionError both when it could not connect and when the connection broke
+    # after the request was sent; only the first means the server never saw the request.
+    # NewConnectionError (refused, DNS failure) is a ConnectTimeoutError too.
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectTimeout) or isinstance(reason, ConnectTimeoutError)
+
+
+def _recall_payload(client, chat_pair: dict, mode: str, latency_budget_ms: int, **options):
+    return {
+        "api_key": client.api_key,
+        "openai_key": client.openai_key,
+        "project_name": client.project_name,
+        "chat_pair": chat_pair,
+        "mode": mode,
+        "latency_budget_ms": latency_budget_ms,
+        **{name: value for name, value in options.items() if value is not None}
+    }
+
+
+def _context_tokens(response):
+    tokens = response.headers.get("X-Context-Tokens")
+    return int(tokens) if tokens is not None else None
+
+
+def _check_project_response(response):
+    if response.status_code == 400:
+        detail = response.json().get("detail", "")
+        if "already exists" in detail.lower():
+            raise ValueError("Duplicate project name. Please choose a unique name.")
+        raise RuntimeError(f"Project creation failed: {detail}")
+
+    elif response.status_code != 200:
+        raise RuntimeError(f"Unexpected error during project creation: {response.text}")
+
+
+def _check_recall_response(response):
+    if response.status_code == 400:
+        detail = response.json().get("detail", "Bad request.")
+        raise ValueError(f"Recall failed: {detail}")
+    elif response.status_code != 200:
+        raise RuntimeError(f"Unexpected recall failure: {response.status_code} - {response.text}")
+
+
+def _strands_params(client, skip: int, limit: int):
+    params = {"api_key": client.api_key, "project_name": client.project_name, "skip": skip}
+    if limit is not None:
+        params["limit"] = limit
+    return params
+
+
+def _check_strands_response(response):
+    if response.status_code == 404:
+        raise ValueError("Project not found. Please create a project first.")
+    elif response.status_code == 400:
+        raise ValueError(f"Getting strands failed: {response.json().get('detail', 'Bad request.')}")
+    elif response.status_code != 200:
+        raise RuntimeError(f"Unexpected error getting strands: {response.status_code} - {response.text}")
+
+
+def _parse_stream_line(line):
+    event = json.loads(line)
+    if event.get("event") == "error":
+        raise RuntimeError(f"Recall failed mid-stream: {event.get('data')}")
+    return event
+
+
+class _BufferSendError(Exception):
+    pass
+
+
+# Queues chat pairs and memory strands and sends them from a background thread, per kind,
+# once flush_size items are waiting or flush_interval seconds after the oldest one was queued,
+# but never sooner than min_send_interval after the previous batch of that kind.
+# A batch that fails to send goes back to the front of its queue and is retried with backoff,
+# so items are delivered at least once; the queue holds at most max_items, past which new items are dropped.
+class _WriteBuffer:
+    def __init__(self, send_batch, flush_size: int, flush_interval: float, max_items: int, backoff: float,
+                 min_send_interval: float = DEFAULT_MIN_SEND_INTERVAL):
+        self.send_batch = send_batch
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.min_send_interval = min_send_interval
+        self.max_items = max_items
+        self.backoff = backoff
+        self._queues = {"chat": deque(), "strand": deque()}
+        self._last_sent = {kind: float("-inf") for kind in self._queues}
+        self._oldest = None
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closing = False
+        self._condition = threading.Condition()
+        self.sent = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.retries = 0
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="reca11-write-buffer", daemon=True)
+        self._thread.start()
+
+    def _queued(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def add(self, kind: str, item):
+        with self._condition:
+            if self._closing or self._queued() + self._in_flight >= self.max_items:
+                self.dropped += 1
+                logger.warning(f"Reca11 write buffer is {'closed' if self._closing else 'full'}, dropping {kind}")
+                return False
+            self._queues[kind].append(item)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._queues[kind]) >= self.flush_size:
+                self._condition.notify_all()
+            return True
+
+    # When the queued items of a kind may be sent, or None if none are queued
+    def _due_at(self, kind: str):
+        queue = self._queues[kind]
+        if not queue:
+            return None
+        if self._flush_requested or self._closing or len(queue) >= self.flush_size:
+            due = float("-inf")
+        else:
+            due = self._oldest + self.flush_interval
+        return max(due, self._last_sent[kind] + self.min_send_interval)
+
+    def _next_due(self):
+        due = [at for at in map(self._due_at, self._queues) if at is not None]
+        return min(due) if due else None
+
+    def _ready(self):
+        due = self._next_due()
+        return due is not None and due <= time.monotonic()
+
+    def _take_batches(self):
+        batches = []
+        now = time.monotonic()
+        for kind, queue in self._queues.items():
+            due = self._due_at(kind)
+            if due is not None and due <= now:
+                self._last_sent[kind] = now
+                batch = [queue.popleft() for _ in range(min(len(queue), self.flush_size))]
+                batches.append((kind, batch))
+                self._in_flight += len(batch)
+        self._oldest = time.monotonic() if self._queued() else None
+        return batches
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._condition:
+                while not self._ready():
+                    if self._closing:
+                        return
+                    due = self._next_due()
+                    timeout = None if due is None else max(0.0, due - time.monotonic())
+                    self._condition.wait(timeout)
+                batches = self._take_batches()
+
+            for kind, batch in batches:
+                try:
+                    retry = self.send_batch(kind, batch)
+                    failures = 0
+                except Exception as e:
+                    retry = batch
+                    failures += 1
+                    self.last_error = str(e)
+                    logger.warning(f"Reca11 failed to send {len(batch)} buffered {kind} items, will retry: {e}")
+                with self._condition:
+                    self._in_flight -= len(batch)
+                    if retry:
+                        self.retries += len(retry)
+                        self._queues[kind].extendleft(reversed(retry))
+                        if self._oldest is None:
+                            self._oldest = time.monotonic()
+                    self.sent += len(batch) - len(retry)
+                    self._condition.notify_all()
+
+            if failures:
+                with self._condition:
+                    self._condition.wait(_backoff_delay(min(failures - 1, 6), self.backoff))
+
+    # Waits until everything queued so far has been sent; returns False if the timeout passed first
+    def flush(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            try:
+                while self._queued() or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return True
+            finally:
+                self._flush_requested = False
+
+    def close(self, timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        if not flushed:
+            logger.warning(f"Reca11 write buffer closed with {self._queued()} items unsent")
+        self._thread.join(timeout=1.0)
+        return flushed
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queued": self._queued() + self._in_flight,
+                "sent": self.sent,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+                "retries": self.retries,
+                "last_error": self.last_error
+            }
+
+
+# Wrapper class for the Reca11 API, to be used in SDK. Requests share one pooled session,
+# so consecutive calls reuse the same connection; call close() (or use it as a context manager) when done.
+# With buffered=True, add_chat and add_strand only queue their item and return; see _WriteBuffer.
 class Reca11:
-    def __init__(self, api_key: str, openai_key: str, project_name: str):
+    def __init__(self, api_key: str, openai_key: str, project_name: str, base_url: str = BASE_URL,
+                 timeout: float = DEFAULT_TIMEOUT, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF, pool_size: int = DEFAULT_POOL_SIZE,
+                 buffered: bool = False, flush_size: int = DEFAULT_FLUSH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 max_buffer: int = DEFAULT_MAX_BUFFER, min_send_interval: float = DEFAULT_MIN_SEND_INTERVAL):
         self.api_key = api_key
         self.openai_key = openai_key
         self.project_name = project_name
+        self.base_url = base_url
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.last_recall_path = None
+        self.last_context_tokens = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.buffer = None
         self._create_project_or_fail()
+        if buffered:
+            self.buffer = _WriteBuffer(self._send_batch, flush_size, flush_interval, max_buffer, backoff, min_send_interval)
+            atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Sends whatever is still buffered (waiting up to timeout seconds) before closing the connection pool
+    def close(self, timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        if self.buffer is not None:
+            atexit.unregister(self.close)
+            self.buffer.close(timeout)
+        self.session.close()
+
+    def _request(self, method: str, path: str, idempotent: bool = True, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == self.max_retries or not (idempotent or _never_connected(e)):
+                    raise
+                time.sleep(_backoff_delay(attempt, self.backoff))
+                continue
+            if attempt == self.max_retries or not _should_retry(response.status_code, idempotent):
+                return response
+            delay = _backoff_delay(attempt, self.backoff, response)
+            response.close()
+            time.sleep(delay)
 
     def _create_project_or_fail(self):
         payload = {
             "api_key": self.api_key,
             "project_name": self.project_name
         }
-        response = requests.post(f"{BASE_URL}/project/create", json=payload)
+        response = self._request("POST", "/project/create", idempotent=False, json=payload)
+        _check_project_response(response)
 
-        if response.status_code == 400:
-            detail = response.json().get("detail", "")
-            if "already exists" in detail.lower():
-                raise ValueError("Duplicate project name. Please choose a unique name.")
-            raise RuntimeError(f"Project creation failed: {detail}")
+    # mode is "auto", "full" or "fast"; with a latency_budget_ms, "auto" falls back to the fast path
+    # when question generation would not fit. The path taken is kept in last_recall_path.
+    # The context is fitted into token_budget tokens (server default if None), as text or, with
+    # format="json", a dict; the tokens it used are kept in last_context_tokens.
+    def recall(self, chat_pair: dict, mode: str = "auto", latency_budget_ms: int = None,
+               token_budget: int = None, format: str = "text"):
+        payload = _recall_payload(self, chat_pair, mode, latency_budget_ms, token_budget=token_budget, format=format)
+        response = self._request("POST", "/recall", idempotent=False, json=payload)
+        self.last_recall_path = response.headers.get("X-Recall-Path")
+        self.last_context_tokens = _context_tokens(response)
+        _check_recall_response(response)
+        return response.json()
 
-        elif response.status_code != 200:
-            raise RuntimeError(f"Unexpected error during project creation: {response.text}")
+    # Runs several recalls concurrently over the pooled session and returns their contexts in order.
+    # Chat pairs from the same conversation should go through recall() one at a time instead,
+    # since each recall stores its chat pair and the order between concurrent ones is not fixed.
+    def recall_many(self, chat_pairs: list, mode: str = "auto", latency_budget_ms: int = None,
+                    max_concurrency: int = DEFAULT_MAX_CONCURRENCY, token_budget: int = None, format: str = "text"):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, self.pool_size, len(chat_pairs) or 1))) as pool:
+            return list(pool.map(lambda chat_pair: self.recall(chat_pair, mode, latency_budget_ms, token_budget, format), chat_pairs))
 
-    def recall(self, chat_pair: dict):
+    # Yields {"event", "data"} sections as they become ready: recent_chats, summary, facts (one or more), done
+    def recall_stream(self, chat_pair: dict, mode: str = "auto", latency_budget_ms: int = None):
+        payload = _recall_payload(self, chat_pair, mode, latency_budget_ms)
+        with self._request("POST", "/recall/stream", idempotent=False, json=payload, stream=True) as response:
+            _check_recall_response(response)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                yield _parse_stream_line(line)
+
+    # Returns one page of strands; while "truncated" is true, pass "next_skip" as skip for the next (older) page
+    def get_strands(self, skip: int = 0, limit: int = None):
+        response = self._request("GET", "/memory/all", params=_strands_params(self, skip, limit))
+        _check_strands_response(response)
+        return response.json()
+
+    def add_chat(self, user_message: str, assistant_message: str):
+        if self.buffer is not None:
+            return self.buffer.add("chat", {"user_message": user_message, "assistant_message": assistant_message})
         payload = {
             "api_key": self.api_key,
-            "openai_key": self.openai_key,
             "project_name": self.project_name,
-            "chat_pair": chat_pair
+            "user_message": user_message,
+            "assistant_message": assistant_message
         }
-        response = requests.post(f"{BASE_URL}/recall", json=payload)
+        response = self._request("POST", "/chat/add", idempotent=False, json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected error adding chat: {response.status_code} - {response.text}")
+        return True
 
-        if response.status_code == 400:
-            detail = response.json().get("detail", "Bad request.")
-            raise ValueError(f"Recall failed: {detail}")
-        elif response.status_code != 200:
-            raise RuntimeError(f"Unexpected recall failure: {response.status_code} - {response.text}")
+    def add_strand(self, memory_strand: str):
+        if self.buffer is not None:
+            return self.buffer.add("strand", {"memory_strand": memory_strand})
+        payload = {
+            "api_key": self.api_key,
+            "project_name": self.project_name,
+            "memory_strand": memory_strand
+        }
+        response = self._request("POST", "/memory/add", idempotent=False, json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected error adding memory strand: {response.status_code} - {response.text}")
+        return True
 
-        return response.json()
-    
-    def get_strands(self):
-        params = {
+    # Blocks until everything buffered so far has been sent; returns False if timeout passed first
+    def flush(self, timeout: float = None):
+        return self.buffer.flush(timeout) if self.buffer is not None else True
+
+    def buffer_stats(self):
+        return self.buffer.stats() if self.buffer is not None else None
+
+    # Posts one buffered batch to the bulk endpoint for its kind and returns the items to retry.
+    # Rows the server rejected as invalid are dropped; rows whose batch write failed are retried.
+    def _send_batch(self, kind: str, items: list):
+        path = "/chat/bulk" if kind == "chat" else "/memory/bulk"
+        params = {"api_key": self.api_key, "project_name": self.project_name}
+        body = "".join(json.dumps(item) + "\n" for item in items).encode()
+        response = self._request("POST", path, idempotent=False, params=params, data=body,
+                                 headers={"Content-Type": "application/x-ndjson"})
+        if response.status_code in (400, 404):
+            self.buffer.rejected += len(items)
+            self.buffer.last_error = response.text
+            logger.error(f"Reca11 dropped {len(items)} buffered {kind} items: {response.status_code} - {response.text}")
+            return []
+        if response.status_code != 200:
+            raise _BufferSendError(f"{response.status_code} - {response.text}")
+
+        report = response.json()
+        retry_lines = {error["line"] for error in report.get("errors", []) if error["error"].startswith("Batch write failed")}
+        self.buffer.rejected += report.get("failed", 0) - len(retry_lines)
+        return [item for line, item in enumerate(items, start=1) if line in retry_lines]
+
+
+# asyncio counterpart of Reca11 for recall and reading strands, with those methods as coroutines;
+# writing chats and strands (add_chat, add_strand and buffered logging) is only on Reca11. Create it with
+# `await AsyncReca11.create(...)` or `async with AsyncReca11(...) as rc:`, either of which creates the project.
+class AsyncReca11:
+    def __init__(self, api_key: str, openai_key: str, project_name: str, base_url: str = BASE_URL,
+                 timeout: float = DEFAULT_TIMEOUT, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff: float = DEFAULT_BACKOFF, pool_size: int = DEFAULT_POOL_SIZE):
+        self.api_key = api_key
+        self.openai_key = openai_key
+        self.project_name = project_name
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.last_recall_path = None
+        self.last_context_tokens = None
+        self._project_ready = False
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        client = cls(*args, **kwargs)
+        try:
+            await client._create_project_or_fail()
+        except Exception:
+            await client.aclose()
+            raise
+        return client
+
+    async def __aenter__(self):
+        if not self._project_ready:
+            try:
+                await self._create_project_or_fail()
+            except Exception:
+                await self.aclose()
+                raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _send(self, method: str, path: str, idempotent: bool = True, stream: bool = False, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            request = self.client.build_request(method, path, **kwargs)
+            try:
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries or not (idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))):
+                    raise
+                await asyncio.sleep(_backoff_delay(attempt, self.backoff))
+                continue
+            if attempt == self.max_retries or not _should_retry(response.status_code, idempotent):
+                return response
+            delay = _backoff_delay(attempt, self.backoff, response)
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def _create_project_or_fail(self):
+        payload = {
             "api_key": self.api_key,
             "project_name": self.project_name
         }
-        response = requests.get(f"{BASE_URL}/memory/all", params=params)
+        response = await self._send("POST", "/project/create", idempotent=False, json=payload)
+        _check_project_response(response)
+        self._project_ready = True
+
+    async def recall(self, chat_pair: dict, mode: str = "auto", latency_budget_ms: int = None,
+                     token_budget: int = None, format: str = "text"):
+        payload = _recall_payload(self, chat_pair, mode, latency_budget_ms, token_budget=token_budget, format=format)
+        response = await self._send("POST", "/recall", idempotent=False, json=payload)
+        self.last_recall_path = response.headers.get("X-Recall-Path")
+        self.last_context_tokens = _context_tokens(response)
+        _check_recall_response(response)
+        return response.json()
+
+    async def recall_many(self, chat_pairs: list, mode: str = "auto", latency_budget_ms: int = None,
+                          max_concurrency: int = DEFAULT_MAX_CONCURRENCY, token_budget: int = None, format: str = "text"):
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
 
-        if response.status_code == 404:
-            raise ValueError("Project not found. Please create a project first.")
-        elif response.status_code != 200:
-            raise RuntimeError(f"Unexpected error getting strands: {response.status_code} - {response.text}")
-        return response.json()
\ No newline at end of file
+        async def bounded(chat_pair):
+            async with semaphore:
+                return await self.recall(chat_pair, mode, latency_budget_ms, token_budget, format)
+
+        return await asyncio.gather(*(bounded(chat_pair) for chat_pair in chat_pairs))
+
+    async def recall_stream(self, chat_pair: dict, mode: str = "auto", latency_budget_ms: int = None):
+        payload = _recall_payload(self, chat_pair, mode, latency_budget_ms)
+        response = await self._send("POST", "/recall/stream", idempotent=False, stream=True, json=payload)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+            _check_recall_response(response)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                yield _parse_stream_line(line)
+        finally:
+            await response.aclose()
+
+    async def get_strands(self, skip: int = 0, limit: int = None):
+        response = await self._send("GET", "/memory/all", params=_strands_params(self, skip, limit))
+        _check_strands_response(response)
+        return response.json()